@@ -0,0 +1,312 @@
+# coding=utf-8
+"""
+
+Benchmarks of the HaloPy hot paths, run against a local stub server:
+
+* ``limiter``: token acquisition rate of the limiters, alone and contended
+* ``session``: latency of a pooled HaloPy request against a standalone
+  ``requests.get`` per call
+* ``throughput``: requests per second achieved under the rate limiter
+* ``cache``: latency of cache hits and misses for each cache backend, and
+  with instrumentation enabled
+* ``result``: HaloPyResult construction and attribute access on real-size
+  match payloads, with the memory they retain
+* ``history``: end-to-end time to page a player's history and hydrate every
+  match
+
+Results are written as JSON, to compare runs across releases.
+
+Usage::
+
+    python benchmarks/run.py [-o results.json] [--quick] [benchmark ...]
+
+"""
+from __future__ import unicode_literals, print_function, division
+
+import argparse
+import itertools
+import json
+import os
+import platform
+import shutil
+import sys
+import tempfile
+import threading
+import time
+
+import requests
+
+# Benchmark the checkout the script belongs to, not an installed halopy
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import halopy
+
+from halopy import (HaloPy, HaloPyResult, Metrics, PriorityScheduler, SQLiteCache, TokenBucket,
+                    json_loads)
+from halopy.stub import StubServer
+
+try:
+    from urllib.parse import parse_qs, urlsplit
+except ImportError:  # Python 2
+    from urlparse import parse_qs, urlsplit
+
+try:
+    import tracemalloc
+except ImportError:  # Python 2
+    tracemalloc = None
+
+timer = getattr(time, 'perf_counter', time.time)
+
+WEAPONS = [{'id': str(x), 'name': 'Weapon {0}'.format(x)} for x in range(50)]
+
+
+def make_match(players=24, weapons=12, medals=20):
+    """Synthetic arena match roughly the size of a real one"""
+    def player(n):
+        return {
+            'Player': {'Gamertag': 'player{0}'.format(n), 'Xuid': None},
+            'TeamId': n % 2, 'Rank': n + 1, 'DNF': False, 'AvgLifeTimeOfPlayer': 'PT35.5S',
+            'TotalKills': n, 'TotalDeaths': 10, 'TotalAssists': 3, 'TotalHeadshots': 4,
+            'TotalWeaponDamage': 1234.5, 'TotalShotsFired': 300, 'TotalShotsLanded': 120,
+            'TotalMeleeKills': 1, 'TotalGrenadeKills': 2, 'TotalPowerWeaponKills': 1,
+            'WeaponStats': [{
+                'WeaponId': {'StockId': 1000 + w, 'Attachments': []},
+                'TotalShotsFired': 30, 'TotalShotsLanded': 12, 'TotalHeadshots': 1,
+                'TotalKills': 2, 'TotalDamageDealt': 150.5, 'TotalPossessionTime': 'PT1M2S',
+            } for w in range(weapons)],
+            'MedalAwards': [{'MedalId': 2000 + m, 'Count': m % 3 + 1} for m in range(medals)],
+            'DestroyedEnemyVehicles': [], 'EnemyKills': [], 'Impulses': [],
+        }
+    return {
+        'Id': {'MatchId': 'abc', 'GameMode': 1}, 'IsTeamGame': True, 'IsMatchOver': True,
+        'MapId': 'c74c9d0f-f206-11e4-8330-24be05e24f7e', 'TotalDuration': 'PT12M4S',
+        'PlayerStats': [player(n) for n in range(players)],
+        'TeamStats': [{'TeamId': t, 'Score': 50, 'Rank': t + 1} for t in range(2)],
+    }
+
+
+def latency(fn, n):
+    """Latency statistics in milliseconds of ``n`` sequential calls"""
+    samples = []
+    for x in range(n):
+        start = timer()
+        fn(x)
+        samples.append(timer() - start)
+    samples.sort()
+    return {
+        'n': n,
+        'mean_ms': sum(samples) / n * 1000,
+        'p50_ms': samples[n // 2] * 1000,
+        'p99_ms': samples[min(int(n * 0.99), n - 1)] * 1000,
+    }
+
+
+def rate(fn, n, threads=1):
+    """Calls per second of ``n`` calls spread over ``threads`` threads"""
+    def run():
+        for x in range(n // threads):
+            fn()
+    workers = [threading.Thread(target=run) for x in range(threads)]
+    start = timer()
+    for worker in workers:
+        worker.start()
+    for worker in workers:
+        worker.join()
+    elapsed = timer() - start
+    return {'n': n // threads * threads, 'threads': threads, 'seconds': elapsed,
+            'per_second': n // threads * threads / elapsed}
+
+
+def client(server, **kwargs):
+    options = {'cache': 0, 'cache_backend': 'memory', 'rate': (10 ** 9, 1)}
+    options.update(kwargs)
+    return HaloPy('key', base_url=server.url, **options)
+
+
+def bench_limiter(server, n):
+    results = {}
+    for name, limiter in (('token_bucket', TokenBucket((10 ** 9, 1))),
+                          ('priority_scheduler', PriorityScheduler(TokenBucket((10 ** 9, 1))))):
+        for threads in (1, 8):
+            results['{0}_{1}_threads'.format(name, threads)] = rate(
+                limiter.acquire, n * 20, threads)
+    return results
+
+
+def bench_session(server, n):
+    api = client(server)
+    url = server.url + 'metadata/h5/metadata/weapons'
+    results = {
+        'requests_get': latency(
+            lambda x: requests.get(url, headers={'Ocp-Apim-Subscription-Key': 'key'}), n),
+        'halopy_session': latency(lambda x: api.request('metadata/h5/metadata/weapons'), n),
+    }
+    api.close()
+    return results
+
+
+def bench_throughput(server, n):
+    results = {}
+    for limit in (100, 400):
+        api = client(server, rate=(limit // 10, 0.1), rate_timeout=None)
+        api.limiter.reset(0)
+        # Distinct requests, identical concurrent ones would be coalesced
+        counter = itertools.count(1)
+        result = rate(lambda: api.request('metadata/h5/metadata/weapons',
+                                          {'n': next(counter)}), n, 8)
+        result['limit_per_second'] = limit
+        results['limit_{0}'.format(limit)] = result
+        api.close()
+    return results
+
+
+def bench_cache(server, n):
+    results = {}
+    directory = tempfile.mkdtemp()
+    try:
+        backends = (
+            ('memory', {'cache_backend': 'memory'}),
+            ('sqlite', {'cache_backend': 'sqlite',
+                        'cache_name': os.path.join(directory, 'tiered')}),
+            ('sqlite_disk_only', {'cache_backend': SQLiteCache(
+                os.path.join(directory, 'disk.sqlite'), fast_save=True)}),
+            ('memory_instrumented', {'cache_backend': 'memory', 'instrument': Metrics()}),
+        )
+        for name, options in backends:
+            api = client(server, cache=300, **options)
+            endpoint = 'metadata/h5/metadata/weapons'
+            results[name] = {
+                'miss': latency(lambda x: api.request(endpoint, {'n': x + 1}), n),
+                'hit': latency(lambda x: api.request(endpoint, {'n': x % 10 + 1}), n * 5),
+            }
+            api.close()
+    finally:
+        shutil.rmtree(directory)
+    return results
+
+
+def measure(fn, bodies):
+    if tracemalloc is not None:
+        tracemalloc.start()
+    start = timer()
+    results = [fn(body) for body in bodies]
+    elapsed = timer() - start
+    retained = None
+    if tracemalloc is not None:
+        retained = tracemalloc.get_traced_memory()[0]
+        tracemalloc.stop()
+    del results
+    return {'n': len(bodies), 'us_per_result': elapsed / len(bodies) * 10 ** 6,
+            'retained_bytes': retained}
+
+
+def bench_result(server, n):
+    bodies = [json.dumps(make_match()).encode('utf-8') for x in range(n)]
+
+    def read_one(body):
+        result = HaloPyResult(raw=body)
+        result.IsMatchOver
+        return result
+
+    def read_all(body):
+        result = HaloPyResult(raw=body)
+        for player in result.PlayerStats:
+            player['TotalKills']
+        return result
+
+    results = {
+        'payload_bytes': len(bodies[0]),
+        'eager_stdlib_json': measure(lambda body: HaloPyResult(json.loads(body)), bodies),
+        'eager': measure(lambda body: HaloPyResult(json_loads(body)), bodies),
+        'lazy_untouched': measure(lambda body: HaloPyResult(raw=body), bodies),
+        'lazy_one_field': measure(read_one, bodies),
+        'lazy_every_player': measure(read_all, bodies),
+    }
+    result = HaloPyResult(json_loads(bodies[0]))
+    results['attribute_access'] = rate(lambda: result.IsMatchOver, n * 100)
+    return results
+
+
+def bench_history(server, n):
+    modes = {1: 'arena', 2: 'campaign', 3: 'custom', 4: 'warzone'}
+    match = json.dumps(make_match()).encode('utf-8')
+
+    def matches(handler):
+        query = parse_qs(urlsplit(handler.path).query)
+        start, count = int(query.get('start', ['0'])[0]), int(query.get('count', ['25'])[0])
+        return 200, {}, {'Results': [{
+            'Id': {'MatchId': 'm{0}'.format(x), 'GameMode': x % 4 + 1},
+            'MatchCompletedDate': {'ISO8601Date': '2016-01-01T00:00:00Z'},
+        } for x in range(start, min(start + count, n))]}
+
+    server.routes['stats/h5/players/bench/matches'] = matches
+    for x in range(n):
+        server.routes['stats/h5/{0}/matches/m{1}'.format(modes[x % 4 + 1], x)] = match
+    server.latency = 0.002
+
+    results = {'matches': n, 'latency_ms': server.latency * 1000}
+    for workers in (1, 4, 16):
+        api = client(server, rate_timeout=None)
+        start = timer()
+        details = list(api.hydrate_matches(api.iter_player_matches('bench'), workers))
+        elapsed = timer() - start
+        assert len(details) == n
+        results['workers_{0}'.format(workers)] = {'seconds': elapsed,
+                                                  'matches_per_second': n / elapsed}
+        api.close()
+    server.latency = 0.0
+    return results
+
+
+BENCHMARKS = [
+    ('limiter', bench_limiter),
+    ('session', bench_session),
+    ('throughput', bench_throughput),
+    ('cache', bench_cache),
+    ('result', bench_result),
+    ('history', bench_history),
+]
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description='Benchmark the HaloPy hot paths.')
+    parser.add_argument('benchmarks', nargs='*', metavar='benchmark',
+                        help='benchmarks to run, all by default: {0}'.format(
+                            ', '.join(name for name, _ in BENCHMARKS)))
+    parser.add_argument('-o', '--output', help='JSON file to write, stdout by default')
+    parser.add_argument('--quick', action='store_true', help='fewer iterations, for smoke runs')
+    args = parser.parse_args(argv)
+    unknown = set(args.benchmarks) - set(name for name, _ in BENCHMARKS)
+    if unknown:
+        parser.error('unknown benchmark: {0}'.format(', '.join(sorted(unknown))))
+
+    n = 50 if args.quick else 500
+    report = {
+        'halopy': halopy.__version__,
+        'python': platform.python_version(),
+        'implementation': platform.python_implementation(),
+        'platform': platform.platform(),
+        'decoder': '{0}.{1}'.format(json_loads.__module__, json_loads.__name__),
+        'timestamp': time.time(),
+        'quick': args.quick,
+        'results': {},
+    }
+    with StubServer() as server:
+        server.routes['metadata/h5/metadata/weapons'] = WEAPONS
+        for name, bench in BENCHMARKS:
+            if args.benchmarks and name not in args.benchmarks:
+                continue
+            print('running {0}'.format(name), file=sys.stderr)
+            report['results'][name] = bench(server, n)
+
+    output = json.dumps(report, indent=2, sort_keys=True)
+    if args.output:
+        with open(args.output, 'w') as f:
+            f.write(output + '\n')
+    else:
+        print(output)
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -6,12 +6,44 @@ Licensed under the Eiffel Forum License 2
 """
 from __future__ import unicode_literals, absolute_import, print_function, division
 
+import re
 import requests
-import requests_cache
+import sys
+import threading
 import time
 
+from requests.adapters import HTTPAdapter
+from requests.structures import CaseInsensitiveDict
+from requests.utils import get_encoding_from_headers
+
+try:
+    from urllib.parse import urlencode
+except ImportError:  # Python 2
+    from urllib import urlencode
+
+try:
+    from orjson import loads as json_loads
+except ImportError:
+    try:
+        from ujson import loads as json_loads
+    except ImportError:
+        from json import loads as json_loads
+
+from halopy.cache import Cache, CacheEntry, MemoryCache, SQLiteCache, TieredCache, create_cache
+
+from halopy.history import MatchHistory, WatermarkStore, sync_player_matches
+from halopy.images import ImageStore, StoredImage
+from halopy.instrument import Instrument, Metrics, StatsD, endpoint_name, timer
+from halopy.keys import ApiKey, KeyPool
+from halopy import scheduler
+from halopy.pool import SingleFlight, imap
+from halopy.ratelimit import AdaptiveThrottle, RateLimiter, TokenBucket, monotonic
+from halopy.scheduler import PriorityScheduler
+
 __version__ = '1.1'
 
+_decode_lock = threading.Lock()
+
 
 class HaloPyError(Exception):
     """Standard HaloPy exception class"""
@@ -21,18 +53,51 @@ class HaloPyError(Exception):
 class HaloPyResult(object):
     """Wrapper object for results from the Halo API
 
+    A result may be created from the raw JSON body of a response instead of
+    a dictionary, in which case the body is only decoded the first time an
+    attribute is accessed. Decoding uses ``orjson`` or ``ujson`` when one is
+    installed, falling back to the standard library.
+
     Args:
-        wrap (dict): Dictionary to wrap
+        wrap (Optional[dict]): Dictionary to wrap
+        raw (Optional[bytes]): JSON document to wrap instead of ``wrap``
     """
 
-    def __init__(self, wrap):
-        self._wrap = wrap
+    def __init__(self, wrap=None, raw=None):
+        if raw is None:
+            self._wrap = wrap
+        else:
+            self._raw = raw
+
+    @classmethod
+    def from_response(cls, response):
+        """Wrap the body of a response without decoding it yet.
+
+        Args:
+            response (Response): Requests Response object
+
+        Returns:
+            HaloPyResult: The lazily decoded result
+        """
+        return cls(raw=response.content)
 
     def __getattr__(self, name):
-        if name in self._wrap:
-            return self._wrap[name]
-        elif 'Result' in self._wrap and name in self._wrap['Result']:
-            return self._wrap['Result'][name]
+        if name == '_wrap':
+            # Results are shared between threads, e.g. by coalesced requests
+            with _decode_lock:
+                if '_wrap' not in self.__dict__:
+                    if '_raw' not in self.__dict__:
+                        raise AttributeError(name)
+                    self._wrap = json_loads(self._raw)
+                    del self._raw
+            return self.__dict__['_wrap']
+        if name.startswith('__'):
+            return object.__getattribute__(self, name)
+        wrap = self._wrap
+        if name in wrap:
+            return wrap[name]
+        elif 'Result' in wrap and name in wrap['Result']:
+            return wrap['Result'][name]
         else:
             return object.__getattribute__(self, name)
 
@@ -41,64 +106,263 @@ class HaloPy(object):
     """Primary abstraction class for HaloPy
 
     Args:
-        api_key          (str): Halo API key.
+        api_key (str|list|KeyPool): Halo API key. Several keys, or a
+            :class:`~halopy.keys.KeyPool`, spread the requests over the keys
+            with ``rate`` applying to each key.
         title (Optional[str])): Game title, presumably for forward
             compatibility.
-        cache  (Optional[int]): Seconds to cache API results, 0 indicates no
-            cache.
-        cache_backend (Optional[obj]): ``requests-cache`` supported backend. If
-            unspecified, HaloPy will automatically generate a cache.sqlite file
-            in the current working directory.
+        cache  (Optional[int|dict]): Seconds to cache API results, 0
+            indicates no cache and None caches forever. May also be a dict
+            setting the time per endpoint family, see :attr:`cache`.
+        cache_backend (Optional[str|Cache]): ``memory`` for an in-memory LRU
+            cache, ``sqlite`` for an in-memory LRU cache in front of a
+            cache.sqlite file in the current working directory, or a
+            :class:`~halopy.cache.Cache` instance. Default is ``sqlite``.
         rate (Optional[tuple]): Maximum rate limit in form ``(req, sec)``
-        **backend_options: Options to pass to the requests-cache backend
+        rate_limiter (Optional[RateLimiter]): Limiter to draw request tokens
+            from, share one between clients to share a budget. If
+            unspecified, a :class:`~halopy.ratelimit.TokenBucket` for
+            ``rate`` is created. Only used with a single key, give the keys
+            of a :class:`~halopy.keys.KeyPool` their own limiters instead.
+        rate_timeout (Optional[float]): Seconds to wait for the rate limiter
+            before giving up with a rate limit error. 0 (default) fails
+            immediately, None waits indefinitely. Retries of throttled
+            requests wait within the same timeout.
+        throttle_retries (Optional[int]): Times to retry a request the server
+            throttled with a 429, backing off as the server asks plus jitter.
+            Default is 3.
+        pool_connections (Optional[int]): Number of connection pools to keep
+            in the HTTP session. Default is 10.
+        pool_maxsize (Optional[int]): Maximum number of connections to keep
+            open per host. Default is 10.
+        max_retries (Optional[int|Retry]): Retry policy for failed
+            connections, either a count or a ``urllib3`` ``Retry`` object.
+            Default is 0, no retries.
+        keep_alive (Optional[bool]): Reuse connections between requests.
+            Default is True.
+        base_url (Optional[str]): Root URL of the Halo API, every endpoint is
+            appended to it.
+        instrument (Optional[Instrument]): Told the duration of each phase
+            of a request and the cache and error events, see
+            :mod:`halopy.instrument`. None (default) disables
+            instrumentation.
+        image_store (Optional[ImageStore]): Store to keep player emblems and
+            spartan images in, instead of the response cache, see
+            :class:`~halopy.images.ImageStore`.
+        **backend_options: Options to pass to the cache backend, see
+            :func:`halopy.cache.create_cache`
+
+    HaloPy owns a pooled HTTP session, call :meth:`close` when you are done
+    with it or use it as a context manager::
+
+        with HaloPy(api_key) as api:
+            api.get_weapons()
     """
 
-    def _now(self):
-        return round(time.time())
+    base_url = 'https://www.haloapi.com/'
 
-    def __init__(self, api_key, title='h5', cache=300, cache_backend='sqlite', rate=(10, 10), **backend_options):
-        self._api_key = api_key
-        self.title = title
-        self._cache = cache
-        self._rate = rate
-        self._cache_backend = cache_backend
+    #: Endpoint families the cache time may be set for individually
+    cache_families = ('metadata', 'profile', 'stats', 'match')
 
-        backend_options['fast_save'] = backend_options.get('fast_save', True)
+    _match_endpoint = re.compile(r'^stats/[^/]+/(arena|campaign|custom|warzone)/matches/[^/]+$')
 
-        self._backend_options = backend_options
+    #: Maximum number of players the service record endpoints accept at once
+    max_service_record_players = 32
 
-        requests_cache.install_cache(backend=self._cache_backend,
-            expire_after=self.cache, **backend_options)
+    #: Match summary ``GameMode`` values and the endpoints of their details
+    game_modes = {1: 'arena', 2: 'campaign', 3: 'custom', 4: 'warzone'}
 
-        self._allowance = rate[0]
-        self._last_check = self._now()
+    def __init__(self, api_key, title='h5', cache=300, cache_backend='sqlite', rate=(10, 10),
+                 rate_limiter=None, rate_timeout=0, throttle_retries=3, pool_connections=10,
+                 pool_maxsize=10, max_retries=0, keep_alive=True, base_url=None, instrument=None,
+                 image_store=None, **backend_options):
+        if isinstance(api_key, KeyPool):
+            self._keys = api_key
+        elif isinstance(api_key, (list, tuple)):
+            self._keys = KeyPool(api_key, rate)
+        else:
+            self._keys = KeyPool([(api_key, rate_limiter or TokenBucket(rate))])
+        self.title = title
+        self.cache = cache
+        self._limiter = self._keys.keys[0].limiter
+        self.rate_timeout = rate_timeout
+        self._local = threading.local()
+        self._throttle = self._keys.keys[0].throttle
+        self.throttle_retries = throttle_retries
+        if base_url is not None:
+            self.base_url = base_url
+        self.instrument = instrument
+        self.image_store = image_store
+
+        if cache_backend == 'sqlite':
+            backend_options.setdefault('fast_save', True)
+
+        self._response_cache = create_cache(cache_backend, **backend_options)
+        self._stats = {'hits': 0, 'misses': 0, 'revalidated': 0, 'bytes_saved': 0}
+        self._stats_lock = threading.Lock()
+        self._flights = SingleFlight()
+
+        self._pool_connections = pool_connections
+        self._pool_maxsize = pool_maxsize
+        self._max_retries = max_retries
+        self._keep_alive = keep_alive
+        self._session = self._new_session()
+
+    def _new_session(self):
+        session = requests.Session()
+        adapter = HTTPAdapter(pool_connections=self._pool_connections,
+            pool_maxsize=self._pool_maxsize, max_retries=self._max_retries)
+        session.mount('https://', adapter)
+        session.mount('http://', adapter)
+        if not self._keep_alive:
+            session.headers['Connection'] = 'close'
+        return session
+
+    def close(self):
+        """Close the HTTP session, release pooled connections and close the
+        cache."""
+        self._session.close()
+        self._response_cache.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        self.close()
 
     @property
     def api_key(self):
-        """str: Halo API key."""
-        return self._api_key
+        """str: Halo API key, the first one of :attr:`keys`."""
+        return self._keys.keys[0].key
+
+    @property
+    def keys(self):
+        """KeyPool: Subscription keys requests are spread over, see
+        :meth:`~halopy.keys.KeyPool.stats` for their usage."""
+        return self._keys
 
     @property
     def cache(self):
-        """int: Seconds to cache API results, 0 indicates no cache."""
+        """int|dict: Seconds to cache API results, 0 indicates no cache and
+        None caches forever.
+
+        A dict sets the time per endpoint family: ``metadata``, ``profile``,
+        ``stats`` and ``match`` (details of a finished match, which never
+        change). Families not listed use the ``default`` key, or 300 seconds.
+        For example::
+
+            api.cache = {'metadata': 86400, 'match': None, 'stats': 60}
+        """
         return self._cache
 
     @cache.setter
     def cache(self, value):
+        if isinstance(value, dict):
+            for family in value:
+                if family != 'default' and family not in self.cache_families:
+                    raise ValueError('Unknown endpoint family {0!r}'.format(family))
         self._cache = value
-        requests_cache.install_cache(backend=self._cache_backend,
-            expire_after=self.cache, **self._backend_options)
+
+    def cache_ttl(self, family=None):
+        """Seconds responses of an endpoint family are cached for.
+
+        Args:
+            family (Optional[str]): One of :attr:`cache_families`, None for
+                requests that don't belong to a family.
+
+        Returns:
+            int: Seconds to cache, 0 for no cache and None for forever
+        """
+        if not isinstance(self._cache, dict):
+            return self._cache
+        return self._cache.get(family, self._cache.get('default', 300))
+
+    @property
+    def response_cache(self):
+        """Cache: Cache API responses are stored in."""
+        return self._response_cache
+
+    @property
+    def cache_stats(self):
+        """dict: Cache counters since the client was created
+
+        ``hits`` responses were served from the cache, ``misses`` were
+        downloaded and ``revalidated`` were refreshed by a ``304 Not
+        Modified`` without downloading the body. ``bytes_saved`` is the size
+        of the bodies hits and revalidations did not have to download.
+        """
+        with self._stats_lock:
+            return dict(self._stats)
+
+    _events = {'hits': 'cache_hit', 'misses': 'cache_miss', 'revalidated': 'revalidated'}
+
+    def _count(self, counter, saved=0, label=None):
+        with self._stats_lock:
+            self._stats[counter] += 1
+            self._stats['bytes_saved'] += saved
+        if label is not None:
+            self.instrument.count(self._events[counter], label)
 
     @property
     def rate(self):
-        """tuple: Maximum rate limit in form ``(req, sec)``"""
-        return self._rate
+        """tuple: Maximum rate limit in form ``(req, sec)``
+
+        The rate actually used may be lower for a while after the server
+        throttled us, see :class:`~halopy.ratelimit.AdaptiveThrottle`.
+        """
+        return self._throttle.rate
 
     @rate.setter
     def rate(self, value):
         if type(value) is not tuple:
             raise ValueError('HaloPy.rate must be a tuple!')
-        self._rate = value
+        self._keys.rate = value
+
+    @property
+    def limiter(self):
+        """RateLimiter: Limiter request tokens are drawn from, the one of the
+        first key if there are several."""
+        return self._limiter
+
+    def _waiting(self, fn, timeout=None):
+        """Wrap ``fn`` so requests it makes wait ``timeout`` seconds for the
+        rate limiter instead of :attr:`rate_timeout`. Used by the bulk
+        helpers, whose worker threads should queue for the budget. The
+        wrapper also carries the caller's :meth:`priority` over to them."""
+        context = scheduler.current()
+
+        def wrapper(*args, **kwargs):
+            previous = getattr(self._local, 'rate_timeout', self.rate_timeout)
+            self._local.rate_timeout = timeout
+            try:
+                with scheduler.priority(*context):
+                    return fn(*args, **kwargs)
+            finally:
+                self._local.rate_timeout = previous
+        return wrapper
+
+    def priority(self, level, tenant=None):
+        """Context manager setting the priority of the requests made by the
+        current thread, including those of the bulk helpers it calls.
+
+        Only has an effect if :attr:`limiter` is a
+        :class:`~halopy.scheduler.PriorityScheduler`, which serves queued
+        requests by priority class, and by tenant within a class. With several
+        keys, the :attr:`keys` pool must be created with ``priority=True``
+        instead, as a pool spreads tokens over the keys without waiting on
+        their limiters. Since a high priority request only waits for the next
+        token, interactive callers may set a short :attr:`rate_timeout`
+        instead of failing immediately when the budget is in use::
+
+            with api.priority('interactive', tenant=user_id):
+                api.get_player_service_record(gamertag)
+
+        Args:
+            level (str|int): ``interactive``, ``default`` or ``background``,
+                or a number, lower numbers being served first.
+            tenant (Optional[hashable]): Tenant the requests are made for
+        """
+        return scheduler.priority(level, tenant)
 
     _err_400 = 'Bad request'
     _err_401 = 'Unauthorized'
@@ -106,16 +370,6 @@ class HaloPy(object):
     _err_429 = 'Rate limit exceeded'
     _err_500 = 'Internal server error'
 
-    def _pre_request(self):
-        current = self._now()
-        time_passed = current - self._last_check
-        self._last_check = current
-        allowance = self._allowance
-        allowance += time_passed * (self.rate[0] / self.rate[1])
-        if allowance > self.rate[0]:
-            allowance = self.rate[0]
-        return allowance
-
     def can_request(self):
         """Check if we should be within our rate limits.
 
@@ -125,26 +379,40 @@ class HaloPy(object):
         Returns:
             bool: True if we are within the limit, False otherwise.
         """
-        allowance = self._pre_request()
-        if allowance >= 1.0:
-            return True
-        return False
+        return any(key.limiter.available() >= 1.0 for key in self._keys.active())
 
-    def request(self, endpoint, params={}, headers={}):
+    def request(self, endpoint, params={}, headers={}, family=None):
         """Sends request to the Halo API servers.
 
         API key header will automatically be attached if it't not already
-        specified. Endpoint will be prefixed with ``https://www.haloapi.com/``
-        before the request is executed.
-
-        Retrieved values will be cached via cache method specified when
-        initializing HaloPy. If the value is from the cache, we the request
-        will not count towards our rate limit bucket.
+        specified. Endpoint will be prefixed with :attr:`base_url`
+        (``https://www.haloapi.com/`` by default) before the request is
+        executed. Requests are sent over the instance's pooled session.
+
+        Retrieved values will be cached in :attr:`response_cache` for
+        :attr:`cache` seconds. If the value is from the cache, the request
+        will not count towards our rate limit bucket. Expired values are
+        revalidated with ``If-None-Match``/``If-Modified-Since`` when the
+        server sent an ``ETag``/``Last-Modified``, a ``304 Not Modified``
+        refreshes them without downloading the body again. A revalidation
+        still takes a token as the server counts it like any other request.
+
+        Concurrent identical requests are coalesced: the first one is sent
+        and the others wait for and share its response (or error).
+
+        A token is taken from :attr:`limiter` first, waiting up to
+        :attr:`rate_timeout` seconds for one to become available. Requests
+        the server throttles are retried up to :attr:`throttle_retries` times
+        once the limiter has backed off, if that happens within
+        :attr:`rate_timeout`, and the server's rate limit headers are used to
+        tune the limiter.
 
         Args:
             endpoint           (str): The endpoint to send the request to
             params  (Optional[dict]): Dictionary of key, value URL params
             headers (Optional[dict]): Dictionary of key, value request headers
+            family   (Optional[str]): Endpoint family used to pick the cache
+                time, see :attr:`cache`.
 
         Returns:
             Response: Requests Response object.
@@ -153,27 +421,153 @@ class HaloPy(object):
             HaloPyError: If we are over our rate limit, or if an
                 HTTP error occurs.
         """
-        self._allowance = self._pre_request()
-        if not self.can_request():
-            raise HaloPyError(self._err_429)
-
+        if self.instrument is None:
+            return self._request(endpoint, params, headers, family)
+        label = endpoint_name(endpoint)
+        started = timer()
+        try:
+            return self._request(endpoint, params, headers, family, label)
+        finally:
+            self.instrument.timing('request', label, timer() - started)
+
+    def _request(self, endpoint, params, headers, family, label=None):
+        url, p, query = self._prepare(endpoint, params)
+        ttl = self.cache_ttl(family)
+        key = entry = None
+        if ttl != 0:
+            key = '{u}?{q}'.format(u=url, q=query)
+            entry = self._lookup(key, label)
+            if entry is not None and entry.fresh():
+                return self._hit(entry, label)
+
+        # Identical requests already in flight share a single HTTP call
+        flight = (url, query, tuple(sorted(headers.items())))
+        return self._flights.do(flight, self._send, url, p, headers, ttl, key, entry, label)
+
+    def _send(self, url, p, headers, ttl, key, entry, label=None):
+        if key is not None:
+            # A call that just finished may have filled the cache
+            entry = self._response_cache.get(key)
+            if entry is not None and entry.fresh():
+                return self._hit(entry, label)
+        response = self._get(url, p, self._validated(headers, entry), label=label)
+        return self._store(response, ttl, key, entry, label)
+
+    def _prepare(self, endpoint, params):
+        """URL, non-empty params and canonical query string of a request"""
         p = {}
         for k, v in params.items():
             if k not in p and v:
                 p[k] = v
+        url = '{b}{e}'.format(b=self.base_url, e=endpoint)
+        return url, p, urlencode(sorted(p.items()), doseq=True)
+
+    def _lookup(self, key, label=None):
+        if label is None:
+            return self._response_cache.get(key)
+        started = timer()
+        entry = self._response_cache.get(key)
+        self.instrument.timing('cache', label, timer() - started)
+        return entry
+
+    def _hit(self, entry, label=None):
+        self._count('hits', len(entry.content), label)
+        return self._cached_response(entry)
+
+    @staticmethod
+    def _validated(headers, entry):
+        """Request headers, asking the server to only send the body if it
+        changed since ``entry`` if there is one"""
+        headers = dict(headers)
+        if entry is not None:
+            for header, value in entry.validators().items():
+                headers.setdefault(header, value)
+        return headers
+
+    def _store(self, response, ttl, key, entry, label=None):
+        """Cache a response, or refresh ``entry`` from a 304, and raise the
+        error of an unsuccessful one"""
+        expires = None if ttl is None else time.time() + ttl
+        if response.status_code == 304 and entry is not None:
+            entry = entry.revalidated(response.headers, expires)
+            self._response_cache.set(key, entry)
+            self._count('revalidated', len(entry.content), label)
+            return self._cached_response(entry)
+        if key is not None:
+            self._count('misses', 0, label)
+        self._check(response)
+
+        if key is not None and response.status_code == 200:
+            self._response_cache.set(key, CacheEntry(
+                response.url, response.status_code, dict(response.headers),
+                response.content, expires))
+        return response
 
-        if 'Ocp-Apim-Subscription-Key' not in headers:
-            headers['Ocp-Apim-Subscription-Key'] = self.api_key
+    def _acquire(self, blocking=True, timeout=None, label=None):
+        if label is None:
+            return self._keys.acquire(blocking, timeout)
+        started = timer()
+        try:
+            return self._keys.acquire(blocking, timeout)
+        finally:
+            self.instrument.timing('limiter', label, timer() - started)
+
+    def _get(self, url, params, headers, stream=False, label=None):
+        """Send a GET once a key has a token, retrying throttled requests"""
+        timeout = getattr(self._local, 'rate_timeout', self.rate_timeout)
+        # Retries wait for a token within what is left of the same timeout
+        deadline = None if timeout is None else monotonic() + timeout
+        key = self._acquire(timeout != 0, timeout, label)
+        if key is None:
+            raise HaloPyError(self._err_429)
 
-        response = requests.get(
-            'https://www.haloapi.com/{e}'.format(e=endpoint),
-            params=p,
-            headers=headers
-        )
-        if not response.from_cache:
-            # IF the request was not cached, ensure that we are rate limiting
-            self._allowance -= 1.0
+        headers = dict(headers)
+        own_key = 'Ocp-Apim-Subscription-Key' in headers
+
+        attempt = 0
+        while True:
+            if not own_key:
+                headers['Ocp-Apim-Subscription-Key'] = key.key
+            if label is None:
+                response = self._session.get(url, params=params, headers=headers, stream=stream)
+            else:
+                started = timer()
+                response = self._session.get(url, params=params, headers=headers, stream=stream)
+                self.instrument.timing('network', label, timer() - started)
+                if response.status_code == 429:
+                    self.instrument.count('throttled', label)
+                elif response.status_code >= 400:
+                    self.instrument.count('error', label)
+            response.from_cache = False
+            if not own_key and self._keys.record(key, response):
+                # Rejected key, out of rotation now
+                response.close()
+                key = self._reacquire(deadline, label)
+                continue
+            if response.status_code != 429:
+                key.throttle.observe(response)
+                return response
+            key.throttle.throttled(response, attempt)
+            if attempt >= self.throttle_retries:
+                return response
+            response.close()
+            attempt += 1
+            # Wait out the backoff the throttle just applied, unless another
+            # key has tokens
+            key = self._reacquire(deadline, label)
+
+    def _reacquire(self, deadline, label=None):
+        """Take a token for a retry, waiting until ``deadline`` at most"""
+        if deadline is None:
+            return self._acquire(label=label)
+        remaining = deadline - monotonic()
+        key = self._acquire(remaining > 0, max(remaining, 0.0), label)
+        if key is None:
+            raise HaloPyError(self._err_429)
+        return key
 
+    def _check(self, response):
+        """Raise the HaloPyError matching an unsuccessful response"""
         if response.status_code == 400:
             raise HaloPyError(self._err_400)
         elif response.status_code == 401:
@@ -186,6 +580,72 @@ class HaloPy(object):
             raise HaloPyError(self._err_500)
         else:
             response.raise_for_status()
+
+    def stream(self, endpoint, params={}, headers={}):
+        """Sends a streamed request to the Halo API servers.
+
+        Like :meth:`request`, but the body is not read up front and the
+        response cache is bypassed entirely, for large binary responses
+        such as profile images. Read the body with ``iter_content()`` and
+        close the response when done.
+
+        Args:
+            endpoint           (str): The endpoint to send the request to
+            params  (Optional[dict]): Dictionary of key, value URL params
+            headers (Optional[dict]): Dictionary of key, value request headers
+
+        Returns:
+            Response: Requests Response object, a ``304 Not Modified`` or
+            ``206 Partial Content`` is returned as is.
+
+        Raises:
+            HaloPyError: If we are over our rate limit, or if an
+                HTTP error occurs.
+        """
+        p = dict((k, v) for k, v in params.items() if v)
+        url = '{b}{e}'.format(b=self.base_url, e=endpoint)
+        label = None if self.instrument is None else endpoint_name(endpoint)
+        response = self._get(url, p, headers, stream=True, label=label)
+        try:
+            self._check(response)
+        except Exception:
+            response.close()
+            raise
+        return response
+
+    def _label(self, response):
+        url = response.url
+        if url.startswith(self.base_url):
+            url = url[len(self.base_url):]
+        return endpoint_name(url)
+
+    def _decode(self, response):
+        if self.instrument is None:
+            return json_loads(response.content)
+        started = timer()
+        data = json_loads(response.content)
+        self.instrument.timing('decode', self._label(response), timer() - started)
+        return data
+
+    def _results(self, response):
+        """Decode a listing into a list of HaloPyResult objects"""
+        items = self._decode(response)
+        if self.instrument is None:
+            return [HaloPyResult(item) for item in items]
+        started = timer()
+        results = [HaloPyResult(item) for item in items]
+        self.instrument.timing('result', self._label(response), timer() - started)
+        return results
+
+    @staticmethod
+    def _cached_response(entry):
+        response = requests.Response()
+        response.url = entry.url
+        response.status_code = entry.status
+        response.headers = CaseInsensitiveDict(entry.headers)
+        response.encoding = get_encoding_from_headers(response.headers)
+        response._content = entry.content
+        response.from_cache = True
         return response
 
     def meta_request(self, endpoint, params={}, headers={}):
@@ -202,11 +662,15 @@ class HaloPy(object):
         Returns:
             json-encoded content of a response, if any
         """
+        return self._decode(self._meta_response(endpoint, params, headers))
+
+    def _meta_response(self, endpoint, params={}, headers={}):
         return self.request(
             'metadata/{t}/metadata/{e}'.format(t=self.title, e=endpoint),
             params,
-            headers
-        ).json()
+            headers,
+            'metadata'
+        )
 
     def profile_request(self, endpoint, params={}, headers={}):
         """Helper method for profile requests
@@ -225,14 +689,16 @@ class HaloPy(object):
         return self.request(
             'profile/{t}/profiles/{e}'.format(t=self.title, e=endpoint),
             params,
-            headers
+            headers,
+            'profile'
         )
 
     def stats_request(self, endpoint, params={}, headers={}):
         """Helper method for metadata requests
 
         Prepends the endpoint with ``stats/{title}/`` where
-        ``{title}`` is the game title.
+        ``{title}`` is the game title. Match details are cached as the
+        ``match`` endpoint family, everything else as ``stats``.
 
         Args:
             endpoint           (str): The endpoint to send the request to
@@ -242,11 +708,12 @@ class HaloPy(object):
         Returns:
             json-encoded content of a response, if any
         """
-        return self.request(
-            'stats/{t}/{e}'.format(t=self.title, e=endpoint),
-            params,
-            headers
-        ).json()
+        return self._decode(self._stats_response(endpoint, params, headers))
+
+    def _stats_response(self, endpoint, params={}, headers={}):
+        endpoint = 'stats/{t}/{e}'.format(t=self.title, e=endpoint)
+        family = 'match' if self._match_endpoint.match(endpoint) else 'stats'
+        return self.request(endpoint, params, headers, family)
 
     def  get_campaign_missions(self):
         """Get a listing of campaign missions supported in the title.
@@ -258,7 +725,7 @@ class HaloPy(object):
             list[HaloPyResult]: List of campaign mission details
         """
         url = 'campaign-missions'
-        return [HaloPyResult(mission) for mission in self.meta_request(url)]
+        return self._results(self._meta_response(url))
 
     def  get_commendations(self):
         """Get a listing of commendations supported in the title.
@@ -270,7 +737,7 @@ class HaloPy(object):
             list[HaloPyResult]: List of commendation details
         """
         url = 'commendations'
-        return [HaloPyResult(com) for com in self.meta_request(url)]
+        return self._results(self._meta_response(url))
 
     def get_csr_designations(self):
         """Get a listing of CSR designations supported in the title.
@@ -282,7 +749,7 @@ class HaloPy(object):
             list[HaloPyResult]: List of CSR designation details
         """
         url = 'csr-designations'
-        return [HaloPyResult(csr) for csr in self.meta_request(url)]
+        return self._results(self._meta_response(url))
 
     def get_enemies(self):
         """Get a listing of enemies supported in the title.
@@ -294,7 +761,7 @@ class HaloPy(object):
             list[HaloPyResult]: List of enemy details
         """
         url = 'enemies'
-        return [HaloPyResult(enemy) for enemy in self.meta_request(url)]
+        return self._results(self._meta_response(url))
 
     def get_flexible_stats(self):
         """Get a listing of flexible statistics supported in the title.
@@ -306,7 +773,7 @@ class HaloPy(object):
             list[HaloPyResult]: List of flexible statistic details
         """
         url = 'flexible-stats'
-        return [HaloPyResult(stat) for stat in self.meta_request(url)]
+        return self._results(self._meta_response(url))
 
     def get_game_base_variants(self):
         """Get a listing of all game base variants supported in the title.
@@ -318,7 +785,7 @@ class HaloPy(object):
             list[HaloPyResult]: List of game base variant details
         """
         url = 'game-base-variants'
-        return [HaloPyResult(variant) for variant in self.meta_request(url)]
+        return self._results(self._meta_response(url))
 
     def get_game_variant_by_id(self, var_id):
         """Get details for specified game variant id.
@@ -333,7 +800,7 @@ class HaloPy(object):
             HaloPyResult: Game variant details
         """
         url = 'game-variants/{var_id}'.format(var_id=var_id)
-        return HaloPyResult(self.meta_request(url))
+        return HaloPyResult.from_response(self._meta_response(url))
 
     def get_impulses(self):
         """Get list of supported impulses for the title. Impulses are
@@ -347,7 +814,7 @@ class HaloPy(object):
             list[HaloPyResult]: List of impulse details
         """
         url = 'impulses'
-        return [HaloPyResult(impulse) for impulse in self.meta_request(url)]
+        return self._results(self._meta_response(url))
 
     def get_map_variant_by_id(self, map_id):
         """Get details for specified map variant id
@@ -362,7 +829,7 @@ class HaloPy(object):
             HaloPyResult: Map variant details
         """
         url = 'map-variants/{map_id}'.format(map_id=map_id)
-        return HaloPyResult(self.meta_request(url))
+        return HaloPyResult.from_response(self._meta_response(url))
 
     def get_maps(self):
         """Get list of supported maps in the title.
@@ -374,7 +841,7 @@ class HaloPy(object):
             list[HaloPyResult]: List of map details
         """
         url = 'maps'
-        return [HaloPyResult(map_d) for map_d in self.meta_request(url)]
+        return self._results(self._meta_response(url))
 
     def get_medals(self):
         """Get list of supported medals in the title.
@@ -386,7 +853,7 @@ class HaloPy(object):
             list[HaloPyResult]: List of medal details
         """
         url = 'medals'
-        return [HaloPyResult(medal) for medal in self.meta_request(url)]
+        return self._results(self._meta_response(url))
 
     def get_playlists(self):
         """Get list of playlists available in the title.
@@ -398,7 +865,7 @@ class HaloPy(object):
             list[HaloPyResult]: List of playlist details
         """
         url = 'playlists'
-        return [HaloPyResult(playlist) for playlist in self.meta_request(url)]
+        return self._results(self._meta_response(url))
 
     def get_requisition_pack_by_id(self, req_pack_id):
         """Get details for a specific "REQ" pack
@@ -413,7 +880,7 @@ class HaloPy(object):
             HaloPyResult: "REQ" pack details
         """
         url = 'requisition-packs/{req}'.format(req=req_pack_id)
-        return HaloPyResult(self.meta_request(url))
+        return HaloPyResult.from_response(self._meta_response(url))
 
     def get_requisition_by_id(self, req_id):
         """Get details for a specific "REQ"
@@ -428,7 +895,7 @@ class HaloPy(object):
             HaloPyResult: "REQ" details
         """
         url = 'requisitions/{req_id}'.format(req_id=req_id)
-        return HaloPyResult(self.meta_request(url))
+        return HaloPyResult.from_response(self._meta_response(url))
 
     def get_skulls(self):
         """Get list of skulls supported in the title.
@@ -440,7 +907,7 @@ class HaloPy(object):
             list[HaloPyResult]: List of skull details
         """
         url = 'skulls'
-        return [HaloPyResult(skull) for skull in self.meta_request(url)]
+        return self._results(self._meta_response(url))
 
     def get_spartan_ranks(self):
         """Get list of spartan ranks supported in the title.
@@ -452,7 +919,7 @@ class HaloPy(object):
             list[HaloPyResult]: List of spartan rank details
         """
         url = 'spartan-ranks'
-        return [HaloPyResult(rank) for rank in self.meta_request(url)]
+        return self._results(self._meta_response(url))
 
     def get_team_colors(self):
         """Get list of supported team colors in the title.
@@ -464,7 +931,7 @@ class HaloPy(object):
             list[HaloPyResult]: List of team color details
         """
         url = 'team-colors'
-        return [HaloPyResult(color) for color in self.meta_request(url)]
+        return self._results(self._meta_response(url))
 
     def get_vehicles(self):
         """Get list of supported vehicles in the title.
@@ -476,7 +943,7 @@ class HaloPy(object):
             list[HaloPyResult]: List of vehicle details
         """
         url = 'vehicles'
-        return [HaloPyResult(vehicle) for vehicle in self.meta_request(url)]
+        return self._results(self._meta_response(url))
 
     def get_weapons(self):
         """Get list of supported weapons in the title.
@@ -488,7 +955,7 @@ class HaloPy(object):
             list[HaloPyResult]: List of weapon details
         """
         url = 'weapons'
-        return [HaloPyResult(weapon) for weapon in self.meta_request(url)]
+        return self._results(self._meta_response(url))
 
     '''
     Profile functions
@@ -500,6 +967,9 @@ class HaloPy(object):
         See https://developer.haloapi.com/docs/services/56393773e2f7f718548921d7/operations/56393774e2f7f70ad8d46e9c
         for more information on this endpoint.
 
+        Images are kept in :attr:`image_store` if there is one, otherwise
+        they are cached as any other response.
+
         Args:
             player_gt      (str): Player gamertag
             size (Optional[int]): Size of emblem image, must be one of the
@@ -508,6 +978,8 @@ class HaloPy(object):
         Returns:
             Response: Response object containing the player's emblem
         """
+        if self.image_store is not None:
+            return self._image_response(self.image_store.emblem, player_gt, size)
         url = '{player}/emblem'.format(player=player_gt)
         return self.profile_request(url, {'size': size})
 
@@ -517,6 +989,9 @@ class HaloPy(object):
         See https://developer.haloapi.com/docs/services/56393773e2f7f718548921d7/operations/56393774e2f7f70ad8d46e9b
         for more information on this endpoint.
 
+        Images are kept in :attr:`image_store` if there is one, otherwise
+        they are cached as any other response.
+
         Args:
             player_gt      (str): Player gamertag
             size (Optional[int]): Size of spartan image, must be one of the
@@ -527,9 +1002,30 @@ class HaloPy(object):
         Returns:
             Response: Response object containing the player's spartan image
         """
+        if self.image_store is not None:
+            return self._image_response(self.image_store.spartan_image, player_gt, size, crop)
         url = '{player}/spartan'.format(player=player_gt)
         return self.profile_request(url, {'size': size, 'crop': crop})
 
+    def _image_response(self, fetch, player_gt, *args):
+        """Response holding an image fetched into :attr:`image_store`"""
+        started = time.time()
+        image = fetch(self, player_gt, *args)
+        kind, _, size, crop = image.key.split('|')
+        url, _, query = self._prepare('profile/{t}/profiles/{gt}/{kind}'.format(
+            t=self.title, gt=player_gt, kind=kind), {'size': size, 'crop': crop})
+        response = requests.Response()
+        response.url = '{u}?{q}'.format(u=url, q=query) if query else url
+        response.status_code = 200
+        response.headers = CaseInsensitiveDict({'Content-Length': str(image.length)})
+        for header, value in (('Content-Type', image.content_type), ('ETag', image.etag),
+                              ('Last-Modified', image.last_modified)):
+            if value:
+                response.headers[header] = value
+        response._content = self.image_store.read(image)
+        response.from_cache = image.stamp < started
+        return response
+
     '''
     Statistics functions
     '''
@@ -559,9 +1055,60 @@ class HaloPy(object):
                 }
         """
         url = 'players/{player}/matches'.format(player=player_gt)
-        return HaloPyResult(self.stats_request(url, {'modes': modes,
+        return HaloPyResult.from_response(self._stats_response(url, {'modes': modes,
             'start': start, 'count': count}))
 
+    def iter_player_matches(self, player_gt, modes=None, start=0, until=None, until_match_id=None,
+                            prefetch=True, rate_timeout=None):
+        """Iterate over every match played by the given player, newest first.
+
+        Pages of :meth:`get_player_matches` are requested lazily, the next
+        page being fetched in the background while the current one is
+        consumed. See :class:`~halopy.history.MatchHistory`.
+
+        Args:
+            player_gt       (str): Player gamertag
+            modes (Optional[str]): Game mode(s) to show, if unspecified, all
+                game modes will be included. You may specify multiple game
+                modes by comma-delimiting the values.
+            start (Optional[int]): Index to start from, e.g. the
+                ``position`` of an interrupted iterator.
+            until (Optional[datetime|str]): Stop at the first match completed
+                before this time.
+            until_match_id (Optional[str]): Stop when this match is reached.
+            prefetch (Optional[bool]): Fetch the next page in the background.
+            rate_timeout (Optional[float]): Seconds each page request waits
+                for the rate limiter, None (default) waits indefinitely.
+
+        Returns:
+            MatchHistory: Iterator of match summary ``HaloPyResult`` objects
+        """
+        return MatchHistory(self, player_gt, modes, start, until, until_match_id, prefetch,
+                            rate_timeout)
+
+    def sync_player_matches(self, player_gt, store, modes=None, since=None, rate_timeout=None):
+        """Get the matches the given player completed since the last sync.
+
+        Only pages until the watermark kept in ``store`` for this player and
+        ``modes`` is reached, so a sync with nothing new costs one request.
+        See :func:`halopy.history.sync_player_matches`.
+
+        Args:
+            player_gt       (str): Player gamertag
+            store (WatermarkStore): Store of per player watermarks, e.g. a
+                :class:`~halopy.history.SQLiteWatermarkStore`.
+            modes (Optional[str]): Comma-delimited game modes, all if
+                unspecified.
+            since (Optional[datetime|str]): Oldest match to return when the
+                player has no watermark yet.
+            rate_timeout (Optional[float]): Seconds each page request waits
+                for the rate limiter, None (default) waits indefinitely.
+
+        Returns:
+            list[HaloPyResult]: New match summaries, newest first
+        """
+        return sync_player_matches(self, player_gt, store, modes, since, rate_timeout)
+
     def get_arena_match_by_id(self, match_id):
         """Get arena match details by match id.
 
@@ -575,7 +1122,7 @@ class HaloPy(object):
             HaloPyResult: An object representing an arena match's details
         """
         url = 'arena/matches/{match_id}'.format(match_id=match_id)
-        return HaloPyResult(self.stats_request(url))
+        return HaloPyResult.from_response(self._stats_response(url))
 
     def get_campaign_match_by_id(self, match_id):
         """Get campaign match details by match id.
@@ -590,7 +1137,7 @@ class HaloPy(object):
             HaloPyResult: An object representing a campaign match details
         """
         url = 'campaign/matches/{match_id}'.format(match_id=match_id)
-        return HaloPyResult(self.stats_request(url))
+        return HaloPyResult.from_response(self._stats_response(url))
 
     def get_custom_match_by_id(self, match_id):
         """Get custom match details by match id.
@@ -605,7 +1152,7 @@ class HaloPy(object):
             HaloPyResult: An object representing a custom match details
         """
         url = 'custom/matches/{match_id}'.format(match_id=match_id)
-        return HaloPyResult(self.stats_request(url))
+        return HaloPyResult.from_response(self._stats_response(url))
 
     def get_warzone_match_by_id(self, match_id):
         """Get warzone match details by match id.
@@ -620,7 +1167,87 @@ class HaloPy(object):
             HaloPyResult: An object representing a warzone match details
         """
         url = 'warzone/matches/{match_id}'.format(match_id=match_id)
-        return HaloPyResult(self.stats_request(url))
+        return HaloPyResult.from_response(self._stats_response(url))
+
+    def get_match_by_id(self, match_id, game_mode):
+        """Get match details by match id, using the endpoint of the given game
+        mode.
+
+        Args:
+            match_id (uid): Match unique identifier
+            game_mode (int|str): ``GameMode`` of the match summary (1 to 4),
+                or ``arena``, ``campaign``, ``custom`` or ``warzone``
+
+        Returns:
+            HaloPyResult: An object representing the match details
+
+        Raises:
+            ValueError: If the game mode is unknown
+        """
+        mode = self.game_modes.get(game_mode, game_mode)
+        if mode not in self.game_modes.values():
+            raise ValueError('Unknown game mode: {0!r}'.format(game_mode))
+        url = '{mode}/matches/{match_id}'.format(mode=mode, match_id=match_id)
+        return HaloPyResult.from_response(self._stats_response(url))
+
+    def hydrate_matches(self, summaries, workers=4, ordered=False, rate_timeout=None):
+        """Get the details of any number of matches.
+
+        Each summary is fetched from the endpoint of its game mode, on
+        ``workers`` threads within the rate limit. Summaries are consumed
+        lazily, so e.g. :meth:`iter_player_matches` can be hydrated as it
+        pages. Matches whose details are already cached are returned without
+        going through the pool.
+
+        If a match fails, a result with its ``MatchId``, ``GameMode`` and the
+        error message in ``Error`` is yielded instead of raising.
+
+        Args:
+            summaries (iterable): Match summaries, as ``HaloPyResult`` objects
+                or dicts from :meth:`get_player_matches`, or
+                :class:`~halopy.models.MatchSummary` models
+            workers (Optional[int]): Number of concurrent requests
+            ordered (Optional[bool]): Yield in input order instead of
+                completion order.
+            rate_timeout (Optional[float]): Seconds each request waits for
+                the rate limiter, None (default) waits indefinitely.
+
+        Yields:
+            HaloPyResult: Match details
+        """
+        fetch = self._waiting(self.get_match_by_id, rate_timeout)
+
+        def cached(ref):
+            endpoint = 'stats/{t}/{m}/matches/{i}'.format(
+                t=self.title, m=self.game_modes.get(ref[1], ref[1]), i=ref[0])
+            return self._fresh_entry(endpoint, 'match') is not None
+
+        def hydrate(ref):
+            try:
+                return fetch(*ref)
+            except (HaloPyError, ValueError, requests.RequestException) as ex:
+                return HaloPyResult({'MatchId': ref[0], 'GameMode': ref[1], 'Error': str(ex)})
+
+        refs = (self._match_ref(summary) for summary in summaries)
+        for _, future in imap(hydrate, refs, workers, ordered, cached):
+            yield future.result()
+
+    @staticmethod
+    def _match_ref(summary):
+        if isinstance(summary, HaloPyResult):
+            summary = summary.Id
+        elif isinstance(summary, dict):
+            summary = summary['Id']
+        else:
+            return summary.match_id, summary.game_mode
+        return summary['MatchId'], summary['GameMode']
+
+    def _fresh_entry(self, endpoint, family=None):
+        """Cache entry of a parameterless request if it is fresh, else None"""
+        if self.cache_ttl(family) == 0:
+            return None
+        entry = self._response_cache.get('{b}{e}?'.format(b=self.base_url, e=endpoint))
+        return entry if entry is not None and entry.fresh() else None
 
     def get_player_service_record(self, player_gt, game_mode='campaign'):
         """Get service record for the given player
@@ -651,3 +1278,62 @@ class HaloPy(object):
         url = 'servicerecords/{game_mode}'.format(game_mode=game_mode)
         res_json = self.stats_request(url, {'players': player_gts})
         return [HaloPyResult(result) for result in res_json.get('Results', [])]
+
+    def iter_players_service_record(self, player_gts, game_mode='campaign', batch_size=None,
+                                    workers=4, rate_timeout=None):
+        """Get service records for any number of player gamertags.
+
+        Gamertags are deduplicated (case-insensitively) and split into
+        batches of at most :attr:`max_service_record_players`, which are
+        fetched on ``workers`` threads within the rate limit. Results are
+        yielded as their batch arrives, so the input may be an arbitrarily
+        long iterable.
+
+        If a batch fails, a result is yielded for each of its gamertags with
+        a ``ResultCode`` of 2 (service failure) and the error message in
+        ``Error`` instead of raising.
+
+        Args:
+            player_gts (iterable[str]): Player gamertags
+            game_mode       (str): Must be ``arena``, ``warzone``, ``custom``,
+                or ``campaign``. Defaults to ``campaign``.
+            batch_size (Optional[int]): Players per request, defaults to
+                :attr:`max_service_record_players`.
+            workers    (Optional[int]): Number of concurrent requests
+            rate_timeout (Optional[float]): Seconds each request waits for
+                the rate limiter, None (default) waits indefinitely.
+
+        Yields:
+            HaloPyResult: Player service record objects
+        """
+        batch_size = min(batch_size or self.max_service_record_players,
+                         self.max_service_record_players)
+
+        def batches():
+            seen = set()
+            batch = []
+            for gt in player_gts:
+                key = gt.lower()
+                if key in seen:
+                    continue
+                seen.add(key)
+                batch.append(gt)
+                if len(batch) == batch_size:
+                    yield batch
+                    batch = []
+            if batch:
+                yield batch
+
+        fetch = self._waiting(self.get_players_service_record, rate_timeout)
+        for batch, future in imap(lambda batch: fetch(batch, game_mode), batches(), workers):
+            try:
+                results = future.result()
+            except (HaloPyError, requests.RequestException) as ex:
+                results = [HaloPyResult({'Id': gt, 'ResultCode': 2, 'Error': str(ex)})
+                           for gt in batch]
+            for result in results:
+                yield result
+
+
+if sys.version_info >= (3, 5):
+    from halopy.aio import AsyncHaloPy
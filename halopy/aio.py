@@ -0,0 +1,377 @@
+# coding=utf-8
+"""
+asyncio front-end for HaloPy.
+
+Requests are sent with an ``httpx.AsyncClient``, install ``httpx`` (or
+``halopy[async]``) to use it.
+
+.. moduleauthor:: Max Gurela <maxpowa@outlook.com>
+
+Licensed under the Eiffel Forum License 2
+"""
+import asyncio
+import functools
+
+import requests
+
+from requests.structures import CaseInsensitiveDict
+from requests.utils import get_encoding_from_headers
+
+try:
+    import httpx
+except ImportError:
+    httpx = None
+
+from halopy import HaloPy, HaloPyError, HaloPyResult
+from halopy.instrument import endpoint_name, timer
+from halopy.ratelimit import monotonic
+
+
+def _mirror(fn):
+    """Give a coroutine the name and docstring of the HaloPy method it
+    mirrors"""
+    return functools.wraps(getattr(HaloPy, fn.__name__))(fn)
+
+
+class AsyncHaloPy(object):
+    """Awaitable counterpart of :class:`halopy.HaloPy`
+
+    Every ``get_*`` method and the ``request`` helpers of :class:`HaloPy` are
+    available as coroutines with the same arguments. Requests are sent over
+    a pooled ``httpx.AsyncClient`` from the event loop, so no thread is held
+    per request in flight. The keys, rate limiters, cache and instrument of
+    a :class:`HaloPy` client are used, and shared with it if one is given.
+
+    Waiting for the rate limiter never blocks the event loop, coroutines
+    sleep until their token is due. As with :class:`HaloPy`, a request fails
+    if no token is due within ``rate_timeout``, so pass ``rate_timeout=None``
+    to gather more requests than the rate allows. Concurrent identical
+    requests are coalesced, as they are by :class:`HaloPy`. Only images kept
+    in an ``image_store`` are fetched on the loop's default executor, since
+    the store works with files.
+
+    Args:
+        api_key     (Optional[str]): Halo API key.
+        max_workers (Optional[int]): Maximum number of requests in flight,
+            and of pooled connections. Default is 10.
+        api      (Optional[HaloPy]): Existing client to share the keys, rate
+            limit and cache of instead of creating a new one from
+            ``api_key``.
+        **kwargs: Options to pass to :class:`HaloPy`
+
+    Example::
+
+        async with AsyncHaloPy(api_key, rate_timeout=None) as api:
+            records = await api.gather(
+                *[api.get_player_service_record(gt) for gt in gamertags])
+    """
+
+    def __init__(self, api_key=None, max_workers=10, api=None, **kwargs):
+        if httpx is None:
+            raise ImportError('AsyncHaloPy requires httpx')
+        if api is None:
+            api = HaloPy(api_key, **kwargs)
+        self.api = api
+        self.max_workers = max_workers
+        self._flights = {}
+
+        limits = httpx.Limits(max_connections=max_workers,
+                              max_keepalive_connections=max_workers if api._keep_alive else 0)
+        retries = api._max_retries if isinstance(api._max_retries, int) else 0
+        self._client = httpx.AsyncClient(timeout=None, transport=httpx.AsyncHTTPTransport(
+            limits=limits, retries=retries))
+
+    async def request(self, endpoint, params={}, headers={}, family=None):
+        """Coroutine sending a request to the Halo API servers, see
+        :meth:`HaloPy.request`.
+
+        Returns:
+            Response: Requests Response object holding the body read by
+            ``httpx``.
+
+        Raises:
+            HaloPyError: If we are over our rate limit, or if an
+                HTTP error occurs.
+        """
+        api = self.api
+        if api.instrument is None:
+            return await self._request(endpoint, params, headers, family)
+        label = endpoint_name(endpoint)
+        started = timer()
+        try:
+            return await self._request(endpoint, params, headers, family, label)
+        finally:
+            api.instrument.timing('request', label, timer() - started)
+
+    async def _request(self, endpoint, params, headers, family, label=None):
+        api = self.api
+        url, p, query = api._prepare(endpoint, params)
+        ttl = api.cache_ttl(family)
+        key = entry = None
+        if ttl != 0:
+            key = '{u}?{q}'.format(u=url, q=query)
+            entry = api._lookup(key, label)
+            if entry is not None and entry.fresh():
+                return api._hit(entry, label)
+
+        # Identical requests already in flight share a single HTTP call
+        flight = (url, query, tuple(sorted(headers.items())))
+        future = self._flights.get(flight)
+        if future is None:
+            future = asyncio.ensure_future(self._send(url, p, headers, ttl, key, entry, label))
+            self._flights[flight] = future
+            future.add_done_callback(lambda f: self._flights.pop(flight, None))
+        # A cancelled caller must not cancel the call the others wait for
+        return await asyncio.shield(future)
+
+    async def _send(self, url, p, headers, ttl, key, entry, label=None):
+        api = self.api
+        if key is not None:
+            # Threads sharing the client may have filled the cache meanwhile
+            entry = api._response_cache.get(key)
+            if entry is not None and entry.fresh():
+                return api._hit(entry, label)
+        response = await self._get(url, p, api._validated(headers, entry), label)
+        return api._store(response, ttl, key, entry, label)
+
+    async def _acquire(self, deadline, label=None):
+        """Take a token from the key pool, sleeping until ``deadline`` (a
+        monotonic time, None for no limit) for one to become available"""
+        keys = self.api._keys
+        started = timer()
+        try:
+            while True:
+                key = keys.acquire(False)
+                if key is not None:
+                    return key
+                wait = keys.delay()
+                if deadline is not None:
+                    remaining = deadline - monotonic()
+                    if remaining <= 0:
+                        return None
+                    wait = min(wait, remaining)
+                # Tokens may be taken back (e.g. a penalty) or handed out to
+                # threads at any time, so check again at least once a second
+                await asyncio.sleep(min(max(wait, 0.001), 1.0))
+        finally:
+            if label is not None:
+                self.api.instrument.timing('limiter', label, timer() - started)
+
+    async def _get(self, url, params, headers, label=None):
+        """Send a GET once a key has a token, retrying throttled requests"""
+        api = self.api
+        timeout = api.rate_timeout
+        deadline = None if timeout is None else monotonic() + timeout
+        key = await self._acquire(deadline, label)
+        if key is None:
+            raise HaloPyError(api._err_429)
+
+        headers = dict(headers)
+        own_key = 'Ocp-Apim-Subscription-Key' in headers
+
+        attempt = 0
+        while True:
+            if not own_key:
+                headers['Ocp-Apim-Subscription-Key'] = key.key
+            started = timer()
+            response = self._response(await self._client.get(url, params=params, headers=headers))
+            if label is not None:
+                api.instrument.timing('network', label, timer() - started)
+                if response.status_code == 429:
+                    api.instrument.count('throttled', label)
+                elif response.status_code >= 400:
+                    api.instrument.count('error', label)
+            if not own_key and api._keys.record(key, response):
+                # Rejected key, out of rotation now
+                key = await self._acquire(deadline, label)
+                if key is None:
+                    raise HaloPyError(api._err_429)
+                continue
+            if response.status_code != 429:
+                key.throttle.observe(response)
+                return response
+            key.throttle.throttled(response, attempt)
+            if attempt >= api.throttle_retries:
+                return response
+            attempt += 1
+            # Sleep out the backoff the throttle just applied, unless another
+            # key has tokens
+            key = await self._acquire(deadline, label)
+            if key is None:
+                raise HaloPyError(api._err_429)
+
+    @staticmethod
+    def _response(response):
+        """Requests Response holding an ``httpx`` response, so that results
+        are built and cached as they are by :class:`HaloPy`"""
+        result = requests.Response()
+        result.url = str(response.url)
+        result.status_code = response.status_code
+        result.reason = response.reason_phrase
+        result.headers = CaseInsensitiveDict(response.headers.items())
+        result.encoding = get_encoding_from_headers(result.headers)
+        result._content = response.content
+        result.from_cache = False
+        return result
+
+    @_mirror
+    async def meta_request(self, endpoint, params={}, headers={}):
+        return self.api._decode(await self._meta_response(endpoint, params, headers))
+
+    async def _meta_response(self, endpoint, params={}, headers={}):
+        return await self.request(
+            'metadata/{t}/metadata/{e}'.format(t=self.api.title, e=endpoint),
+            params, headers, 'metadata')
+
+    @_mirror
+    async def profile_request(self, endpoint, params={}, headers={}):
+        return await self.request(
+            'profile/{t}/profiles/{e}'.format(t=self.api.title, e=endpoint),
+            params, headers, 'profile')
+
+    @_mirror
+    async def stats_request(self, endpoint, params={}, headers={}):
+        return self.api._decode(await self._stats_response(endpoint, params, headers))
+
+    async def _stats_response(self, endpoint, params={}, headers={}):
+        endpoint = 'stats/{t}/{e}'.format(t=self.api.title, e=endpoint)
+        family = 'match' if self.api._match_endpoint.match(endpoint) else 'stats'
+        return await self.request(endpoint, params, headers, family)
+
+    async def _meta_result(self, url):
+        return HaloPyResult.from_response(await self._meta_response(url))
+
+    @_mirror
+    async def get_game_variant_by_id(self, var_id):
+        return await self._meta_result('game-variants/{var_id}'.format(var_id=var_id))
+
+    @_mirror
+    async def get_map_variant_by_id(self, map_id):
+        return await self._meta_result('map-variants/{map_id}'.format(map_id=map_id))
+
+    @_mirror
+    async def get_requisition_pack_by_id(self, req_pack_id):
+        return await self._meta_result('requisition-packs/{req}'.format(req=req_pack_id))
+
+    @_mirror
+    async def get_requisition_by_id(self, req_id):
+        return await self._meta_result('requisitions/{req_id}'.format(req_id=req_id))
+
+    async def _stored_image(self, method, *args):
+        # The image store reads and writes files, keep that off the loop
+        loop = asyncio.get_running_loop()
+        return await loop.run_in_executor(None, functools.partial(method, *args))
+
+    @_mirror
+    async def get_player_emblem(self, player_gt, size=None):
+        if self.api.image_store is not None:
+            return await self._stored_image(self.api.get_player_emblem, player_gt, size)
+        url = '{player}/emblem'.format(player=player_gt)
+        return await self.profile_request(url, {'size': size})
+
+    @_mirror
+    async def get_player_spartan_image(self, player_gt, size=None, crop=None):
+        if self.api.image_store is not None:
+            return await self._stored_image(self.api.get_player_spartan_image, player_gt, size,
+                                            crop)
+        url = '{player}/spartan'.format(player=player_gt)
+        return await self.profile_request(url, {'size': size, 'crop': crop})
+
+    @_mirror
+    async def get_player_matches(self, player_gt, modes=None, start=None, count=None):
+        url = 'players/{player}/matches'.format(player=player_gt)
+        return HaloPyResult.from_response(await self._stats_response(
+            url, {'modes': modes, 'start': start, 'count': count}))
+
+    @_mirror
+    async def get_arena_match_by_id(self, match_id):
+        return await self.get_match_by_id(match_id, 'arena')
+
+    @_mirror
+    async def get_campaign_match_by_id(self, match_id):
+        return await self.get_match_by_id(match_id, 'campaign')
+
+    @_mirror
+    async def get_custom_match_by_id(self, match_id):
+        return await self.get_match_by_id(match_id, 'custom')
+
+    @_mirror
+    async def get_warzone_match_by_id(self, match_id):
+        return await self.get_match_by_id(match_id, 'warzone')
+
+    @_mirror
+    async def get_match_by_id(self, match_id, game_mode):
+        mode = self.api.game_modes.get(game_mode, game_mode)
+        if mode not in self.api.game_modes.values():
+            raise ValueError('Unknown game mode: {0!r}'.format(game_mode))
+        url = '{mode}/matches/{match_id}'.format(mode=mode, match_id=match_id)
+        return HaloPyResult.from_response(await self._stats_response(url))
+
+    @_mirror
+    async def get_player_service_record(self, player_gt, game_mode='campaign'):
+        result = await self.get_players_service_record([player_gt], game_mode)
+        return result[0]
+
+    @_mirror
+    async def get_players_service_record(self, player_gts, game_mode='campaign'):
+        url = 'servicerecords/{game_mode}'.format(game_mode=game_mode)
+        res_json = await self.stats_request(url, {'players': player_gts})
+        return [HaloPyResult(result) for result in res_json.get('Results', [])]
+
+    async def gather(self, *aws, limit=None, return_exceptions=False):
+        """Await several coroutines with at most ``limit`` running at once.
+
+        Args:
+            *aws: Awaitables to run
+            limit (Optional[int]): Concurrency bound, defaults to
+                ``max_workers``.
+            return_exceptions (Optional[bool]): Return exceptions as results
+                instead of raising the first one, like ``asyncio.gather``.
+
+        Returns:
+            list: Results in the order the awaitables were given
+        """
+        semaphore = asyncio.Semaphore(limit or self.max_workers)
+
+        async def bounded(aw):
+            async with semaphore:
+                return await aw
+
+        return await asyncio.gather(*[bounded(aw) for aw in aws],
+                                    return_exceptions=return_exceptions)
+
+    async def close(self):
+        """Close the HTTP client and the wrapped client."""
+        await self._client.aclose()
+        self.api.close()
+
+    async def __aenter__(self):
+        return self
+
+    async def __aexit__(self, *exc_info):
+        await self.close()
+
+
+def _listing(name, url):
+    async def listing(self):
+        return self.api._results(await self._meta_response(url))
+    return functools.wraps(getattr(HaloPy, name))(listing)
+
+
+for _name, _url in (('get_campaign_missions', 'campaign-missions'),
+                    ('get_commendations', 'commendations'),
+                    ('get_csr_designations', 'csr-designations'),
+                    ('get_enemies', 'enemies'),
+                    ('get_flexible_stats', 'flexible-stats'),
+                    ('get_game_base_variants', 'game-base-variants'),
+                    ('get_impulses', 'impulses'),
+                    ('get_maps', 'maps'),
+                    ('get_medals', 'medals'),
+                    ('get_playlists', 'playlists'),
+                    ('get_skulls', 'skulls'),
+                    ('get_spartan_ranks', 'spartan-ranks'),
+                    ('get_team_colors', 'team-colors'),
+                    ('get_vehicles', 'vehicles'),
+                    ('get_weapons', 'weapons')):
+    setattr(AsyncHaloPy, _name, _listing(_name, _url))
+del _name, _url
@@ -0,0 +1,216 @@
+# coding=utf-8
+"""
+Compact binary snapshot of the title's metadata, memory-mapped on load.
+
+A bundle is written once, e.g. by a deploy step::
+
+    python -m halopy.bundle metadata.bundle --api-key KEY
+
+and opened by every worker with :class:`MetadataBundle`. Opening only maps
+the file, lookups binary search a sorted hash table in the mapping and decode
+just the item found, and since the mapping is read-only, forked workers
+share its pages.
+
+File layout, all integers little-endian:
+
+* header: magic ``HPYB``, format version, flags, entry count, offset of the
+  entry table, offset and length of the JSON document describing the bundle
+* items: compact JSON documents, one per line, grouped by kind
+* entries: ``(hash, offset, length)`` sorted by hash, one per item id and one
+  per item name, ``hash`` being the first 8 bytes of the SHA-1 of
+  ``kind``, ``id`` or ``name`` and the lowercased value
+* the JSON document: title, version, stamp, and the range of each kind
+
+.. moduleauthor:: Max Gurela <maxpowa@outlook.com>
+
+Licensed under the Eiffel Forum License 2
+"""
+from __future__ import unicode_literals, absolute_import, print_function, division
+
+import argparse
+import hashlib
+import json
+import mmap
+import os
+import struct
+import sys
+
+import halopy
+
+from halopy.metadata import MetadataIndex, MetadataResolver, _key
+
+MAGIC = b'HPYB'
+FORMAT_VERSION = 1
+
+_header = struct.Struct(str('<4sHHIQQI'))
+_entry = struct.Struct(str('<8sQI'))
+
+
+def _hash(kind, field, value):
+    return hashlib.sha1('{0}\0{1}\0{2}'.format(kind, field, value).encode('utf-8')).digest()[:8]
+
+
+def write_bundle(index, path):
+    """Write the items of a metadata index to a bundle file.
+
+    The file is written next to ``path`` and renamed over it, so workers
+    that have the previous bundle mapped are not affected.
+
+    Args:
+        index (MetadataIndex): Metadata to write
+        path (str): Bundle file
+    """
+    records = bytearray()
+    entries = []
+    kinds = {}
+    for kind in index.kinds:
+        start = _header.size + len(records)
+        names = set()
+        for item in index.items(kind):
+            blob = json.dumps(item, separators=(',', ':'), sort_keys=True).encode('utf-8')
+            offset = _header.size + len(records)
+            records += blob + b'\n'
+            if item.get('id') is not None:
+                entries.append((_hash(kind, 'id', _key(item['id'])), offset, len(blob)))
+            name = (item.get('name') or '').lower()
+            if name and name not in names:
+                names.add(name)
+                entries.append((_hash(kind, 'name', name), offset, len(blob)))
+        kinds[kind] = [start, _header.size + len(records)]
+    entries.sort()
+    meta = json.dumps({'title': index.title, 'halopy': halopy.__version__,
+                       'stamp': index.stamp, 'kinds': kinds}).encode('utf-8')
+    entry_offset = _header.size + len(records)
+    meta_offset = entry_offset + len(entries) * _entry.size
+
+    tmp = '{0}.{1}.tmp'.format(path, os.getpid())
+    with open(tmp, 'wb') as f:
+        f.write(_header.pack(MAGIC, FORMAT_VERSION, 0, len(entries), entry_offset,
+                             meta_offset, len(meta)))
+        f.write(records)
+        for entry in entries:
+            f.write(_entry.pack(*entry))
+        f.write(meta)
+    if hasattr(os, 'replace'):
+        os.replace(tmp, path)
+    else:  # Python 2
+        if os.path.exists(path):
+            os.remove(path)
+        os.rename(tmp, path)
+
+
+class MetadataBundle(MetadataResolver):
+    """Read-only, memory-mapped metadata bundle
+
+    Offers the lookups of :class:`~halopy.metadata.MetadataIndex`, including
+    :meth:`resolve`, without loading the bundle into memory.
+
+    Args:
+        path (str): Bundle file written by :func:`write_bundle`
+
+    Raises:
+        HaloPyError: If the file is not a bundle of a supported version
+    """
+
+    def __init__(self, path):
+        self.path = path
+        error = halopy.HaloPyError('{0} is not a version {1} metadata bundle'.format(
+            path, FORMAT_VERSION))
+        with open(path, 'rb') as f:
+            size = os.fstat(f.fileno()).st_size
+            if size < _header.size:
+                raise error
+            self._map = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+        magic, version, flags, self._count, self._entries, meta_offset, meta_len = \
+            _header.unpack_from(self._map, 0)
+        if magic != MAGIC or version != FORMAT_VERSION or \
+                self._entries + self._count * _entry.size > size or \
+                meta_offset + meta_len > size:
+            self._map.close()
+            raise error
+        try:
+            meta = json.loads(self._map[meta_offset:meta_offset + meta_len].decode('utf-8'))
+            self.title = meta['title']
+            self.stamp = meta['stamp']
+            self._kinds = meta['kinds']
+        except (ValueError, KeyError):
+            self._map.close()
+            raise error
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        self.close()
+
+    def close(self):
+        """Unmap the bundle."""
+        self._map.close()
+
+    @property
+    def kinds(self):
+        """list[str]: Kinds of metadata in the bundle"""
+        return sorted(self._kinds)
+
+    def items(self, kind):
+        """list[dict]: Every item of a kind"""
+        if kind not in self._kinds:
+            return []
+        start, end = self._kinds[kind]
+        return [halopy.json_loads(line) for line in self._map[start:end].splitlines()]
+
+    def _find(self, kind, field, value):
+        target = _hash(kind, field, value)
+        lo, hi = 0, self._count
+        while lo < hi:
+            mid = (lo + hi) // 2
+            position = self._entries + mid * _entry.size
+            if self._map[position:position + 8] < target:
+                lo = mid + 1
+            else:
+                hi = mid
+        # Several entries may share a hash, check the item actually matches
+        while lo < self._count:
+            digest, offset, length = _entry.unpack_from(self._map, self._entries + lo * _entry.size)
+            if digest != target:
+                break
+            item = halopy.json_loads(self._map[offset:offset + length])
+            if field == 'id' and _key(item.get('id')) == value:
+                return item
+            if field == 'name' and (item.get('name') or '').lower() == value:
+                return item
+            lo += 1
+        return None
+
+    def get(self, kind, item_id):
+        return self._find(kind, 'id', _key(item_id))
+
+    def by_name(self, kind, name):
+        """Return the metadata item of a kind by name (case-insensitive), or
+        None"""
+        return self._find(kind, 'name', name.lower())
+
+
+def main(argv=None):
+    """Write a metadata bundle from the Halo API, see ``--help``."""
+    parser = argparse.ArgumentParser(prog='python -m halopy.bundle',
+                                     description='Snapshot Halo API metadata into a bundle file.')
+    parser.add_argument('path', help='bundle file to write')
+    parser.add_argument('--api-key', default=os.getenv('HALOPY_API_KEY'),
+                        help='Halo API key, defaults to $HALOPY_API_KEY')
+    parser.add_argument('--title', default='h5', help='game title, defaults to h5')
+    parser.add_argument('--base-url', help='root URL of the Halo API, e.g. of a local stub')
+    args = parser.parse_args(argv)
+    if not args.api_key:
+        parser.error('an API key is required')
+
+    with halopy.HaloPy(args.api_key, title=args.title, cache=0, cache_backend='memory',
+                       rate_timeout=None, base_url=args.base_url) as api:
+        index = MetadataIndex.load(api)
+    write_bundle(index, args.path)
+    print('Wrote {0} kinds of metadata to {1}'.format(len(index.kinds), args.path))
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,350 @@
+# coding=utf-8
+"""
+Per-instance response caches for HaloPy.
+
+.. moduleauthor:: Max Gurela <maxpowa@outlook.com>
+
+Licensed under the Eiffel Forum License 2
+"""
+from __future__ import unicode_literals, absolute_import, print_function, division
+
+import collections
+import json
+import sqlite3
+import threading
+import time
+
+import halopy
+
+
+class CacheEntry(object):
+    """Cached HTTP response
+
+    Args:
+        url       (str): URL the response was retrieved from
+        status    (int): HTTP status code
+        headers  (dict): Response headers
+        content (bytes): Response body
+        expires (Optional[float]): Unix time the entry goes stale, None if it
+            never does
+    """
+
+    __slots__ = ('url', 'status', 'headers', 'content', 'expires')
+
+    def __init__(self, url, status, headers, content, expires=None):
+        self.url = url
+        self.status = status
+        self.headers = headers
+        self.content = content
+        self.expires = expires
+
+    def fresh(self, now=None):
+        """bool: True if the entry has not expired yet"""
+        if self.expires is None:
+            return True
+        return (time.time() if now is None else now) < self.expires
+
+    @property
+    def size(self):
+        """int: Approximate size of the entry in bytes"""
+        return len(self.content)
+
+    def validators(self):
+        """Conditional request headers that ask the server to send the body
+        only if it changed since this entry was stored.
+
+        Returns:
+            dict: ``If-None-Match`` and/or ``If-Modified-Since`` headers,
+            empty if the response had no ``ETag`` or ``Last-Modified``
+        """
+        conditions = {}
+        for header, value in self.headers.items():
+            header = header.lower()
+            if header == 'etag':
+                conditions['If-None-Match'] = value
+            elif header == 'last-modified':
+                conditions['If-Modified-Since'] = value
+        return conditions
+
+    def revalidated(self, headers, expires):
+        """Return a copy of the entry refreshed by a ``304 Not Modified``.
+
+        Args:
+            headers (dict): Headers of the 304 response, validators and
+                caching headers in it replace the stored ones
+            expires (Optional[float]): New expiry time
+
+        Returns:
+            CacheEntry: The refreshed entry
+        """
+        merged = dict(self.headers)
+        for header, value in headers.items():
+            if header.lower() in self._refreshed_headers:
+                for old in [h for h in merged if h.lower() == header.lower()]:
+                    del merged[old]
+                merged[header] = value
+        return CacheEntry(self.url, self.status, merged, self.content, expires)
+
+    _refreshed_headers = ('etag', 'last-modified', 'date', 'expires', 'cache-control')
+
+
+class Cache(object):
+    """Base class for HaloPy response caches
+
+    Entries are returned whether or not they are fresh, it is up to the
+    caller to check :meth:`CacheEntry.fresh`. Subclasses implement
+    :meth:`get`, :meth:`set`, :meth:`delete` and :meth:`clear`.
+    """
+
+    def get(self, key):
+        """Return the entry stored under ``key``, or None"""
+        raise NotImplementedError
+
+    def set(self, key, entry):
+        """Store ``entry`` under ``key``"""
+        raise NotImplementedError
+
+    def delete(self, key):
+        """Remove the entry stored under ``key``, if any"""
+        raise NotImplementedError
+
+    def clear(self):
+        """Remove every entry"""
+        raise NotImplementedError
+
+    def close(self):
+        """Release any resources held by the cache"""
+        pass
+
+
+class MemoryCache(Cache):
+    """Bounded in-memory LRU cache
+
+    Args:
+        max_entries (Optional[int]): Maximum number of entries. Default is
+            1024.
+        max_bytes   (Optional[int]): Maximum total size of the entries'
+            content. Default is 64MiB.
+    """
+
+    def __init__(self, max_entries=1024, max_bytes=64 * 1024 * 1024):
+        self.max_entries = max_entries
+        self.max_bytes = max_bytes
+        self.size = 0
+        self._entries = collections.OrderedDict()
+        self._lock = threading.Lock()
+
+    def __len__(self):
+        return len(self._entries)
+
+    def get(self, key):
+        with self._lock:
+            entry = self._entries.pop(key, None)
+            if entry is not None:
+                self._entries[key] = entry
+            return entry
+
+    def set(self, key, entry):
+        if self.max_bytes is not None and entry.size > self.max_bytes:
+            self.delete(key)
+            return
+        with self._lock:
+            old = self._entries.pop(key, None)
+            if old is not None:
+                self.size -= old.size
+            self._entries[key] = entry
+            self.size += entry.size
+            while (len(self._entries) > self.max_entries or
+                   (self.max_bytes is not None and self.size > self.max_bytes)):
+                self.size -= self._entries.popitem(last=False)[1].size
+
+    def delete(self, key):
+        with self._lock:
+            old = self._entries.pop(key, None)
+            if old is not None:
+                self.size -= old.size
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+            self.size = 0
+
+
+class SQLiteCache(Cache):
+    """Cache persisted in a SQLite database
+
+    When a size limit is exceeded the oldest entries are evicted first.
+    Entries are kept in a ``halopy_responses`` table, so the database left by
+    ``requests-cache``, which HaloPy used before, opens without clashing with
+    its ``responses`` table.
+
+    Args:
+        path  (Optional[str]): Database file. Default is ``cache.sqlite`` in
+            the current working directory.
+        max_entries (Optional[int]): Maximum number of entries, unbounded if
+            None (default).
+        max_bytes   (Optional[int]): Maximum total size of the entries'
+            content, unbounded if None (default).
+        fast_save  (Optional[bool]): Don't wait for writes to reach the disk.
+            Faster, but the cache may be lost if the machine crashes.
+    """
+
+    def __init__(self, path='cache.sqlite', max_entries=None, max_bytes=None, fast_save=False):
+        self.path = path
+        self.max_entries = max_entries
+        self.max_bytes = max_bytes
+        self._lock = threading.Lock()
+        self._db = sqlite3.connect(path, check_same_thread=False)
+        if fast_save:
+            self._db.execute('PRAGMA synchronous = OFF')
+        with self._db:
+            self._db.execute('CREATE TABLE IF NOT EXISTS halopy_responses ('
+                             'key TEXT PRIMARY KEY, url TEXT, status INTEGER, headers TEXT, '
+                             'content BLOB, expires REAL, size INTEGER, stamp REAL)')
+            self._db.execute('CREATE INDEX IF NOT EXISTS halopy_responses_stamp '
+                             'ON halopy_responses (stamp)')
+        self._count, self.size = self._db.execute(
+            'SELECT COUNT(*), COALESCE(SUM(size), 0) FROM halopy_responses').fetchone()
+
+    def __len__(self):
+        return self._count
+
+    def get(self, key):
+        with self._lock:
+            row = self._db.execute('SELECT url, status, headers, content, expires '
+                                   'FROM halopy_responses WHERE key = ?', (key,)).fetchone()
+        if row is None:
+            return None
+        url, status, headers, content, expires = row
+        return CacheEntry(url, status, json.loads(headers), bytes(content), expires)
+
+    def _remove(self, key):
+        row = self._db.execute('SELECT size FROM halopy_responses WHERE key = ?',
+                               (key,)).fetchone()
+        if row is not None:
+            self._db.execute('DELETE FROM halopy_responses WHERE key = ?', (key,))
+            self._count -= 1
+            self.size -= row[0]
+
+    def set(self, key, entry):
+        with self._lock, self._db:
+            self._remove(key)
+            if self.max_bytes is not None and entry.size > self.max_bytes:
+                return
+            self._db.execute('INSERT INTO halopy_responses VALUES (?, ?, ?, ?, ?, ?, ?, ?)', (
+                key, entry.url, entry.status, json.dumps(entry.headers),
+                sqlite3.Binary(entry.content), entry.expires, entry.size, time.time()))
+            self._count += 1
+            self.size += entry.size
+            while ((self.max_entries is not None and self._count > self.max_entries) or
+                   (self.max_bytes is not None and self.size > self.max_bytes)):
+                key, size = self._db.execute('SELECT key, size FROM halopy_responses '
+                                             'ORDER BY stamp LIMIT 1').fetchone()
+                self._db.execute('DELETE FROM halopy_responses WHERE key = ?', (key,))
+                self._count -= 1
+                self.size -= size
+
+    def delete(self, key):
+        with self._lock, self._db:
+            self._remove(key)
+
+    def clear(self):
+        with self._lock, self._db:
+            self._db.execute('DELETE FROM halopy_responses')
+            self._count = self.size = 0
+
+    def close(self):
+        with self._lock:
+            self._db.close()
+
+
+class TieredCache(Cache):
+    """Cache made of a fast tier in front of a slower, larger tier
+
+    Entries are written to both tiers. Lookups try the front tier first and
+    copy entries found only in the back tier to the front, so hot entries
+    are served without touching the back tier at all.
+
+    Args:
+        front (Cache): Fast tier, usually a :class:`MemoryCache`
+        back  (Cache): Slow tier, usually a :class:`SQLiteCache`
+    """
+
+    def __init__(self, front, back):
+        self.front = front
+        self.back = back
+
+    def get(self, key):
+        entry = self.front.get(key)
+        if entry is None:
+            entry = self.back.get(key)
+            if entry is not None:
+                self.front.set(key, entry)
+        return entry
+
+    def set(self, key, entry):
+        self.front.set(key, entry)
+        self.back.set(key, entry)
+
+    def delete(self, key):
+        self.front.delete(key)
+        self.back.delete(key)
+
+    def clear(self):
+        self.front.clear()
+        self.back.clear()
+
+    def close(self):
+        self.front.close()
+        self.back.close()
+
+
+_MEMORY_OPTIONS = ('memory_entries', 'memory_bytes')
+_SQLITE_OPTIONS = ('cache_name', 'disk_entries', 'disk_bytes', 'fast_save')
+
+
+def create_cache(backend='sqlite', **options):
+    """Create a cache from a backend name.
+
+    Args:
+        backend (Optional[str|Cache]): ``memory`` for a :class:`MemoryCache`,
+            ``sqlite`` for a :class:`MemoryCache` in front of a
+            :class:`SQLiteCache`, or an existing :class:`Cache` which is
+            returned as-is.
+        **options: Cache options. ``memory_entries`` and ``memory_bytes`` size
+            the memory tier; ``cache_name`` (file name without the
+            ``.sqlite`` extension), ``disk_entries``, ``disk_bytes`` and
+            ``fast_save`` configure the SQLite tier.
+
+    Returns:
+        Cache: The cache
+
+    Raises:
+        HaloPyError: If an option is not accepted by the backend
+    """
+    name = backend
+    if isinstance(backend, Cache):
+        name, accepted = type(backend).__name__, ()
+    elif backend == 'memory':
+        accepted = _MEMORY_OPTIONS
+    elif backend == 'sqlite':
+        accepted = _MEMORY_OPTIONS + _SQLITE_OPTIONS
+    else:
+        raise ValueError('Unsupported cache backend {0!r}'.format(backend))
+    unknown = sorted(set(options) - set(accepted))
+    if unknown:
+        raise halopy.HaloPyError('Unsupported options for the {0} cache backend: {1}'.format(
+            name, ', '.join(unknown)))
+    if isinstance(backend, Cache):
+        return backend
+    memory_options = {}
+    for option in ('entries', 'bytes'):
+        if 'memory_' + option in options:
+            memory_options['max_' + option] = options.pop('memory_' + option)
+    memory = MemoryCache(**memory_options)
+    if backend == 'memory':
+        return memory
+    return TieredCache(memory, SQLiteCache(
+        '{0}.sqlite'.format(options.get('cache_name', 'cache')),
+        options.get('disk_entries'), options.get('disk_bytes'),
+        options.get('fast_save', False)))
@@ -0,0 +1,185 @@
+# coding=utf-8
+"""
+Columnar export of match details and service records.
+
+Results are flattened in a single pass into :class:`Table` columns of plain
+Python values, which :func:`to_numpy` turns into NumPy structured arrays and
+:func:`to_arrow` into Arrow tables, so aggregations run vectorized::
+
+    players = to_numpy(match_tables(matches))['players']
+    kd = players['kills'].sum() / players['deaths'].sum()
+
+NumPy and pyarrow are optional, they are only imported by the functions
+that need them.
+
+.. moduleauthor:: Max Gurela <maxpowa@outlook.com>
+
+Licensed under the Eiffel Forum License 2
+"""
+from __future__ import unicode_literals, absolute_import, print_function, division
+
+import collections
+import itertools
+
+import halopy
+
+from halopy.models import PlayerMatchStats, ServiceRecord, _text
+
+
+class Table(object):
+    """Columns of equal length
+
+    Args:
+        fields (list): ``(name, type)`` tuples, ``type`` being ``int``,
+            ``float``, ``bool`` or text
+    """
+
+    def __init__(self, fields):
+        self.types = collections.OrderedDict(fields)
+        self.columns = collections.OrderedDict((name, []) for name in self.types)
+
+    def __len__(self):
+        for column in self.columns.values():
+            return len(column)
+        return 0
+
+    def append(self, *values):
+        """Add a row, values in column order"""
+        for column, value in zip(self.columns.values(), values):
+            column.append(value)
+
+
+_WEAPON_FIELDS = (
+    ('stock_id', ('WeaponId', 'StockId'), int),
+    ('shots_fired', ('TotalShotsFired',), int),
+    ('shots_landed', ('TotalShotsLanded',), int),
+    ('headshots', ('TotalHeadshots',), int),
+    ('kills', ('TotalKills',), int),
+    ('damage', ('TotalDamageDealt',), float),
+    ('possession_time', ('TotalPossessionTime',), _text),
+)
+
+
+def _get(data, path, kind):
+    for key in path:
+        if data is None:
+            return None
+        data = data.get(key)
+    return data if data is None else kind(data)
+
+
+def _wrapped(result):
+    return result._wrap if isinstance(result, halopy.HaloPyResult) else result
+
+
+def match_tables(matches, match_ids=None):
+    """Flatten match details into tables.
+
+    Args:
+        matches (iterable[HaloPyResult|dict]): Match details
+        match_ids (Optional[iterable[str]]): Id of each match. If unspecified
+            the match's ``Id.MatchId`` is used when present, its position
+            otherwise.
+
+    Returns:
+        dict: ``players`` table with a row per player per match and the
+        :class:`~halopy.models.PlayerMatchStats` columns, ``medals`` table
+        with a row per medal kind per player, and ``weapons`` table with a
+        row per weapon per player. Every row starts with ``match_id`` and
+        every child row with the player's ``gamertag``.
+    """
+    players = Table([('match_id', _text)] + list(zip(PlayerMatchStats.fields,
+                                                      PlayerMatchStats.types)))
+    medals = Table([('match_id', _text), ('gamertag', _text), ('medal_id', int),
+                    ('count', int)])
+    weapons = Table([('match_id', _text), ('gamertag', _text)] +
+                    [(name, kind) for name, path, kind in _WEAPON_FIELDS])
+    if match_ids is None:
+        match_ids = itertools.repeat(None)
+    for index, (match, match_id) in enumerate(zip(matches, match_ids)):
+        match = _wrapped(match)
+        if match_id is None:
+            match_id = _get(match, ('Id', 'MatchId'), _text) or _text(index)
+        for player in match.get('PlayerStats', ()):
+            row = PlayerMatchStats.from_dict(player)
+            players.append(match_id, *[getattr(row, name) for name in row.fields])
+            for award in player.get('MedalAwards', ()):
+                medals.append(match_id, row.gamertag, _get(award, ('MedalId',), int),
+                              _get(award, ('Count',), int))
+            for weapon in player.get('WeaponStats', ()):
+                weapons.append(match_id, row.gamertag,
+                               *[_get(weapon, path, kind) for name, path, kind in _WEAPON_FIELDS])
+    return {'players': players, 'medals': medals, 'weapons': weapons}
+
+
+def service_record_table(records):
+    """Flatten service records into a table.
+
+    Args:
+        records (iterable[HaloPyResult|dict]): Service records, e.g. from
+            :meth:`HaloPy.iter_players_service_record`
+
+    Returns:
+        Table: A row per record with the
+        :class:`~halopy.models.ServiceRecord` columns
+    """
+    table = Table(zip(ServiceRecord.fields, ServiceRecord.types))
+    for record in records:
+        row = ServiceRecord.from_dict(_wrapped(record))
+        table.append(*[getattr(row, name) for name in row.fields])
+    return table
+
+
+def _numpy_column(np, values, kind):
+    if kind is bool:
+        return np.array([bool(v) for v in values], dtype='?'), '?'
+    if kind is int:
+        return np.array([0 if v is None else v for v in values], dtype='i8'), 'i8'
+    if kind is float:
+        return np.array([np.nan if v is None else v for v in values], dtype='f8'), 'f8'
+    values = ['' if v is None else v for v in values]
+    dtype = 'U{0}'.format(max([len(v) for v in values] or [1]) or 1)
+    return np.array(values, dtype=dtype), dtype
+
+
+def to_numpy(tables):
+    """Convert tables to NumPy structured arrays.
+
+    Missing values become 0 in integer columns, NaN in float columns, False
+    in boolean columns and an empty string in text columns, which are
+    fixed-width unicode.
+
+    Args:
+        tables (Table|dict): A table, or a dict of tables
+
+    Returns:
+        ndarray|dict: Structured array(s), keyed like ``tables``
+    """
+    import numpy as np
+    if isinstance(tables, dict):
+        return dict((name, to_numpy(table)) for name, table in tables.items())
+    columns = [_numpy_column(np, tables.columns[name], kind)
+               for name, kind in tables.types.items()]
+    array = np.empty(len(tables), dtype=[(str(name), dtype) for name, (column, dtype)
+                                         in zip(tables.types, columns)])
+    for name, (column, dtype) in zip(tables.types, columns):
+        array[str(name)] = column
+    return array
+
+
+def to_arrow(tables):
+    """Convert tables to Arrow tables, missing values become nulls.
+
+    Args:
+        tables (Table|dict): A table, or a dict of tables
+
+    Returns:
+        pyarrow.Table|dict: Arrow table(s), keyed like ``tables``
+    """
+    import pyarrow as pa
+    if isinstance(tables, dict):
+        return dict((name, to_arrow(table)) for name, table in tables.items())
+    arrow_types = {int: pa.int64(), float: pa.float64(), bool: pa.bool_()}
+    return pa.table(collections.OrderedDict(
+        (name, pa.array(tables.columns[name], type=arrow_types.get(kind, pa.string())))
+        for name, kind in tables.types.items()))
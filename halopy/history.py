@@ -0,0 +1,243 @@
+# coding=utf-8
+"""
+Lazy iteration over a player's match history.
+
+.. moduleauthor:: Max Gurela <maxpowa@outlook.com>
+
+Licensed under the Eiffel Forum License 2
+"""
+from __future__ import unicode_literals, absolute_import, print_function, division
+
+import collections
+import datetime
+import sqlite3
+import threading
+
+from concurrent.futures import ThreadPoolExecutor
+
+import halopy
+
+
+def parse_date(value):
+    """Parse an ISO 8601 timestamp from the Halo API into a naive UTC
+    datetime. Datetimes are returned as-is, converted to UTC if aware."""
+    if isinstance(value, datetime.datetime):
+        if value.utcoffset() is not None:
+            value = (value - value.utcoffset()).replace(tzinfo=None)
+        return value
+    value = value.rstrip('Z')
+    if '.' in value:
+        # strptime only takes microseconds, the API sends up to 7 digits
+        value, fraction = value.split('.', 1)
+        value = '{0}.{1}'.format(value, fraction[:6])
+        return datetime.datetime.strptime(value, '%Y-%m-%dT%H:%M:%S.%f')
+    return datetime.datetime.strptime(value, '%Y-%m-%dT%H:%M:%S')
+
+
+def match_id(match):
+    """Match id of a match summary from the player matches endpoint"""
+    return match.Id['MatchId']
+
+
+def match_date(match):
+    """Completion date of a match summary as a naive UTC datetime"""
+    return parse_date(match.MatchCompletedDate['ISO8601Date'])
+
+
+class MatchHistory(object):
+    """Iterator over a player's matches, newest first
+
+    Pages are requested lazily from :meth:`HaloPy.get_player_matches`. While
+    a page is being consumed the next one is fetched in the background, so
+    there is no idle gap between pages.
+
+    :attr:`position` is the index of the next match to be yielded; pass it
+    as ``start`` to resume an interrupted walk. Note that new matches played
+    in the meantime shift every index.
+
+    Args:
+        api (HaloPy): Client to request pages with
+        player_gt (str): Player gamertag
+        modes (Optional[str]): Comma-delimited game modes, all if unspecified
+        start (Optional[int]): Index to start from. Default is 0.
+        until (Optional[datetime|str]): Stop at the first match completed
+            before this time
+        until_match_id (Optional[str]): Stop when this match is reached, it
+            is not yielded
+        prefetch (Optional[bool]): Fetch the next page in the background.
+            Default is True.
+        rate_timeout (Optional[float]): Seconds each page request waits for
+            the rate limiter, None (default) waits indefinitely.
+    """
+
+    page_size = 25
+
+    def __init__(self, api, player_gt, modes=None, start=0, until=None, until_match_id=None,
+                 prefetch=True, rate_timeout=None):
+        self.player_gt = player_gt
+        self.modes = modes
+        self.position = start
+        self.until = parse_date(until) if until is not None else None
+        self.until_match_id = until_match_id
+        self._fetch = api._waiting(api.get_player_matches, rate_timeout)
+        self._executor = ThreadPoolExecutor(1) if prefetch else None
+        self._page = collections.deque()
+        self._next_page = None
+        self._page_start = start
+        self._done = False
+
+    def _request(self, start):
+        if self._executor is None:
+            return self._fetch(self.player_gt, self.modes, start, self.page_size)
+        return self._executor.submit(self._fetch, self.player_gt, self.modes, start,
+                                     self.page_size)
+
+    def _load(self):
+        if self._next_page is None:
+            self._next_page = self._request(self._page_start)
+        page = self._next_page
+        if self._executor is not None:
+            page = page.result()
+        self._next_page = None
+        self._page = collections.deque(halopy.HaloPyResult(match) for match in page.Results)
+        self._page_start += len(self._page)
+        if len(self._page) < self.page_size:
+            self._done = True
+        elif self._executor is not None:
+            self._next_page = self._request(self._page_start)
+
+    def __iter__(self):
+        return self
+
+    def __next__(self):
+        if not self._page:
+            if self._done:
+                self.close()
+                raise StopIteration
+            self._load()
+            if not self._page:
+                self.close()
+                raise StopIteration
+        match = self._page[0]
+        if self.until_match_id is not None and match_id(match) == self.until_match_id:
+            self.close()
+            raise StopIteration
+        if self.until is not None and match_date(match) < self.until:
+            self.close()
+            raise StopIteration
+        self._page.popleft()
+        self.position += 1
+        return match
+
+    next = __next__
+
+    def close(self):
+        """Stop iterating and discard any page being prefetched."""
+        self._done = True
+        self._page.clear()
+        if self._executor is not None:
+            if self._next_page is not None:
+                self._next_page.cancel()
+            self._executor.shutdown(wait=False)
+        self._next_page = None
+
+
+class WatermarkStore(object):
+    """Base class for stores of the newest match synced per player
+
+    A watermark is a dict with the ``MatchId`` and ``Date`` (ISO 8601) of the
+    newest match seen. Subclasses implement :meth:`get` and :meth:`set`.
+    """
+
+    def get(self, key):
+        """Return the watermark stored for ``key``, or None"""
+        raise NotImplementedError
+
+    def set(self, key, watermark):
+        """Store the watermark for ``key``"""
+        raise NotImplementedError
+
+
+class MemoryWatermarkStore(WatermarkStore):
+    """Watermark store kept in a dict, lost when the process exits"""
+
+    def __init__(self):
+        self._marks = {}
+        self._lock = threading.Lock()
+
+    def get(self, key):
+        with self._lock:
+            return self._marks.get(key)
+
+    def set(self, key, watermark):
+        with self._lock:
+            self._marks[key] = dict(watermark)
+
+
+class SQLiteWatermarkStore(WatermarkStore):
+    """Watermark store persisted in a SQLite database
+
+    Args:
+        path (Optional[str]): Database file, ``watermarks.sqlite`` in the
+            current working directory if unspecified.
+    """
+
+    def __init__(self, path='watermarks.sqlite'):
+        self.path = path
+        self._lock = threading.Lock()
+        self._db = sqlite3.connect(path, check_same_thread=False)
+        with self._db:
+            self._db.execute('CREATE TABLE IF NOT EXISTS watermarks '
+                             '(key TEXT PRIMARY KEY, match_id TEXT, date TEXT)')
+
+    def get(self, key):
+        with self._lock:
+            row = self._db.execute('SELECT match_id, date FROM watermarks WHERE key = ?',
+                                   (key,)).fetchone()
+        if row is None:
+            return None
+        return {'MatchId': row[0], 'Date': row[1]}
+
+    def set(self, key, watermark):
+        with self._lock, self._db:
+            self._db.execute('INSERT OR REPLACE INTO watermarks VALUES (?, ?, ?)',
+                             (key, watermark['MatchId'], watermark['Date']))
+
+    def close(self):
+        """Close the database connection."""
+        self._db.close()
+
+
+def sync_player_matches(api, player_gt, store, modes=None, since=None, rate_timeout=None):
+    """Return the matches a player completed since the last sync.
+
+    Pages through the player's history only until the stored watermark is
+    reached, then moves the watermark to the newest match. Without a
+    watermark the whole history is returned, back to ``since`` if given.
+
+    Args:
+        api (HaloPy): Client to request pages with
+        player_gt (str): Player gamertag
+        store (WatermarkStore): Store of per player watermarks
+        modes (Optional[str]): Comma-delimited game modes, all if unspecified
+        since (Optional[datetime|str]): Oldest match to return on first sync
+        rate_timeout (Optional[float]): Seconds each page request waits for
+            the rate limiter, None (default) waits indefinitely.
+
+    Returns:
+        list[HaloPyResult]: New match summaries, newest first
+    """
+    key = '{0}|{1}'.format(player_gt.lower(), modes or '')
+    mark = store.get(key)
+    until_match_id = None
+    if mark is not None:
+        until_match_id = mark['MatchId']
+        since = mark['Date']
+    # No prefetch, the page after the watermark is usually never needed
+    history = MatchHistory(api, player_gt, modes, until=since, until_match_id=until_match_id,
+                           prefetch=False, rate_timeout=rate_timeout)
+    matches = list(history)
+    if matches:
+        store.set(key, {'MatchId': match_id(matches[0]),
+                        'Date': matches[0].MatchCompletedDate['ISO8601Date']})
+    return matches
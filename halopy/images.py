@@ -0,0 +1,404 @@
+# coding=utf-8
+"""
+Content-addressed on-disk store of player emblems and spartan images.
+
+Images are streamed from :meth:`HaloPy.stream` straight to disk, bypassing
+the response cache, and stored once per distinct content under their SHA-256
+digest, so players sharing an emblem share its file. A small SQLite index maps
+each (kind, gamertag, size, crop) to its digest and validators, which are used
+to refresh stale images with a conditional request. Interrupted downloads are
+resumed with a byte range request.
+
+Give a store to ``HaloPy(image_store=...)`` to have
+:meth:`~halopy.HaloPy.get_player_emblem` and
+:meth:`~halopy.HaloPy.get_player_spartan_image` go through it.
+
+.. moduleauthor:: Max Gurela <maxpowa@outlook.com>
+
+Licensed under the Eiffel Forum License 2
+"""
+from __future__ import unicode_literals, absolute_import, print_function, division
+
+import hashlib
+import mmap
+import os
+import sqlite3
+import threading
+import time
+
+from contextlib import closing
+
+import requests
+
+import halopy
+
+from halopy.pool import SingleFlight, imap
+from halopy.ratelimit import monotonic
+
+_replace = getattr(os, 'replace', os.rename)
+
+
+class StoredImage(object):
+    """Image held by an :class:`ImageStore`
+
+    Args:
+        key           (str): Index key, see :meth:`ImageStore.key`
+        digest        (str): Hex SHA-256 digest of the content
+        path          (str): File holding the content
+        content_type  (str): Content type sent by the server
+        etag          (str): ETag sent by the server, if any
+        last_modified (str): Last-Modified date sent by the server, if any
+        length        (int): Size of the content in bytes
+        stamp       (float): Unix time the image was last fetched or
+            revalidated
+    """
+
+    __slots__ = ('key', 'digest', 'path', 'content_type', 'etag', 'last_modified', 'length',
+                 'stamp')
+
+    def __init__(self, key, digest, path, content_type, etag, last_modified, length, stamp):
+        self.key = key
+        self.digest = digest
+        self.path = path
+        self.content_type = content_type
+        self.etag = etag
+        self.last_modified = last_modified
+        self.length = length
+        self.stamp = stamp
+
+    def fresh(self, ttl, now=None):
+        """bool: True if the image was fetched less than ``ttl`` seconds ago,
+        always True if ``ttl`` is None"""
+        if ttl is None:
+            return True
+        return (time.time() if now is None else now) - self.stamp < ttl
+
+    def validators(self):
+        """dict: Conditional request headers to revalidate the image"""
+        headers = {}
+        if self.etag:
+            headers['If-None-Match'] = self.etag
+        if self.last_modified:
+            headers['If-Modified-Since'] = self.last_modified
+        return headers
+
+    def __repr__(self):
+        return '<StoredImage {0} {1}>'.format(self.key, self.digest[:12])
+
+
+class ImageStore(object):
+    """Content-addressed store of profile images
+
+    Args:
+        path (Optional[str]): Directory of the store, created if missing.
+            Default is ``images`` in the current working directory.
+        ttl (Optional[float]): Seconds an image is used before it is
+            revalidated, None to never revalidate. Default is a day.
+        fast_save (Optional[bool]): Don't wait for index writes to reach the
+            disk.
+    """
+
+    #: Profile image endpoints
+    kinds = ('emblem', 'spartan')
+
+    #: Sizes the profile image endpoints accept
+    sizes = (95, 128, 190, 256, 512)
+
+    #: Crops the spartan image endpoint accepts
+    crops = ('full', 'portrait')
+
+    #: Bytes written to disk at a time while downloading
+    chunk_size = 64 * 1024
+
+    def __init__(self, path='images', ttl=86400, fast_save=False):
+        self.path = path
+        self.ttl = ttl
+        for directory in ('blobs', 'partial'):
+            directory = os.path.join(path, directory)
+            if not os.path.isdir(directory):
+                os.makedirs(directory)
+        self._lock = threading.Lock()
+        self._flights = SingleFlight()
+        self._db = sqlite3.connect(os.path.join(path, 'index.sqlite'), check_same_thread=False)
+        if fast_save:
+            self._db.execute('PRAGMA synchronous = OFF')
+        with self._db:
+            self._db.execute('CREATE TABLE IF NOT EXISTS images (key TEXT PRIMARY KEY, '
+                             'digest TEXT, content_type TEXT, etag TEXT, last_modified TEXT, '
+                             'length INTEGER, stamp REAL)')
+            self._db.execute('CREATE INDEX IF NOT EXISTS images_digest ON images (digest)')
+            self._db.execute('CREATE TABLE IF NOT EXISTS partials (key TEXT PRIMARY KEY, '
+                             'validator TEXT)')
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        self.close()
+
+    def close(self):
+        """Close the index."""
+        with self._lock:
+            self._db.close()
+
+    def __len__(self):
+        with self._lock:
+            return self._db.execute('SELECT COUNT(*) FROM images').fetchone()[0]
+
+    @staticmethod
+    def key(kind, player_gt, size=None, crop=None):
+        """str: Index key of an image, gamertags are case-insensitive"""
+        return '{0}|{1}|{2}|{3}'.format(kind, player_gt.lower(), size or '', crop or '')
+
+    def _blob(self, digest):
+        return os.path.join(self.path, 'blobs', digest[:2], digest)
+
+    def _partial(self, key):
+        name = hashlib.sha1(key.encode('utf-8')).hexdigest()
+        return os.path.join(self.path, 'partial', name)
+
+    def get(self, kind, player_gt, size=None, crop=None):
+        """Return the stored image, fresh or not, or None"""
+        key = self.key(kind, player_gt, size, crop)
+        with self._lock:
+            row = self._db.execute('SELECT digest, content_type, etag, last_modified, length, '
+                                   'stamp FROM images WHERE key = ?', (key,)).fetchone()
+        if row is None:
+            return None
+        return StoredImage(key, row[0], self._blob(row[0]), *row[1:])
+
+    def open(self, image):
+        """Memory-map the content of a stored image.
+
+        The map is read-only and stays valid even if the image is replaced or
+        pruned meanwhile, close it when done.
+
+        Returns:
+            mmap: Image content, or an empty bytes object for an empty image
+        """
+        with open(image.path, 'rb') as f:
+            if not image.length:
+                return b''
+            return mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+
+    def read(self, image):
+        """bytes: Content of a stored image"""
+        with open(image.path, 'rb') as f:
+            return f.read()
+
+    def emblem(self, api, player_gt, size=None, refresh=False):
+        """Get a player's emblem, see :meth:`fetch`."""
+        return self.fetch(api, 'emblem', player_gt, size, refresh=refresh)
+
+    def spartan_image(self, api, player_gt, size=None, crop=None, refresh=False):
+        """Get a player's spartan image, see :meth:`fetch`."""
+        return self.fetch(api, 'spartan', player_gt, size, crop, refresh)
+
+    def fetch(self, api, kind, player_gt, size=None, crop=None, refresh=False):
+        """Get an image, downloading it unless it is stored and fresh.
+
+        A stale image is revalidated with a conditional request and only
+        downloaded again if it changed. A download interrupted earlier is
+        resumed where it stopped when the server supports byte ranges.
+        Concurrent fetches of the same image share a single download.
+
+        Args:
+            api (HaloPy): Client to request the image with
+            kind (str): ``emblem`` or ``spartan``
+            player_gt (str): Player gamertag
+            size (Optional[int]): One of 95, 128, 190, 256 or 512, the
+                server's default (256) if unspecified.
+            crop (Optional[str]): Spartan image crop, ``full`` or
+                ``portrait``.
+            refresh (Optional[bool]): Revalidate the image even if it is
+                fresh.
+
+        Returns:
+            StoredImage: The stored image
+
+        Raises:
+            ValueError: If the kind is unknown
+            HaloPyError: If the request fails
+        """
+        if kind not in self.kinds:
+            raise ValueError('Unknown image kind: {0!r}'.format(kind))
+        image = self.get(kind, player_gt, size, crop)
+        if image is not None and not refresh and image.fresh(self.ttl):
+            return image
+        return self._flights.do(self.key(kind, player_gt, size, crop), self._download,
+                                api, kind, player_gt, size, crop, image)
+
+    def _download(self, api, kind, player_gt, size, crop, image):
+        key = self.key(kind, player_gt, size, crop)
+        partial = self._partial(key)
+        with self._lock:
+            row = self._db.execute('SELECT validator FROM partials WHERE key = ?',
+                                   (key,)).fetchone()
+        offset = os.path.getsize(partial) if row and os.path.exists(partial) else 0
+
+        headers = {}
+        if offset:
+            headers['Range'] = 'bytes={0}-'.format(offset)
+            headers['If-Range'] = row[0]
+        elif image is not None:
+            headers.update(image.validators())
+
+        endpoint = 'profile/{t}/profiles/{gt}/{kind}'.format(t=api.title, gt=player_gt, kind=kind)
+        response = api.stream(endpoint, {'size': size, 'crop': crop}, headers)
+        with closing(response):
+            now = time.time()
+            if response.status_code == 304 and image is not None:
+                with self._lock, self._db:
+                    self._db.execute('UPDATE images SET stamp = ? WHERE key = ?', (now, key))
+                image.stamp = now
+                return image
+
+            digest = hashlib.sha256()
+            if response.status_code == 206 and offset:
+                with open(partial, 'rb') as f:
+                    for chunk in iter(lambda: f.read(self.chunk_size), b''):
+                        digest.update(chunk)
+                mode = 'ab'
+            else:
+                mode = 'wb'
+
+            etag = response.headers.get('ETag')
+            last_modified = response.headers.get('Last-Modified')
+            with self._lock, self._db:
+                # Remember what the partial file is a part of to resume it
+                if etag or last_modified:
+                    self._db.execute('INSERT OR REPLACE INTO partials VALUES (?, ?)',
+                                     (key, etag or last_modified))
+                else:
+                    self._db.execute('DELETE FROM partials WHERE key = ?', (key,))
+            with open(partial, mode) as f:
+                for chunk in response.iter_content(self.chunk_size):
+                    digest.update(chunk)
+                    f.write(chunk)
+                length = f.tell()
+
+        digest = digest.hexdigest()
+        blob = self._blob(digest)
+        if os.path.exists(blob):
+            # Same content as another image
+            os.remove(partial)
+        else:
+            if not os.path.isdir(os.path.dirname(blob)):
+                try:
+                    os.makedirs(os.path.dirname(blob))
+                except OSError:  # Created by another thread meanwhile
+                    pass
+            _replace(partial, blob)
+
+        image = StoredImage(key, digest, blob, response.headers.get('Content-Type'), etag,
+                            last_modified, length, now)
+        with self._lock, self._db:
+            self._db.execute('DELETE FROM partials WHERE key = ?', (key,))
+            self._db.execute('INSERT OR REPLACE INTO images VALUES (?, ?, ?, ?, ?, ?, ?)', (
+                key, digest, image.content_type, etag, last_modified, length, now))
+        return image
+
+    def prefetch(self, api, player_gts, kinds=('emblem',), sizes=None, crops=(None,), workers=4,
+                 rate_timeout=None, progress=None):
+        """Fetch the images of many players, e.g. to warm the store for a
+        leaderboard.
+
+        Every combination of gamertag, kind, size and crop (crops only apply
+        to spartan images) is fetched on ``workers`` threads within the rate
+        limit. Images already stored and fresh are skipped without a request,
+        stale ones are revalidated. Gamertags are deduplicated
+        case-insensitively. Failures are counted and reported, not raised.
+
+        Args:
+            api (HaloPy): Client to request the images with
+            player_gts (iterable[str]): Player gamertags
+            kinds (Optional[iterable[str]]): ``emblem`` and/or ``spartan``,
+                only emblems by default.
+            sizes (Optional[iterable[int]]): Image sizes, all of
+                :attr:`sizes` by default. None in the list is the server's
+                default size.
+            crops (Optional[iterable[str]]): Spartan image crops, the
+                server's default (``full``) by default.
+            workers (Optional[int]): Number of concurrent downloads
+            rate_timeout (Optional[float]): Seconds each request waits for
+                the rate limiter, None (default) waits indefinitely.
+            progress (Optional[callable]): Called with the statistics below
+                after each image.
+
+        Returns:
+            dict: Statistics: ``total`` images, ``done`` so far, of which
+            ``downloaded``, ``revalidated``, ``skipped`` and ``failed``,
+            ``bytes`` downloaded, ``elapsed`` seconds, ``images_per_second``,
+            ``bytes_per_second`` and ``errors``, a list of
+            ``(key, message)`` of the failed images.
+        """
+        for kind in kinds:
+            if kind not in self.kinds:
+                raise ValueError('Unknown image kind: {0!r}'.format(kind))
+        sizes = self.sizes if sizes is None else tuple(sizes)
+        crops = tuple(crops)
+        seen = set()
+        gamertags = []
+        for gt in player_gts:
+            if gt.lower() not in seen:
+                seen.add(gt.lower())
+                gamertags.append(gt)
+        wanted = [(kind, gt, size, crop) for gt in gamertags for kind in kinds for size in sizes
+                  for crop in (crops if kind == 'spartan' else (None,))]
+
+        stats = {'total': len(wanted), 'done': 0, 'downloaded': 0, 'revalidated': 0,
+                 'skipped': 0, 'failed': 0, 'bytes': 0, 'elapsed': 0.0,
+                 'images_per_second': 0.0, 'bytes_per_second': 0.0, 'errors': []}
+        started = monotonic()
+
+        def report(outcome):
+            stats[outcome] += 1
+            stats['done'] += 1
+            stats['elapsed'] = monotonic() - started
+            if stats['elapsed'] > 0:
+                stats['images_per_second'] = stats['done'] / stats['elapsed']
+                stats['bytes_per_second'] = stats['bytes'] / stats['elapsed']
+            if progress is not None:
+                progress(stats)
+
+        def stale():
+            for item in wanted:
+                image = self.get(*item)
+                if image is not None and image.fresh(self.ttl):
+                    report('skipped')
+                else:
+                    yield item, image
+
+        fetch = api._waiting(self.fetch, rate_timeout)
+        for (item, previous), future in imap(lambda entry: fetch(api, *entry[0]), stale(),
+                                             workers):
+            try:
+                image = future.result()
+            except (halopy.HaloPyError, requests.RequestException, EnvironmentError) as ex:
+                stats['errors'].append((self.key(*item), str(ex)))
+                report('failed')
+                continue
+            if previous is not None and previous.digest == image.digest:
+                report('revalidated')
+            else:
+                stats['bytes'] += image.length
+                report('downloaded')
+        stats['elapsed'] = monotonic() - started
+        return stats
+
+    def prune(self):
+        """Delete the files no image refers to anymore.
+
+        Returns:
+            int: Number of files deleted
+        """
+        with self._lock:
+            digests = set(row[0] for row in self._db.execute('SELECT DISTINCT digest FROM images'))
+        removed = 0
+        blobs = os.path.join(self.path, 'blobs')
+        for directory in os.listdir(blobs):
+            for name in os.listdir(os.path.join(blobs, directory)):
+                if name not in digests:
+                    os.remove(os.path.join(blobs, directory, name))
+                    removed += 1
+        return removed
@@ -0,0 +1,258 @@
+# coding=utf-8
+"""
+Instrumentation hooks for the HaloPy request path.
+
+Pass an :class:`Instrument` to ``HaloPy(instrument=...)`` to be told how long
+each phase of a request takes and how often each event occurs::
+
+    metrics = Metrics()
+    api = HaloPy(api_key, instrument=metrics)
+    ...
+    print(metrics.prometheus())
+
+Phases, timed in seconds:
+
+* ``request``: the whole of :meth:`HaloPy.request`
+* ``cache``: looking the response up in the cache
+* ``limiter``: waiting for a rate limit token
+* ``network``: sending the request and reading the response
+* ``decode``: decoding JSON bodies (results decoded lazily on first access
+  are not timed)
+* ``result``: building the ``HaloPyResult`` objects of listings
+
+Events: ``cache_hit``, ``cache_miss``, ``revalidated`` (304), ``throttled``
+(429 from the server), ``error`` (other status of 400 and above).
+
+Endpoints are reported as templates such as ``stats/h5/{mode}/matches/{id}``,
+see :func:`endpoint_name`. Without an instrument the request path only pays
+for a None check.
+
+.. moduleauthor:: Max Gurela <maxpowa@outlook.com>
+
+Licensed under the Eiffel Forum License 2
+"""
+from __future__ import unicode_literals, absolute_import, print_function, division
+
+import bisect
+import collections
+import re
+import socket
+import threading
+import time
+
+timer = getattr(time, 'perf_counter', time.time)
+
+_endpoints = [
+    (re.compile(r'^(metadata/[^/]+/metadata/[^/]+)/[^/]+$'), r'\1/{id}'),
+    (re.compile(r'^(profile/[^/]+/profiles)/[^/]+/'), r'\1/{player}/'),
+    (re.compile(r'^(stats/[^/]+/players)/[^/]+/'), r'\1/{player}/'),
+    (re.compile(r'^(stats/[^/]+)/(arena|campaign|custom|warzone)/matches/[^/]+$'),
+     r'\1/{mode}/matches/{id}'),
+    (re.compile(r'^(stats/[^/]+/servicerecords)/[^/]+$'), r'\1/{mode}'),
+]
+
+
+def endpoint_name(endpoint):
+    """str: Endpoint with its gamertags, ids and game modes replaced by
+    placeholders, so that metrics are grouped per endpoint"""
+    endpoint = endpoint.split('?', 1)[0]
+    for pattern, template in _endpoints:
+        endpoint = pattern.sub(template, endpoint)
+    return endpoint
+
+
+class Instrument(object):
+    """Base class of instruments, ignoring everything
+
+    Subclasses override :meth:`timing` and :meth:`count`. They are called on
+    the threads making requests, so they must be thread-safe and fast.
+    """
+
+    def timing(self, phase, endpoint, seconds):
+        """Record the duration of a phase of a request to ``endpoint``."""
+
+    def count(self, event, endpoint, value=1):
+        """Record an event of a request to ``endpoint``."""
+
+
+class Instruments(Instrument):
+    """Forwards everything to several instruments, e.g. :class:`Metrics` and
+    :class:`StatsD`
+
+    Args:
+        *instruments (Instrument): Instruments to forward to
+    """
+
+    def __init__(self, *instruments):
+        self.instruments = instruments
+
+    def timing(self, phase, endpoint, seconds):
+        for instrument in self.instruments:
+            instrument.timing(phase, endpoint, seconds)
+
+    def count(self, event, endpoint, value=1):
+        for instrument in self.instruments:
+            instrument.count(event, endpoint, value)
+
+
+class Histogram(object):
+    """Bucketed distribution of durations, keeping the most recent samples
+    for percentiles
+
+    Args:
+        buckets (tuple): Upper bounds of the buckets in seconds
+        samples (Optional[int]): Number of recent samples kept
+    """
+
+    __slots__ = ('buckets', 'counts', 'count', 'sum', 'recent')
+
+    def __init__(self, buckets, samples=1024):
+        self.buckets = buckets
+        self.counts = [0] * len(buckets)
+        self.count = 0
+        self.sum = 0.0
+        self.recent = collections.deque(maxlen=samples)
+
+    def add(self, value):
+        index = bisect.bisect_left(self.buckets, value)
+        if index < len(self.counts):
+            self.counts[index] += 1
+        self.count += 1
+        self.sum += value
+        self.recent.append(value)
+
+    def percentile(self, q):
+        """float: ``q``-th percentile of the recent samples, None if there
+        are none"""
+        recent = sorted(self.recent)
+        if not recent:
+            return None
+        return recent[min(int(len(recent) * q / 100), len(recent) - 1)]
+
+
+class Metrics(Instrument):
+    """Instrument keeping counters and per endpoint histograms in memory
+
+    Args:
+        buckets (Optional[tuple]): Histogram bucket bounds in seconds
+        samples (Optional[int]): Recent samples kept per histogram for
+            percentiles
+    """
+
+    #: Default histogram bucket bounds, in seconds
+    buckets = (0.0001, 0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5,
+               1.0, 2.5, 5.0, 10.0)
+
+    def __init__(self, buckets=None, samples=1024):
+        if buckets is not None:
+            self.buckets = tuple(sorted(buckets))
+        self.samples = samples
+        self._lock = threading.Lock()
+        self.counters = collections.Counter()
+        self.histograms = {}
+
+    def timing(self, phase, endpoint, seconds):
+        with self._lock:
+            histogram = self.histograms.get((phase, endpoint))
+            if histogram is None:
+                histogram = self.histograms[phase, endpoint] = Histogram(self.buckets,
+                                                                         self.samples)
+            histogram.add(seconds)
+
+    def count(self, event, endpoint, value=1):
+        with self._lock:
+            self.counters[event, endpoint] += value
+
+    def reset(self):
+        """Forget everything recorded."""
+        with self._lock:
+            self.counters.clear()
+            self.histograms.clear()
+
+    def summary(self, percentiles=(50, 90, 99)):
+        """Snapshot of the metrics.
+
+        Returns:
+            dict: ``counters`` as ``{event: {endpoint: count}}`` and
+            ``timings`` as ``{phase: {endpoint: stats}}``, the stats being
+            the ``count``, ``sum`` and e.g. ``p50`` of the phase's durations
+            in seconds.
+        """
+        counters = collections.defaultdict(dict)
+        timings = collections.defaultdict(dict)
+        with self._lock:
+            for (event, endpoint), value in self.counters.items():
+                counters[event][endpoint] = value
+            for (phase, endpoint), histogram in self.histograms.items():
+                stats = {'count': histogram.count, 'sum': histogram.sum}
+                for q in percentiles:
+                    stats['p{0}'.format(q)] = histogram.percentile(q)
+                timings[phase][endpoint] = stats
+        return {'counters': dict(counters), 'timings': dict(timings)}
+
+    def prometheus(self, prefix='halopy'):
+        """str: Metrics in the Prometheus text exposition format"""
+        def labels(**values):
+            return ','.join('{0}="{1}"'.format(k, v.replace('\\', '\\\\').replace('"', '\\"'))
+                            for k, v in sorted(values.items()))
+
+        lines = []
+        with self._lock:
+            lines.append('# TYPE {0}_events_total counter'.format(prefix))
+            for (event, endpoint), value in sorted(self.counters.items()):
+                lines.append('{0}_events_total{{{1}}} {2}'.format(
+                    prefix, labels(event=event, endpoint=endpoint), value))
+            lines.append('# TYPE {0}_phase_seconds histogram'.format(prefix))
+            for (phase, endpoint), histogram in sorted(self.histograms.items()):
+                cumulative = 0
+                for bound, count in zip(histogram.buckets, histogram.counts):
+                    cumulative += count
+                    lines.append('{0}_phase_seconds_bucket{{{1}}} {2}'.format(
+                        prefix, labels(phase=phase, endpoint=endpoint, le=repr(bound)),
+                        cumulative))
+                lines.append('{0}_phase_seconds_bucket{{{1}}} {2}'.format(
+                    prefix, labels(phase=phase, endpoint=endpoint, le='+Inf'), histogram.count))
+                lines.append('{0}_phase_seconds_sum{{{1}}} {2!r}'.format(
+                    prefix, labels(phase=phase, endpoint=endpoint), histogram.sum))
+                lines.append('{0}_phase_seconds_count{{{1}}} {2}'.format(
+                    prefix, labels(phase=phase, endpoint=endpoint), histogram.count))
+        return '\n'.join(lines) + '\n'
+
+
+class StatsD(Instrument):
+    """Instrument sending every timing and event to a StatsD server over UDP
+
+    Timings are sent as ``{prefix}.{phase}.{endpoint}:{ms}|ms`` and events
+    as ``{prefix}.{event}.{endpoint}:{value}|c``, the endpoint's slashes
+    turned into dots. Send errors are ignored.
+
+    Args:
+        host (Optional[str]): StatsD server address
+        port (Optional[int]): StatsD server port
+        prefix (Optional[str]): Prefix of the metric names
+    """
+
+    def __init__(self, host='127.0.0.1', port=8125, prefix='halopy'):
+        self.address = (host, port)
+        self.prefix = prefix
+        self._socket = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+
+    def _name(self, kind, endpoint):
+        endpoint = re.sub(r'[^A-Za-z0-9_.-]', '', endpoint.replace('/', '.'))
+        return '{0}.{1}.{2}'.format(self.prefix, kind, endpoint)
+
+    def _send(self, line):
+        try:
+            self._socket.sendto(line.encode('utf-8'), self.address)
+        except (socket.error, OSError):
+            pass
+
+    def timing(self, phase, endpoint, seconds):
+        self._send('{0}:{1:.3f}|ms'.format(self._name(phase, endpoint), seconds * 1000))
+
+    def count(self, event, endpoint, value=1):
+        self._send('{0}:{1}|c'.format(self._name(event, endpoint), value))
+
+    def close(self):
+        """Close the socket."""
+        self._socket.close()
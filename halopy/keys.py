@@ -0,0 +1,268 @@
+# coding=utf-8
+"""
+Pool of Halo API subscription keys, each with its own rate limit budget.
+
+.. moduleauthor:: Max Gurela <maxpowa@outlook.com>
+
+Licensed under the Eiffel Forum License 2
+"""
+from __future__ import unicode_literals, absolute_import, print_function, division
+
+import threading
+
+from halopy.ratelimit import AdaptiveThrottle, RateLimiter, TokenBucket, monotonic
+from halopy.scheduler import PriorityScheduler
+
+
+class ApiKey(object):
+    """Subscription key of a :class:`KeyPool` and its usage
+
+    Args:
+        key (str): Halo API key
+        limiter (RateLimiter): Limiter of the key's budget
+    """
+
+    def __init__(self, key, limiter):
+        self.key = key
+        self.limiter = limiter
+        self.throttle = AdaptiveThrottle(limiter)
+        #: Requests sent with the key
+        self.requests = 0
+        #: Responses throttled with a 429
+        self.throttled = 0
+        #: 429 responses in a row
+        self.strikes = 0
+        #: Monotonic time the key is out of rotation until, if quarantined
+        self.quarantined_until = None
+        #: True once the server rejected the key with a 401
+        self.removed = False
+
+    def state(self, now=None):
+        """str: ``active``, ``quarantined`` or ``removed``"""
+        if self.removed:
+            return 'removed'
+        if self.quarantined_until is not None and \
+                (monotonic() if now is None else now) < self.quarantined_until:
+            return 'quarantined'
+        return 'active'
+
+    def __repr__(self):
+        return '<ApiKey ...{0} {1}>'.format(self.key[-4:], self.state())
+
+
+class KeyPool(object):
+    """Balances requests over several subscription keys
+
+    Each key draws from its own limiter and is tuned by its own
+    :class:`~halopy.ratelimit.AdaptiveThrottle`. A request takes a token from
+    the key with the most tokens available, so the total rate scales with
+    the number of keys. A key the server rejects with a 401 is taken out of
+    rotation for good, a key throttled ``quarantine_after`` times in a row is
+    taken out for ``quarantine`` seconds (or as long as the server asked us
+    to back off, if longer). The last key in rotation is never taken out.
+
+    Args:
+        keys (iterable): Halo API keys, or ``(key, limiter)`` pairs to give
+            keys a custom limiter.
+        rate (Optional[tuple]): Rate limit in form ``(req, sec)`` of the keys
+            without a custom limiter
+        quarantine_after (Optional[int]): 429 responses in a row that take a
+            key out of rotation. Default is 3.
+        quarantine (Optional[float]): Seconds a key stays out of rotation.
+            Default is 60.
+        priority (Optional[bool]): Queue callers waiting for a token by
+            priority and tenant, see :attr:`scheduler`.
+    """
+
+    def __init__(self, keys, rate=(10, 10), quarantine_after=3, quarantine=60.0,
+                 priority=False):
+        self.keys = []
+        for key in keys:
+            if isinstance(key, tuple):
+                self.keys.append(ApiKey(*key))
+            else:
+                self.keys.append(ApiKey(key, TokenBucket(rate)))
+        if not self.keys:
+            raise ValueError('A key pool needs at least one key')
+        self.quarantine_after = quarantine_after
+        self.quarantine = quarantine
+        self._lock = threading.Condition()
+        #: :class:`~halopy.scheduler.PriorityScheduler` handing out the
+        #: tokens of every key if the pool was created with ``priority``
+        self.scheduler = PriorityScheduler(_PoolTokens(self)) if priority else None
+
+    def __len__(self):
+        return len(self.keys)
+
+    def active(self, now=None):
+        """list[ApiKey]: Keys in rotation"""
+        now = monotonic() if now is None else now
+        return [key for key in self.keys if key.state(now) == 'active']
+
+    def _candidates(self):
+        """Keys in rotation, or the ones back soonest if all are
+        quarantined"""
+        now = monotonic()
+        active = self.active(now)
+        if active:
+            return active
+        waiting = [key for key in self.keys if not key.removed]
+        soonest = min(key.quarantined_until for key in waiting)
+        return [key for key in waiting if key.quarantined_until == soonest]
+
+    def acquire(self, blocking=True, timeout=None):
+        """Take a token from the key with the most tokens available.
+
+        Args:
+            blocking (Optional[bool]): Wait for a token to become available.
+            timeout (Optional[float]): Maximum seconds to wait, None waits
+                indefinitely.
+
+        Returns:
+            ApiKey: The key the token was taken from, None if none was
+            available in time.
+        """
+        if self.scheduler is not None:
+            if self.scheduler.acquire(blocking, timeout):
+                return self.scheduler.limiter.key
+            return None
+
+        candidates = self._candidates()
+        if len(candidates) == 1:
+            # Let the limiter do the waiting, e.g. to queue by priority
+            key = candidates[0]
+            return key if key.limiter.acquire(blocking, timeout) else None
+
+        deadline = None if timeout is None else monotonic() + timeout
+        while True:
+            capacity = {}
+            for key in candidates:
+                capacity[key] = key.limiter.available()
+            key = self._take(candidates, capacity)
+            if key is not None or not blocking:
+                return key
+            wait = min((1 - capacity[key]) * key.limiter.rate[1] / key.limiter.rate[0]
+                       for key in candidates)
+            if deadline is not None:
+                remaining = deadline - monotonic()
+                if remaining <= 0:
+                    return None
+                wait = min(wait, remaining)
+            with self._lock:
+                self._lock.wait(min(max(wait, 0.001), 1.0))
+            candidates = self._candidates()
+
+    @staticmethod
+    def _take(candidates, capacity):
+        """Take a token from the candidate with the most available, if any"""
+        for key in sorted(candidates, key=capacity.get, reverse=True):
+            if capacity[key] >= 1 and key.limiter.acquire(False):
+                return key
+        return None
+
+    def delay(self):
+        """float: Seconds until a key in rotation is expected to have a
+        token, for callers that wait on their own, e.g. in an event loop"""
+        return max(min((1 - key.limiter.available()) * key.limiter.rate[1] / key.limiter.rate[0]
+                       for key in self._candidates()), 0.0)
+
+    def record(self, key, response):
+        """Count a response of a key.
+
+        A 401 takes the key out of rotation and a run of 429 responses
+        quarantines it, unless it is the last key in rotation.
+
+        Returns:
+            bool: True if the key was rejected and taken out of rotation, the
+            request should be sent again with another key.
+        """
+        status = response.status_code
+        with self._lock:
+            key.requests += 1
+            if status == 429:
+                key.throttled += 1
+                key.strikes += 1
+            else:
+                key.strikes = 0
+            if not [other for other in self.active() if other is not key]:
+                return False
+            if status == 401:
+                key.removed = True
+            elif status == 429 and key.strikes >= self.quarantine_after:
+                retry_after = key.throttle.retry_after(response) or 0
+                key.quarantined_until = monotonic() + max(self.quarantine, retry_after)
+                key.strikes = 0
+            self._lock.notify_all()
+        return key.removed
+
+    @property
+    def rate(self):
+        """tuple: Configured rate limit of each key in form ``(req, sec)``"""
+        return self.keys[0].throttle.rate
+
+    @rate.setter
+    def rate(self, value):
+        for key in self.keys:
+            key.throttle.rate = value
+        with self._lock:
+            self._lock.notify_all()
+
+    def available(self):
+        """float: Tokens available over all keys in rotation"""
+        return sum(max(key.limiter.available(), 0.0) for key in self.active())
+
+    def stats(self):
+        """Usage of each key.
+
+        Returns:
+            dict: For each key: its ``state``, ``requests`` sent, responses
+            ``throttled``, tokens ``available`` and the ``factor`` of the
+            configured rate it is currently used at.
+        """
+        now = monotonic()
+        return dict((key.key, {
+            'state': key.state(now),
+            'requests': key.requests,
+            'throttled': key.throttled,
+            'available': key.limiter.available(),
+            'factor': key.throttle.factor,
+        }) for key in self.keys)
+
+
+class _PoolTokens(RateLimiter):
+    """The tokens of every key of a pool, as one limiter a
+    :class:`~halopy.scheduler.PriorityScheduler` can hand out"""
+
+    def __init__(self, pool):
+        self.pool = pool
+        self._local = threading.local()
+
+    @property
+    def rate(self):
+        """tuple: Combined rate of the keys in rotation, per second"""
+        return (sum(key.limiter.rate[0] / key.limiter.rate[1]
+                    for key in self.pool._candidates()), 1.0)
+
+    @property
+    def key(self):
+        """ApiKey: Key of the last token the current thread took"""
+        return self._local.key
+
+    def _take(self, tokens):
+        candidates = self.pool._candidates()
+        capacity = dict((key, key.limiter.available()) for key in candidates)
+        key = self.pool._take(candidates, capacity)
+        if key is None:
+            return max(self.pool.delay(), 0.001)
+        self._local.key = key
+        return 0
+
+    def refund(self, tokens=1):
+        self.key.limiter.refund(tokens)
+
+    def available(self):
+        return self.pool.available()
+
+    def reset(self, tokens=None):
+        for key in self.pool.active():
+            key.limiter.reset(tokens)
@@ -0,0 +1,282 @@
+# coding=utf-8
+"""
+Local index of the title's metadata.
+
+.. moduleauthor:: Max Gurela <maxpowa@outlook.com>
+
+Licensed under the Eiffel Forum License 2
+"""
+from __future__ import unicode_literals, absolute_import, print_function, division
+
+import hashlib
+import json
+import os
+import time
+
+import halopy
+
+#: Metadata listings, by endpoint
+LISTINGS = (
+    'campaign-missions', 'commendations', 'csr-designations', 'enemies', 'flexible-stats',
+    'game-base-variants', 'impulses', 'maps', 'medals', 'playlists', 'skulls',
+    'spartan-ranks', 'team-colors', 'vehicles', 'weapons',
+)
+
+#: Metadata only available one id at a time, by endpoint
+SINGLE = ('game-variants', 'map-variants', 'requisition-packs', 'requisitions')
+
+
+def _key(value):
+    return '{0}'.format(value).lower()
+
+
+class MetadataResolver(object):
+    """Mixin resolving the metadata ids found in match documents
+
+    Subclasses implement :meth:`get`.
+    """
+
+    # (name in the result, kind, path to the id in the match)
+    _match_refs = (
+        ('Map', 'maps', ('MapId',)),
+        ('MapVariant', 'map-variants', ('MapVariant', 'ResourceId')),
+        ('GameBaseVariant', 'game-base-variants', ('GameBaseVariantId',)),
+        ('GameVariant', 'game-variants', ('GameVariant', 'ResourceId')),
+        ('Playlist', 'playlists', ('PlaylistId',)),
+        ('Playlist', 'playlists', ('HopperId',)),
+        ('Mission', 'campaign-missions', ('MissionId',)),
+    )
+
+    # (name in the result, kind, list in a player's stats, path to the id)
+    _player_refs = (
+        ('Medals', 'medals', 'MedalAwards', ('MedalId',)),
+        ('Weapons', 'weapons', 'WeaponStats', ('WeaponId', 'StockId')),
+        ('Impulses', 'impulses', 'Impulses', ('Id',)),
+        ('Enemies', 'enemies', 'EnemyKills', ('Enemy', 'BaseId')),
+        ('Vehicles', 'vehicles', 'DestroyedEnemyVehicles', ('Enemy', 'BaseId')),
+    )
+
+    def get(self, kind, item_id):
+        """Return the metadata item of a kind by id, or None"""
+        raise NotImplementedError
+
+    @staticmethod
+    def _path(data, path):
+        for key in path:
+            if not isinstance(data, dict):
+                return None
+            data = data.get(key)
+        return data
+
+    def resolve(self, match):
+        """Enrich a match with the metadata it references.
+
+        Never makes a network call, ids missing from the index are left out.
+
+        Args:
+            match (HaloPyResult|dict): Match details or summary
+
+        Returns:
+            HaloPyResult: Copy of the match with a ``Metadata`` key holding
+            the ``Map``, ``MapVariant``, ``GameBaseVariant``, ``GameVariant``,
+            ``Playlist`` and ``Mission`` referenced, and dicts by id of the
+            ``Medals``, ``Weapons``, ``Impulses``, ``Enemies``,
+            ``Vehicles``, ``CsrDesignations`` and ``Skulls`` referenced.
+        """
+        data = match._wrap if isinstance(match, halopy.HaloPyResult) else match
+        resolved = {}
+        for name, kind, path in self._match_refs:
+            item = self._lookup(kind, self._path(data, path))
+            if item is not None:
+                resolved[name] = item
+        for name, kind, key, path in self._player_refs:
+            resolved[name] = {}
+        resolved['CsrDesignations'] = {}
+        for player in data.get('PlayerStats') or ():
+            for name, kind, key, path in self._player_refs:
+                for entry in player.get(key) or ():
+                    self._collect(resolved[name], kind, self._path(entry, path))
+            self._collect(resolved['CsrDesignations'], 'csr-designations',
+                          self._path(player, ('CurrentCsr', 'DesignationId')))
+        resolved['Skulls'] = {}
+        for skull_id in data.get('Skulls') or ():
+            self._collect(resolved['Skulls'], 'skulls', skull_id)
+        return halopy.HaloPyResult(dict(data, Metadata=resolved))
+
+    def _lookup(self, kind, item_id):
+        if item_id is None:
+            return None
+        return self.get(kind, item_id)
+
+    def _collect(self, found, kind, item_id):
+        if item_id is not None and item_id not in found:
+            item = self.get(kind, item_id)
+            if item is not None:
+                found[item_id] = item
+
+
+class MetadataIndex(MetadataResolver):
+    """In-memory index of the title's metadata
+
+    Every listing in :data:`LISTINGS` is indexed by id and by name for
+    constant time lookups. Items only available by id (:data:`SINGLE`) are
+    added as they are fetched through :meth:`fetch`. The index can be saved
+    to and opened from disk, and refreshed from the API incrementally.
+
+    Args:
+        listings (Optional[dict]): Items of each kind, by kind
+        title (Optional[str]): Game title the metadata belongs to
+    """
+
+    #: Version of the on-disk format
+    format_version = 1
+
+    def __init__(self, listings=None, title='h5'):
+        self.title = title
+        self.stamp = None
+        self._items = {}
+        self._by_id = {}
+        self._by_name = {}
+        self._digests = {}
+        for kind, items in (listings or {}).items():
+            self._index(kind, items)
+
+    @staticmethod
+    def _digest(items):
+        return hashlib.sha1(json.dumps(items, sort_keys=True).encode('utf-8')).hexdigest()
+
+    def _index(self, kind, items, digest=None):
+        by_id = {}
+        by_name = {}
+        for item in items:
+            if item.get('id') is not None:
+                by_id[_key(item['id'])] = item
+            if item.get('name'):
+                by_name.setdefault(item['name'].lower(), item)
+        self._items[kind] = list(items)
+        self._by_id[kind] = by_id
+        self._by_name[kind] = by_name
+        self._digests[kind] = digest or self._digest(items)
+
+    @property
+    def kinds(self):
+        """list[str]: Kinds of metadata in the index"""
+        return sorted(self._items)
+
+    def items(self, kind):
+        """list[dict]: Every item of a kind"""
+        return self._items.get(kind, [])
+
+    def get(self, kind, item_id):
+        by_id = self._by_id.get(kind)
+        return None if by_id is None else by_id.get(_key(item_id))
+
+    def by_name(self, kind, name):
+        """Return the metadata item of a kind by name (case-insensitive), or
+        None"""
+        by_name = self._by_name.get(kind)
+        return None if by_name is None else by_name.get(name.lower())
+
+    def add(self, kind, item):
+        """Add a single item, e.g. a game variant, to the index"""
+        if kind not in self._items:
+            self._index(kind, [])
+        old = self.get(kind, item['id'])
+        if old is not None:
+            self._items[kind].remove(old)
+        self._items[kind].append(item)
+        self._by_id[kind][_key(item['id'])] = item
+        if item.get('name'):
+            self._by_name[kind].setdefault(item['name'].lower(), item)
+
+    def fetch(self, api, kind, item_id):
+        """Return an item from :data:`SINGLE`, requesting and adding it to
+        the index if it isn't indexed yet.
+
+        Args:
+            api (HaloPy): Client to request missing items with
+            kind (str): One of :data:`SINGLE`
+            item_id (str): Item id
+
+        Returns:
+            dict: The item
+        """
+        item = self.get(kind, item_id)
+        if item is None:
+            item = api.meta_request('{0}/{1}'.format(kind, item_id))
+            self.add(kind, item)
+        return item
+
+    @classmethod
+    def load(cls, api):
+        """Build an index from every listing of the API.
+
+        Args:
+            api (HaloPy): Client to request the listings with
+
+        Returns:
+            MetadataIndex: The index
+        """
+        index = cls(title=api.title)
+        index.refresh(api)
+        return index
+
+    def refresh(self, api, kinds=LISTINGS):
+        """Request listings again and re-index those that changed.
+
+        With a response cache, unchanged listings are usually answered from
+        the cache or revalidated with a ``304 Not Modified``.
+
+        Args:
+            api (HaloPy): Client to request the listings with
+            kinds (Optional[iterable[str]]): Listings to refresh, all of
+                :data:`LISTINGS` if unspecified
+
+        Returns:
+            list[str]: Kinds that changed
+        """
+        changed = []
+        for kind in kinds:
+            items = api.meta_request(kind)
+            digest = self._digest(items)
+            if self._digests.get(kind) != digest:
+                self._index(kind, items, digest)
+                changed.append(kind)
+        self.stamp = time.time()
+        return changed
+
+    def save(self, path):
+        """Write the index to ``path``, atomically replacing any existing
+        file."""
+        data = {
+            'format': self.format_version,
+            'halopy': halopy.__version__,
+            'title': self.title,
+            'stamp': self.stamp,
+            'listings': self._items,
+        }
+        tmp = '{0}.{1}.tmp'.format(path, os.getpid())
+        with open(tmp, 'w') as f:
+            json.dump(data, f)
+        if hasattr(os, 'replace'):
+            os.replace(tmp, path)
+        else:  # Python 2
+            if os.path.exists(path):
+                os.remove(path)
+            os.rename(tmp, path)
+
+    @classmethod
+    def open(cls, path):
+        """Read an index written by :meth:`save`.
+
+        Raises:
+            HaloPyError: If the file was written in another format version
+        """
+        with open(path) as f:
+            data = json.load(f)
+        if data.get('format') != cls.format_version:
+            raise halopy.HaloPyError('Unsupported metadata index format {0!r}'.format(
+                data.get('format')))
+        index = cls(data['listings'], data['title'])
+        index.stamp = data['stamp']
+        return index
@@ -0,0 +1,253 @@
+# coding=utf-8
+"""
+Compact, typed models for the entities HaloPy handles in bulk.
+
+Models are generated from a field table mapping attribute names to paths in
+the API's JSON documents. Instances use ``__slots__`` instead of a
+``__dict__``, hold plain typed values and convert to and from
+:class:`~halopy.HaloPyResult`.
+
+.. moduleauthor:: Max Gurela <maxpowa@outlook.com>
+
+Licensed under the Eiffel Forum License 2
+"""
+from __future__ import unicode_literals, absolute_import, print_function, division
+
+import halopy
+
+
+class Model(object):
+    """Base class of generated models
+
+    Positional or keyword arguments set the fields, in the order of
+    :attr:`fields`. Unset fields are None.
+    """
+
+    __slots__ = ()
+
+    #: Attribute names, in order
+    fields = ()
+    #: Path of each field in the JSON document, as a tuple of keys
+    paths = ()
+    #: Type each field's value is converted to
+    types = ()
+
+    def __init__(self, *args, **kwargs):
+        for name, value in zip(self.fields, args):
+            setattr(self, name, value)
+        for name in self.fields[len(args):]:
+            setattr(self, name, kwargs.pop(name, None))
+        if kwargs:
+            raise TypeError('Unknown fields: {0}'.format(', '.join(sorted(kwargs))))
+
+    @classmethod
+    def from_dict(cls, data):
+        """Build a model from a decoded JSON document
+
+        Args:
+            data (dict): Document, as returned by the API
+
+        Returns:
+            Model: The model
+        """
+        values = []
+        for path, kind in zip(cls.paths, cls.types):
+            value = data
+            for key in path:
+                if value is None:
+                    break
+                value = value.get(key)
+            values.append(value if value is None else kind(value))
+        return cls(*values)
+
+    @classmethod
+    def from_result(cls, result):
+        """Build a model from a :class:`~halopy.HaloPyResult`"""
+        return cls.from_dict(result._wrap)
+
+    def to_dict(self):
+        """Rebuild the JSON document the model's fields came from
+
+        Returns:
+            dict: Document with the model's fields, None fields are left out
+        """
+        data = {}
+        for name, path in zip(self.fields, self.paths):
+            value = getattr(self, name)
+            if value is None:
+                continue
+            node = data
+            for key in path[:-1]:
+                node = node.setdefault(key, {})
+            node[path[-1]] = value
+        return data
+
+    def to_result(self):
+        """Convert the model to a :class:`~halopy.HaloPyResult`"""
+        return halopy.HaloPyResult(self.to_dict())
+
+    def __eq__(self, other):
+        return type(self) is type(other) and all(
+            getattr(self, name) == getattr(other, name) for name in self.fields)
+
+    def __ne__(self, other):
+        return not self == other
+
+    def __repr__(self):
+        return '{0}({1})'.format(type(self).__name__, ', '.join(
+            '{0}={1!r}'.format(name, getattr(self, name)) for name in self.fields))
+
+    def __getstate__(self):
+        return tuple(getattr(self, name) for name in self.fields)
+
+    def __setstate__(self, state):
+        for name, value in zip(self.fields, state):
+            setattr(self, name, value)
+
+
+def model(name, fields, doc=None, base=Model):
+    """Generate a slotted model class.
+
+    Args:
+        name   (str): Class name
+        fields (list): ``(attribute, path, type)`` tuples, ``path`` being a
+            dotted path into the JSON document
+        doc (Optional[str]): Class docstring
+        base (Optional[type]): Base class
+
+    Returns:
+        type: The model class
+    """
+    names = tuple(field[0] for field in fields)
+    return type(str(name), (base,), {
+        '__slots__': names,
+        '__doc__': doc,
+        'fields': names,
+        'paths': tuple(tuple(field[1].split('.')) for field in fields),
+        'types': tuple(field[2] for field in fields),
+    })
+
+
+def _text(value):
+    return value if isinstance(value, type('')) else type('')(value)
+
+
+MatchSummary = model('MatchSummary', [
+    ('match_id', 'Id.MatchId', _text),
+    ('game_mode', 'Id.GameMode', int),
+    ('hopper_id', 'HopperId', _text),
+    ('map_id', 'MapId', _text),
+    ('map_variant_id', 'MapVariant.ResourceId', _text),
+    ('game_base_variant_id', 'GameBaseVariantId', _text),
+    ('game_variant_id', 'GameVariant.ResourceId', _text),
+    ('season_id', 'SeasonId', _text),
+    ('is_team_game', 'IsTeamGame', bool),
+    ('duration', 'MatchDuration', _text),
+    ('completed', 'MatchCompletedDate.ISO8601Date', _text),
+], """Match summary, as listed by :meth:`HaloPy.get_player_matches`""")
+
+
+PlayerMatchStats = model('PlayerMatchStats', [
+    ('gamertag', 'Player.Gamertag', _text),
+    ('team_id', 'TeamId', int),
+    ('rank', 'Rank', int),
+    ('dnf', 'DNF', bool),
+    ('kills', 'TotalKills', int),
+    ('deaths', 'TotalDeaths', int),
+    ('assists', 'TotalAssists', int),
+    ('headshots', 'TotalHeadshots', int),
+    ('weapon_damage', 'TotalWeaponDamage', float),
+    ('shots_fired', 'TotalShotsFired', int),
+    ('shots_landed', 'TotalShotsLanded', int),
+    ('melee_kills', 'TotalMeleeKills', int),
+    ('melee_damage', 'TotalMeleeDamage', float),
+    ('assassinations', 'TotalAssassinations', int),
+    ('ground_pound_kills', 'TotalGroundPoundKills', int),
+    ('shoulder_bash_kills', 'TotalShoulderBashKills', int),
+    ('grenade_kills', 'TotalGrenadeKills', int),
+    ('grenade_damage', 'TotalGrenadeDamage', float),
+    ('power_weapon_kills', 'TotalPowerWeaponKills', int),
+    ('power_weapon_damage', 'TotalPowerWeaponDamage', float),
+    ('spartan_kills', 'TotalSpartanKills', int),
+    ('avg_lifetime', 'AvgLifeTimeOfPlayer', _text),
+], """A player's stats in a match, one of the ``PlayerStats`` of a match's
+details""")
+
+
+MedalAward = model('MedalAward', [
+    ('medal_id', 'MedalId', int),
+    ('count', 'Count', int),
+], """Medals of one kind earned by a player, one of ``MedalAwards``""")
+
+
+class ServiceRecord(model('_ServiceRecord', [
+    ('gamertag', 'Id', _text),
+    ('result_code', 'ResultCode', int),
+    ('spartan_rank', 'Result.SpartanRank', int),
+    ('xp', 'Result.Xp', int),
+    ('stats_key', 'Result._StatsKey', _text),
+    ('kills', 'Result.Stats.TotalKills', int),
+    ('deaths', 'Result.Stats.TotalDeaths', int),
+    ('assists', 'Result.Stats.TotalAssists', int),
+    ('headshots', 'Result.Stats.TotalHeadshots', int),
+    ('weapon_damage', 'Result.Stats.TotalWeaponDamage', float),
+    ('shots_fired', 'Result.Stats.TotalShotsFired', int),
+    ('shots_landed', 'Result.Stats.TotalShotsLanded', int),
+    ('games_completed', 'Result.Stats.TotalGamesCompleted', int),
+    ('games_won', 'Result.Stats.TotalGamesWon', int),
+    ('games_lost', 'Result.Stats.TotalGamesLost', int),
+    ('games_tied', 'Result.Stats.TotalGamesTied', int),
+    ('time_played', 'Result.Stats.TotalTimePlayed', _text),
+])):
+    """A player's service record for one game mode
+
+    ``stats_key`` records which block (``ArenaStats``, ``WarzoneStat``,
+    ``CustomStats`` or ``CampaignStat``) the mode's stats were read from.
+    """
+
+    __slots__ = ()
+
+    stats_keys = ('ArenaStats', 'WarzoneStat', 'CustomStats', 'CampaignStat')
+
+    @classmethod
+    def from_dict(cls, data):
+        result = data.get('Result') or {}
+        for key in cls.stats_keys:
+            if key in result:
+                data = dict(data)
+                data['Result'] = dict(result, Stats=result[key], _StatsKey=key)
+                break
+        return super(ServiceRecord, cls).from_dict(data)
+
+    def to_dict(self):
+        data = super(ServiceRecord, self).to_dict()
+        result = data.get('Result', {})
+        key = result.pop('_StatsKey', None)
+        if key is not None and 'Stats' in result:
+            result[key] = result.pop('Stats')
+        return data
+
+
+def player_stats(match):
+    """Player stats models of a match's details
+
+    Args:
+        match (HaloPyResult|dict): Match details
+
+    Returns:
+        list[PlayerMatchStats]: One model per player
+    """
+    data = match._wrap if isinstance(match, halopy.HaloPyResult) else match
+    return [PlayerMatchStats.from_dict(player) for player in data.get('PlayerStats', ())]
+
+
+def medal_awards(player):
+    """Medal award models of a player's stats in a match's details
+
+    Args:
+        player (dict): One of the ``PlayerStats`` of a match's details
+
+    Returns:
+        list[MedalAward]: One model per medal kind
+    """
+    return [MedalAward.from_dict(award) for award in player.get('MedalAwards', ())]
@@ -0,0 +1,124 @@
+# coding=utf-8
+"""
+Bounded worker pool helpers shared by the bulk HaloPy APIs.
+
+.. moduleauthor:: Max Gurela <maxpowa@outlook.com>
+
+Licensed under the Eiffel Forum License 2
+"""
+from __future__ import unicode_literals, absolute_import, print_function, division
+
+import collections
+import threading
+
+from concurrent.futures import FIRST_COMPLETED, Future, ThreadPoolExecutor, wait
+
+
+def imap(fn, items, workers=4, ordered=False, inline=None):
+    """Apply ``fn`` to every item on a pool of worker threads.
+
+    Items are pulled from ``items`` lazily, keeping at most ``2 * workers``
+    calls queued, so arbitrarily long iterables stream through in constant
+    memory. Items ``inline`` accepts are cheap to process (e.g. cached), they
+    are processed on the calling thread as they are pulled, and yielded
+    right away unless ``ordered``.
+
+    Args:
+        fn      (callable): Function to apply to each item
+        items   (iterable): Items to process
+        workers (Optional[int]): Number of worker threads. Default is 4.
+        ordered (Optional[bool]): Yield in input order instead of completion
+            order.
+        inline (Optional[callable]): Predicate of the items to process
+            without the pool.
+
+    Yields:
+        tuple: ``(item, future)`` pairs of finished calls. ``future.result()``
+        returns the value or raises the exception of the call.
+    """
+    items = iter(items)
+    window = workers * 2
+    pending = collections.OrderedDict()
+    executor = ThreadPoolExecutor(workers)
+    try:
+        exhausted = False
+        while True:
+            while not exhausted and len(pending) < window:
+                try:
+                    item = next(items)
+                except StopIteration:
+                    exhausted = True
+                    break
+                if inline is not None and inline(item):
+                    future = Future()
+                    try:
+                        future.set_result(fn(item))
+                    except Exception as ex:
+                        future.set_exception(ex)
+                    if not ordered:
+                        yield item, future
+                        continue
+                else:
+                    future = executor.submit(fn, item)
+                pending[future] = item
+            if not pending:
+                return
+            if ordered:
+                done = [next(iter(pending))]
+                wait(done)
+            else:
+                done, _ = wait(pending, return_when=FIRST_COMPLETED)
+            for future in done:
+                yield pending.pop(future), future
+    finally:
+        for future in pending:
+            future.cancel()
+        executor.shutdown(wait=True)
+
+
+class SingleFlight(object):
+    """Coalesces concurrent calls that share a key
+
+    The first caller of :meth:`do` for a key runs the function; callers
+    arriving with the same key while it runs wait for it and receive the same
+    result, or the same exception.
+    """
+
+    class _Call(object):
+        __slots__ = ('done', 'result', 'error')
+
+        def __init__(self):
+            self.done = threading.Event()
+            self.result = self.error = None
+
+    def __init__(self):
+        self._calls = {}
+        self._lock = threading.Lock()
+
+    def do(self, key, fn, *args, **kwargs):
+        """Call ``fn(*args, **kwargs)`` unless a call for ``key`` is already
+        in flight, in which case wait for its outcome.
+
+        Returns:
+            The return value of the call
+        """
+        with self._lock:
+            call = self._calls.get(key)
+            leader = call is None
+            if leader:
+                call = self._calls[key] = self._Call()
+        if not leader:
+            call.done.wait()
+            if call.error is not None:
+                raise call.error
+            return call.result
+        try:
+            call.result = fn(*args, **kwargs)
+            return call.result
+        except BaseException as ex:
+            call.error = ex
+            raise
+        finally:
+            with self._lock:
+                del self._calls[key]
+            call.done.set()
@@ -0,0 +1,461 @@
+# coding=utf-8
+"""
+Rate limiters used to keep HaloPy inside the API key's request budget.
+
+.. moduleauthor:: Max Gurela <maxpowa@outlook.com>
+
+Licensed under the Eiffel Forum License 2
+"""
+from __future__ import unicode_literals, absolute_import, print_function, division
+
+import os
+import random
+import struct
+import threading
+import time
+
+from email.utils import mktime_tz, parsedate_tz
+
+try:
+    import fcntl
+except ImportError:  # Windows
+    fcntl = None
+
+monotonic = getattr(time, 'monotonic', time.time)
+
+
+class RateLimiter(object):
+    """Base class for HaloPy rate limiters
+
+    Subclasses implement :meth:`_take`, :meth:`refund`, :meth:`available`
+    and :meth:`reset`; waiting and timeouts are handled here.
+
+    Args:
+        rate (tuple): Maximum rate limit in form ``(req, sec)``
+    """
+
+    def __init__(self, rate):
+        self.rate = rate
+
+    @property
+    def rate(self):
+        """tuple: Maximum rate limit in form ``(req, sec)``"""
+        return self._rate
+
+    @rate.setter
+    def rate(self, value):
+        if type(value) is not tuple:
+            raise ValueError('Rate must be a tuple!')
+        self._rate = value
+
+    def _take(self, tokens):
+        """Take ``tokens`` from the budget if they are available.
+
+        Returns:
+            float: 0 if the tokens were taken, otherwise the number of seconds
+            until they are expected to be available.
+        """
+        raise NotImplementedError
+
+    def _sleep(self, seconds):
+        time.sleep(seconds)
+
+    def acquire(self, blocking=True, timeout=None, tokens=1):
+        """Take a token from the budget, waiting for one if required.
+
+        Args:
+            blocking (Optional[bool]): Wait for a token to become available.
+                If False, return immediately.
+            timeout (Optional[float]): Maximum seconds to wait, None waits
+                indefinitely.
+            tokens (Optional[int]): Number of tokens to take.
+
+        Returns:
+            bool: True if the tokens were taken, False otherwise.
+        """
+        deadline = None
+        if timeout is not None:
+            deadline = monotonic() + timeout
+        while True:
+            wait = self._take(tokens)
+            if wait <= 0:
+                return True
+            if not blocking:
+                return False
+            if deadline is not None:
+                remaining = deadline - monotonic()
+                if remaining <= 0:
+                    return False
+                wait = min(wait, remaining)
+            self._sleep(wait)
+
+    def refund(self, tokens=1):
+        """Give tokens back to the budget, e.g. when no request was sent."""
+        raise NotImplementedError
+
+    def available(self):
+        """float: Number of tokens currently available."""
+        raise NotImplementedError
+
+    def reset(self, tokens=None):
+        """Set the number of available tokens, refilling the bucket if
+        ``tokens`` is None."""
+        raise NotImplementedError
+
+    def penalize(self, seconds):
+        """Withhold every token for ``seconds``, e.g. when the server asks us
+        to back off. Waiting callers resume once the penalty has passed.
+
+        Subclasses shared between threads or processes override this to
+        apply the penalty atomically."""
+        capacity, per = self.rate
+        self.reset(min(self.available(), 0.0) - seconds * capacity / per)
+
+
+class TokenBucket(RateLimiter):
+    """Thread-safe in-process token bucket
+
+    Holds up to ``req`` tokens and refills continuously at ``req / sec``
+    tokens per second on a monotonic clock. Waiting threads sleep on a
+    condition variable until their token is due, so one instance may be
+    shared between any number of threads.
+
+    Args:
+        rate (tuple): Maximum rate limit in form ``(req, sec)``
+    """
+
+    def __init__(self, rate):
+        self._cond = threading.Condition()
+        RateLimiter.__init__(self, rate)
+        self._tokens = float(rate[0])
+        self._stamp = monotonic()
+
+    @RateLimiter.rate.setter
+    def rate(self, value):
+        with self._cond:
+            RateLimiter.rate.fset(self, value)
+            self._cond.notify_all()
+
+    def _refill(self):
+        now = monotonic()
+        capacity, per = self._rate
+        self._tokens = min(float(capacity),
+                           self._tokens + (now - self._stamp) * capacity / per)
+        self._stamp = now
+
+    def _take(self, tokens):
+        self._refill()
+        if self._tokens >= tokens:
+            self._tokens -= tokens
+            return 0
+        capacity, per = self._rate
+        return (tokens - self._tokens) * per / capacity
+
+    def acquire(self, blocking=True, timeout=None, tokens=1):
+        with self._cond:
+            return RateLimiter.acquire(self, blocking, timeout, tokens)
+
+    def _sleep(self, seconds):
+        self._cond.wait(seconds)
+
+    def refund(self, tokens=1):
+        with self._cond:
+            self._refill()
+            self._tokens = min(float(self._rate[0]), self._tokens + tokens)
+            self._cond.notify_all()
+
+    def available(self):
+        with self._cond:
+            self._refill()
+            return self._tokens
+
+    def reset(self, tokens=None):
+        with self._cond:
+            self._refill()
+            self._tokens = float(self._rate[0] if tokens is None else tokens)
+            self._cond.notify_all()
+
+    def penalize(self, seconds):
+        with self._cond:
+            RateLimiter.penalize(self, seconds)
+
+
+class FileTokenBucket(RateLimiter):
+    """Token bucket shared by every process on a host through a state file
+
+    The bucket state is kept in ``path`` and updated under an exclusive
+    ``flock``, so any number of processes (and threads) pointing at the same
+    file draw from a single budget. Uses the wall clock, which unlike a
+    monotonic clock is comparable between processes. Requires ``fcntl``, so
+    it is not available on Windows.
+
+    Args:
+        path          (str): Path of the shared state file, created if missing
+        rate (Optional[tuple]): Maximum rate limit in form ``(req, sec)``
+    """
+
+    _state = struct.Struct(str('<dd'))
+
+    def __init__(self, path, rate=(10, 10)):
+        if fcntl is None:
+            raise NotImplementedError('FileTokenBucket requires fcntl')
+        RateLimiter.__init__(self, rate)
+        self.path = path
+        self._lock = threading.Lock()
+        self._fd = None
+        self._pid = None
+
+    def _open(self):
+        # flock locks belong to the open file, which a forked child shares
+        # with its parent, so every process needs its own descriptor.
+        if self._pid != os.getpid():
+            self._fd = os.open(self.path, os.O_RDWR | os.O_CREAT, 0o644)
+            self._pid = os.getpid()
+        return self._fd
+
+    def _update(self, fn):
+        capacity, per = self._rate
+        with self._lock:
+            fd = self._open()
+            fcntl.flock(fd, fcntl.LOCK_EX)
+            try:
+                now = time.time()
+                os.lseek(fd, 0, os.SEEK_SET)
+                data = os.read(fd, self._state.size)
+                if len(data) == self._state.size:
+                    tokens, stamp = self._state.unpack(data)
+                    tokens = min(float(capacity),
+                                 tokens + max(0.0, now - stamp) * capacity / per)
+                else:
+                    tokens = float(capacity)
+                tokens, result = fn(tokens)
+                os.lseek(fd, 0, os.SEEK_SET)
+                os.write(fd, self._state.pack(tokens, now))
+                return result
+            finally:
+                fcntl.flock(fd, fcntl.LOCK_UN)
+
+    def _take(self, tokens):
+        capacity, per = self._rate
+
+        def take(available):
+            if available >= tokens:
+                return available - tokens, 0
+            return available, (tokens - available) * per / capacity
+        return self._update(take)
+
+    def refund(self, tokens=1):
+        capacity = float(self._rate[0])
+        self._update(lambda available: (min(capacity, available + tokens), None))
+
+    def available(self):
+        return self._update(lambda available: (available, available))
+
+    def reset(self, tokens=None):
+        if tokens is None:
+            tokens = self._rate[0]
+        self._update(lambda available: (float(tokens), None))
+
+    def penalize(self, seconds):
+        capacity, per = self._rate
+        self._update(lambda available: (min(available, 0.0) - seconds * capacity / per, None))
+
+    def close(self):
+        """Close the state file descriptor."""
+        with self._lock:
+            if self._fd is not None and self._pid == os.getpid():
+                os.close(self._fd)
+            self._fd = self._pid = None
+
+
+class RedisTokenBucket(RateLimiter):
+    """Token bucket shared by every host talking to the same Redis server
+
+    The bucket is a hash at ``key`` updated atomically by a Lua script, using
+    the Redis server clock so hosts with skewed clocks still agree. Any
+    client object with a redis-py compatible ``eval`` method may be used.
+
+    Args:
+        client             (obj): Redis client, e.g. ``redis.StrictRedis()``
+        rate (Optional[tuple]): Maximum rate limit in form ``(req, sec)``
+        key    (Optional[str]): Redis key holding the bucket state
+    """
+
+    script = """
+if redis.replicate_commands then redis.replicate_commands() end
+local capacity = tonumber(ARGV[1])
+local per = tonumber(ARGV[2])
+local op = ARGV[3]
+local count = tonumber(ARGV[4])
+local time = redis.call('TIME')
+local now = tonumber(time[1]) + tonumber(time[2]) / 1000000
+local state = redis.call('HMGET', KEYS[1], 'tokens', 'stamp')
+local tokens = tonumber(state[1]) or capacity
+local stamp = tonumber(state[2]) or now
+tokens = math.min(capacity, tokens + math.max(0, now - stamp) * capacity / per)
+local wait = 0
+if op == 'take' then
+    if tokens >= count then
+        tokens = tokens - count
+    else
+        wait = (count - tokens) * per / capacity
+    end
+elseif op == 'refund' then
+    tokens = math.min(capacity, tokens + count)
+elseif op == 'reset' then
+    tokens = count
+elseif op == 'penalize' then
+    tokens = math.min(tokens, 0) - count
+end
+redis.call('HSET', KEYS[1], 'tokens', tostring(tokens), 'stamp', tostring(now))
+-- Keep the state until the bucket has refilled, penalties included
+redis.call('PEXPIRE', KEYS[1], math.ceil(((capacity - tokens) * per / capacity + per) * 1000))
+return {tostring(wait), tostring(tokens)}
+"""
+
+    def __init__(self, client, rate=(10, 10), key='halopy:ratelimit'):
+        RateLimiter.__init__(self, rate)
+        self.client = client
+        self.key = key
+
+    def _eval(self, op, count):
+        capacity, per = self._rate
+        wait, tokens = self.client.eval(self.script, 1, self.key, capacity, per, op, count)
+        return float(wait), float(tokens)
+
+    def _take(self, tokens):
+        return self._eval('take', tokens)[0]
+
+    def refund(self, tokens=1):
+        self._eval('refund', tokens)
+
+    def available(self):
+        return self._eval('peek', 0)[1]
+
+    def reset(self, tokens=None):
+        self._eval('reset', self._rate[0] if tokens is None else tokens)
+
+    def penalize(self, seconds):
+        capacity, per = self._rate
+        self._eval('penalize', seconds * capacity / per)
+
+
+class AdaptiveThrottle(object):
+    """Tunes a limiter's rate from the server's rate limit signals
+
+    Each 429 response multiplies the effective rate by ``decrease`` (down to
+    ``min_factor`` of the configured rate) and withholds tokens for the
+    ``Retry-After`` period, or an exponential backoff, plus random jitter.
+    Each successful response wins back ``increase`` of the configured rate.
+    ``X-RateLimit-Remaining`` and ``X-RateLimit-Reset`` headers, when the
+    server sends them, cap the tokens available locally.
+
+    Args:
+        limiter (RateLimiter): Limiter to tune
+        min_factor (Optional[float]): Lowest fraction of the configured rate
+        decrease   (Optional[float]): Rate multiplier applied on each 429
+        increase   (Optional[float]): Fraction of the configured rate
+            recovered on each success
+        backoff    (Optional[float]): Base backoff in seconds when the server
+            does not say how long to wait
+        max_backoff (Optional[float]): Upper bound of backoff and jitter
+    """
+
+    def __init__(self, limiter, min_factor=0.1, decrease=0.5, increase=0.05,
+                 backoff=1.0, max_backoff=60.0):
+        self.limiter = limiter
+        self.min_factor = min_factor
+        self.decrease = decrease
+        self.increase = increase
+        self.backoff = backoff
+        self.max_backoff = max_backoff
+        self._lock = threading.Lock()
+        self._rate = limiter.rate
+        self.factor = 1.0
+
+    @property
+    def rate(self):
+        """tuple: Configured rate limit in form ``(req, sec)``"""
+        return self._rate
+
+    @rate.setter
+    def rate(self, value):
+        with self._lock:
+            self._rate = value
+            self.factor = 1.0
+            self.limiter.rate = value
+
+    def _scale(self, factor):
+        factor = max(self.min_factor, min(1.0, factor))
+        if factor != self.factor:
+            self.factor = factor
+            req, sec = self._rate
+            self.limiter.rate = (req, sec / factor)
+
+    @staticmethod
+    def retry_after(response):
+        """Seconds the server asked us to wait, or None"""
+        value = response.headers.get('Retry-After')
+        if value is None:
+            return None
+        try:
+            return max(0.0, float(value))
+        except ValueError:
+            date = parsedate_tz(value)
+            if date is None:
+                return None
+            return max(0.0, mktime_tz(date) - time.time())
+
+    def _reset(self, response):
+        """Seconds until the server's rate limit window resets, capped at
+        ``max_backoff``. ``X-RateLimit-Reset`` may be a number of seconds or,
+        if later than now, an epoch timestamp."""
+        try:
+            reset = float(response.headers.get('X-RateLimit-Reset', ''))
+        except ValueError:
+            reset = self.backoff
+        now = time.time()
+        if reset > now:
+            reset -= now
+        return max(0.0, min(self.max_backoff, reset))
+
+    def observe(self, response):
+        """Record a response the server did not throttle.
+
+        Only successful responses win back rate, errors are not a sign the
+        server has room for more requests.
+        """
+        if response.status_code < 400:
+            with self._lock:
+                if self.factor < 1.0:
+                    self._scale(self.factor + self.increase)
+        remaining = response.headers.get('X-RateLimit-Remaining')
+        if remaining is not None:
+            try:
+                remaining = float(remaining)
+            except ValueError:
+                return
+            if remaining < 1:
+                self.limiter.penalize(self._reset(response))
+            elif remaining < self.limiter.available():
+                self.limiter.reset(remaining)
+
+    def throttled(self, response, attempt=0):
+        """Record a 429 response and back the limiter off.
+
+        Args:
+            response (Response): The throttled response
+            attempt (Optional[int]): Number of retries already made
+
+        Returns:
+            float: Seconds tokens are withheld for
+        """
+        with self._lock:
+            self._scale(self.factor * self.decrease)
+        backoff = min(self.max_backoff, self.backoff * 2 ** attempt)
+        delay = self.retry_after(response)
+        if delay is None:
+            delay = backoff
+        delay = min(self.max_backoff, delay + random.uniform(0, backoff))
+        self.limiter.penalize(delay)
+        return delay
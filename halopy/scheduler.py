@@ -0,0 +1,230 @@
+# coding=utf-8
+"""
+Priority scheduling of rate limit tokens.
+
+Requests made inside :func:`priority` are queued by priority class, and by
+tenant within a class, when tokens run short::
+
+    api = HaloPy(key, rate_limiter=PriorityScheduler(TokenBucket((10, 10))))
+    with api.priority('interactive', tenant=user_id):
+        api.get_player_service_record(gamertag)
+
+.. moduleauthor:: Max Gurela <maxpowa@outlook.com>
+
+Licensed under the Eiffel Forum License 2
+"""
+from __future__ import unicode_literals, absolute_import, print_function, division
+
+import collections
+import contextlib
+import threading
+
+from halopy.ratelimit import RateLimiter, monotonic
+
+#: Priority classes, lower values are served first
+PRIORITIES = collections.OrderedDict([('interactive', 0), ('default', 1), ('background', 2)])
+
+_context = threading.local()
+
+
+@contextlib.contextmanager
+def priority(level, tenant=None):
+    """Context manager setting the priority class and tenant of the tokens
+    the current thread acquires from a :class:`PriorityScheduler`.
+
+    Args:
+        level (str|int): Name of a class of :data:`PRIORITIES`, or a number,
+            lower numbers being served first.
+        tenant (Optional[hashable]): Tenant the requests are made for, queued
+            tenants of a class are served in turn.
+    """
+    if level not in PRIORITIES and not isinstance(level, int):
+        raise ValueError('Unknown priority: {0!r}'.format(level))
+    previous = current()
+    _context.level, _context.tenant = level, tenant
+    try:
+        yield
+    finally:
+        _context.level, _context.tenant = previous
+
+
+def current():
+    """tuple: ``(level, tenant)`` of the current thread"""
+    return getattr(_context, 'level', 'default'), getattr(_context, 'tenant', None)
+
+
+class _Waiter(object):
+    __slots__ = ('tokens', 'since')
+
+    def __init__(self, tokens):
+        self.tokens = tokens
+        self.since = monotonic()
+
+
+class _Stats(object):
+    __slots__ = ('served', 'timeouts', 'waited', 'max_wait', 'recent')
+
+    def __init__(self):
+        self.served = self.timeouts = 0
+        self.waited = self.max_wait = 0.0
+        self.recent = collections.deque(maxlen=1024)
+
+
+class PriorityScheduler(RateLimiter):
+    """Hands out the tokens of another limiter by priority
+
+    When no caller of the same or a higher priority is waiting, tokens are
+    taken straight from ``limiter``. Otherwise callers queue: the class with
+    the lowest priority value is served first, and within a class the tenants
+    with waiting callers take turns, each tenant's callers being served first
+    come, first served. A high priority call therefore waits at most for the
+    next token, while lower classes use up whatever is left.
+
+    To schedule the tokens of several keys, create their
+    :class:`~halopy.keys.KeyPool` with ``priority=True`` instead.
+
+    Rate, refunds and resets, e.g. from the
+    :class:`~halopy.ratelimit.AdaptiveThrottle`, apply to ``limiter``.
+
+    Args:
+        limiter (RateLimiter): Limiter owning the tokens
+    """
+
+    def __init__(self, limiter):
+        self.limiter = limiter
+        self._cond = threading.Condition()
+        self._queues = {}
+        self._stats = {}
+
+    @property
+    def rate(self):
+        """tuple: Maximum rate limit in form ``(req, sec)``"""
+        return self.limiter.rate
+
+    @rate.setter
+    def rate(self, value):
+        self.limiter.rate = value
+        with self._cond:
+            self._cond.notify_all()
+
+    @staticmethod
+    def _level(level):
+        return PRIORITIES.get(level, level)
+
+    def _head(self, up_to=None):
+        """The waiter to serve next, if its priority value is at most
+        ``up_to``, or None"""
+        for level in sorted(self._queues):
+            if up_to is not None and level > up_to:
+                break
+            tenants = self._queues[level]
+            if tenants:
+                return next(iter(tenants.values()))[0]
+        return None
+
+    def _wait_for(self, tokens):
+        capacity, per = self.limiter.rate
+        return max(tokens - self.limiter.available(), 0.0) * per / capacity
+
+    def acquire(self, blocking=True, timeout=None, tokens=1):
+        level, tenant = current()
+        stats = self._stats.get(level)
+        if stats is None:
+            stats = self._stats.setdefault(level, _Stats())
+        with self._cond:
+            # Only callers of the same or a higher priority are ahead of us
+            if (self._head(self._level(level)) is None and
+                    self.limiter.acquire(False, tokens=tokens)):
+                self._served(stats, 0.0)
+                return True
+            if not blocking:
+                stats.timeouts += 1
+                return False
+
+            deadline = None if timeout is None else monotonic() + timeout
+            waiter = _Waiter(tokens)
+            tenants = self._queues.setdefault(self._level(level), collections.OrderedDict())
+            tenants.setdefault(tenant, collections.deque()).append(waiter)
+            # A lower priority head may be sleeping until its token is due
+            self._cond.notify_all()
+            try:
+                while True:
+                    wait = None
+                    if self._head() is waiter:
+                        if self.limiter.acquire(False, tokens=tokens):
+                            self._dequeue(tenants, tenant)
+                            self._served(stats, monotonic() - waiter.since)
+                            return True
+                        wait = self._wait_for(tokens)
+                    if deadline is not None:
+                        remaining = deadline - monotonic()
+                        if remaining <= 0:
+                            tenants[tenant].remove(waiter)
+                            if not tenants[tenant]:
+                                del tenants[tenant]
+                            stats.timeouts += 1
+                            return False
+                        wait = remaining if wait is None else min(wait, remaining)
+                    # Tokens may be taken back by the limiter (e.g. a penalty)
+                    # at any time, so the head wakes up at least once a second
+                    self._cond.wait(1.0 if wait is None else min(max(wait, 0.001), 1.0))
+            finally:
+                self._cond.notify_all()
+
+    def _dequeue(self, tenants, tenant):
+        queue = tenants.pop(tenant)
+        queue.popleft()
+        if queue:
+            # Round robin: the tenant queues again behind the others
+            tenants[tenant] = queue
+
+    @staticmethod
+    def _served(stats, waited):
+        stats.served += 1
+        stats.waited += waited
+        stats.max_wait = max(stats.max_wait, waited)
+        stats.recent.append(waited)
+
+    def refund(self, tokens=1):
+        self.limiter.refund(tokens)
+        with self._cond:
+            self._cond.notify_all()
+
+    def available(self):
+        return self.limiter.available()
+
+    def reset(self, tokens=None):
+        self.limiter.reset(tokens)
+        with self._cond:
+            self._cond.notify_all()
+
+    def penalize(self, seconds):
+        self.limiter.penalize(seconds)
+        with self._cond:
+            self._cond.notify_all()
+
+    def stats(self):
+        """Queue depth and wait times per priority class.
+
+        Returns:
+            dict: For each class that acquired tokens: ``queued`` callers and
+            ``tenants`` waiting now, tokens ``served``, ``timeouts``, and the
+            ``mean_wait``, ``max_wait`` and ``p50_wait``/``p99_wait`` of the
+            last 1024 tokens, in seconds.
+        """
+        result = {}
+        with self._cond:
+            for level, stats in self._stats.items():
+                tenants = self._queues.get(self._level(level), {})
+                recent = sorted(stats.recent)
+                result[level] = {
+                    'queued': sum(len(queue) for queue in tenants.values()),
+                    'tenants': len(tenants),
+                    'served': stats.served,
+                    'timeouts': stats.timeouts,
+                    'mean_wait': stats.waited / stats.served if stats.served else 0.0,
+                    'max_wait': stats.max_wait,
+                    'p50_wait': recent[len(recent) // 2] if recent else 0.0,
+                    'p99_wait': recent[int(len(recent) * 0.99)] if recent else 0.0,
+                }
+        return result
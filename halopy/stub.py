@@ -0,0 +1,433 @@
+# coding=utf-8
+"""
+Offline record/replay of Halo API responses and a local stub of the API.
+
+Record the responses a client receives, then replay them without a network::
+
+    api = HaloPy(api_key)
+    record(api, 'h5.jsonl')
+    api.get_weapons()
+    api.close()
+
+    api = HaloPy('offline')
+    replay(api, 'h5.jsonl')
+    api.get_weapons()
+
+or serve them from a local HTTP server that injects latency, rate limits and
+errors, seeded so load tests are reproducible::
+
+    with StubServer(Cassette('h5.jsonl'), latency=0.05, rate=(10, 10)) as server:
+        api = HaloPy('key', base_url=server.url)
+
+The server also runs standalone, see ``python -m halopy.stub --help``.
+
+.. moduleauthor:: Max Gurela <maxpowa@outlook.com>
+
+Licensed under the Eiffel Forum License 2
+"""
+from __future__ import unicode_literals, absolute_import, print_function, division
+
+import argparse
+import base64
+import collections
+import errno
+import io
+import json
+import random
+import socket
+import sys
+import threading
+import time
+
+import requests
+
+from requests.adapters import BaseAdapter, HTTPAdapter
+from requests.structures import CaseInsensitiveDict
+from requests.utils import get_encoding_from_headers
+
+from halopy.ratelimit import monotonic
+
+try:
+    from http.server import BaseHTTPRequestHandler, HTTPServer
+    from socketserver import ThreadingMixIn
+    from urllib.parse import parse_qsl, urlencode, urlsplit
+except ImportError:  # Python 2
+    from BaseHTTPServer import BaseHTTPRequestHandler, HTTPServer
+    from SocketServer import ThreadingMixIn
+    from urllib import urlencode
+    from urlparse import parse_qsl, urlsplit
+
+#: Socket errors of a client dropping its connection
+_disconnects = frozenset([errno.ECONNRESET, errno.ECONNABORTED, errno.EPIPE])
+
+#: Response headers that describe the transfer rather than the content
+_transfer_headers = frozenset(['connection', 'content-encoding', 'content-length',
+                               'keep-alive', 'transfer-encoding'])
+
+
+def request_key(url):
+    """str: Recording key of a URL, its path and sorted query string
+
+    Only the path and query are kept, so a recording made against the Halo
+    API replays against any base URL.
+    """
+    parts = urlsplit(url)
+    query = urlencode(sorted(parse_qsl(parts.query, keep_blank_values=True)))
+    return '{0}?{1}'.format(parts.path.lstrip('/'), query)
+
+
+class Cassette(object):
+    """Recorded responses, kept in a JSON lines file
+
+    Args:
+        path (Optional[str]): File to load the recordings from and
+            :meth:`save` them to, None for an in-memory cassette.
+    """
+
+    def __init__(self, path=None):
+        self.path = path
+        self._lock = threading.Lock()
+        self._responses = collections.OrderedDict()
+        if path is not None:
+            try:
+                with io.open(path, encoding='utf-8') as f:
+                    for line in f:
+                        if line.strip():
+                            item = json.loads(line)
+                            self._responses[item['key']] = (
+                                item['status'], item['headers'],
+                                base64.b64decode(item['body'].encode('ascii')))
+            except IOError:
+                pass
+
+    def __len__(self):
+        return len(self._responses)
+
+    def __contains__(self, key):
+        return key in self._responses
+
+    def keys(self):
+        """list[str]: Recording keys, see :func:`request_key`"""
+        return list(self._responses)
+
+    def get(self, key):
+        """Return the recorded ``(status, headers, body)`` of a key, or
+        None"""
+        return self._responses.get(key)
+
+    def add(self, key, status, headers, body, append=False):
+        """Record a response, replacing any previous one of the key.
+
+        Args:
+            append (Optional[bool]): Also append the response to the
+                cassette's file. A later line of a key replaces the earlier
+                ones when the file is loaded.
+        """
+        headers = dict((k, v) for k, v in headers.items()
+                       if k.lower() not in _transfer_headers)
+        with self._lock:
+            self._responses[key] = (status, headers, body)
+            if append:
+                with io.open(self.path, 'a', encoding='utf-8') as f:
+                    f.write(_line(key, status, headers, body))
+
+    def save(self, path=None):
+        """Write the recordings to ``path``, the cassette's path by
+        default."""
+        path = path or self.path
+        with self._lock:
+            with io.open(path, 'w', encoding='utf-8') as f:
+                for key, (status, headers, body) in self._responses.items():
+                    f.write(_line(key, status, headers, body))
+
+
+def _line(key, status, headers, body):
+    """JSON line of a recorded response"""
+    return json.dumps({'key': key, 'status': status, 'headers': headers,
+                       'body': base64.b64encode(body).decode('ascii')}, sort_keys=True) + '\n'
+
+
+def _response(request, status, headers, body):
+    response = requests.Response()
+    response.request = request
+    response.url = request.url
+    response.status_code = status
+    response.reason = BaseHTTPRequestHandler.responses.get(status, ('',))[0]
+    response.headers = CaseInsensitiveDict(headers)
+    response.encoding = get_encoding_from_headers(response.headers)
+    response.raw = io.BytesIO(body)
+    response._content = body
+    response._content_consumed = True
+    return response
+
+
+class RecordingAdapter(HTTPAdapter):
+    """Transport adapter sending requests over the network and recording
+    the responses into a :class:`Cassette`
+
+    Args:
+        cassette (Cassette): Cassette to record into
+        save (Optional[bool]): Append each response to the cassette's file
+            as it is recorded.
+        **kwargs: Passed to ``HTTPAdapter``
+    """
+
+    def __init__(self, cassette, save=True, **kwargs):
+        HTTPAdapter.__init__(self, **kwargs)
+        self.cassette = cassette
+        self.save = save
+
+    def send(self, request, **kwargs):
+        kwargs['stream'] = False
+        response = HTTPAdapter.send(self, request, **kwargs)
+        self.cassette.add(request_key(request.url), response.status_code,
+                          dict(response.headers), response.content,
+                          append=self.save and self.cassette.path is not None)
+        return response
+
+
+class ReplayAdapter(BaseAdapter):
+    """Transport adapter answering requests from a :class:`Cassette`
+
+    Raises ``requests.ConnectionError`` for requests that were not recorded.
+
+    Args:
+        cassette (Cassette): Cassette to replay
+    """
+
+    def __init__(self, cassette):
+        BaseAdapter.__init__(self)
+        self.cassette = cassette
+
+    def send(self, request, **kwargs):
+        key = request_key(request.url)
+        recorded = self.cassette.get(key)
+        if recorded is None:
+            raise requests.ConnectionError('No recording of {0}'.format(key), request=request)
+        return _response(request, *recorded)
+
+    def close(self):
+        pass
+
+
+def _cassette(cassette):
+    return cassette if isinstance(cassette, Cassette) else Cassette(cassette)
+
+
+def record(api, cassette):
+    """Record every response ``api`` receives from now on.
+
+    Args:
+        api (HaloPy): Client to record
+        cassette (str|Cassette): Cassette, or the path of its file
+
+    Returns:
+        Cassette: The cassette recorded into
+    """
+    cassette = _cassette(cassette)
+    adapter = api._session.get_adapter(api.base_url)
+    api._session.mount(api.base_url, RecordingAdapter(
+        cassette, pool_connections=api._pool_connections, pool_maxsize=api._pool_maxsize,
+        max_retries=adapter.max_retries))
+    return cassette
+
+
+def replay(api, cassette):
+    """Answer every request of ``api`` from recorded responses, no request
+    reaches the network.
+
+    Args:
+        api (HaloPy): Client to replay to
+        cassette (str|Cassette): Cassette, or the path of its file
+
+    Returns:
+        Cassette: The cassette replayed
+    """
+    cassette = _cassette(cassette)
+    api._session.mount(api.base_url, ReplayAdapter(cassette))
+    return cassette
+
+
+class StubHandler(BaseHTTPRequestHandler):
+    protocol_version = 'HTTP/1.1'
+    disable_nagle_algorithm = True
+
+    def do_GET(self):
+        server = self.server
+        with server.lock:
+            server.requests.append((self.path, dict(self.headers)))
+            server.connections.add(self.client_address)
+        status, headers, body = server.respond(self)
+        if not isinstance(body, bytes):
+            body = json.dumps(body).encode('utf-8')
+        with server.lock:
+            server.responses[status] += 1
+        self.send_response(status)
+        if 'Content-Type' not in headers:
+            self.send_header('Content-Type', 'application/json')
+        self.send_header('Content-Length', str(len(body)))
+        for k, v in headers.items():
+            self.send_header(k, v)
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, *args):
+        pass
+
+
+class StubServer(ThreadingMixIn, HTTPServer):
+    """Local HTTP stub of the Halo API
+
+    Serves :attr:`routes` first, then the responses of ``cassette``, and a
+    404 for anything else. Every request is delayed by ``latency`` plus up
+    to ``jitter`` seconds. Requests over ``rate`` for their API key are
+    answered with a 429 and a ``Retry-After`` header, and ``error_rate`` of
+    the remaining ones with a 500. Random draws come from a generator seeded
+    with ``seed``, so a sequential client sees the same delays and errors on
+    every run.
+
+    Args:
+        cassette (Optional[Cassette]): Recorded responses to serve
+        latency (Optional[float]): Seconds to delay each response
+        jitter (Optional[float]): Maximum extra random delay in seconds
+        rate (Optional[tuple]): Rate limit per API key in form
+            ``(req, sec)``, unlimited if None
+        error_rate (Optional[float]): Fraction of requests failing with a 500
+        seed (Optional[int]): Seed of the random generator
+        host (Optional[str]): Address to listen on
+        port (Optional[int]): Port to listen on, any free port by default.
+    """
+
+    daemon_threads = True
+
+    def __init__(self, cassette=None, latency=0.0, jitter=0.0, rate=None, error_rate=0.0,
+                 seed=0, host='127.0.0.1', port=0):
+        HTTPServer.__init__(self, (host, port), StubHandler)
+        self.cassette = cassette if cassette is not None else Cassette()
+        self.latency = latency
+        self.jitter = jitter
+        self.rate = rate
+        self.error_rate = error_rate
+        self.lock = threading.Lock()
+        #: Path to a JSON serializable body, bytes, or a callable taking the
+        #: request handler and returning ``(status, headers, body)``
+        self.routes = {}
+        #: ``(path, headers)`` of every request received
+        self.requests = []
+        #: Client addresses requests were received from
+        self.connections = set()
+        #: Number of responses sent per status code
+        self.responses = collections.Counter()
+        self._random = random.Random(seed)
+        self._buckets = {}
+        self._thread = None
+
+    @property
+    def url(self):
+        """str: Base URL of the server, to pass as ``HaloPy(base_url=...)``"""
+        return 'http://{0}:{1}/'.format(*self.server_address[:2])
+
+    def start(self):
+        """Serve requests on a background thread."""
+        self._thread = threading.Thread(target=self.serve_forever, args=(0.05,))
+        self._thread.daemon = True
+        self._thread.start()
+        return self
+
+    def close(self):
+        """Stop serving and close the socket."""
+        if self._thread is not None:
+            self.shutdown()
+            self._thread.join()
+            self._thread = None
+        self.server_close()
+
+    def handle_error(self, request, client_address):
+        error = sys.exc_info()[1]
+        if isinstance(error, socket.error) and error.errno in _disconnects:
+            # The client went away, e.g. closing a pooled connection
+            return
+        HTTPServer.handle_error(self, request, client_address)
+
+    def __enter__(self):
+        return self.start()
+
+    def __exit__(self, *exc_info):
+        self.close()
+
+    def _throttled(self, key):
+        """Seconds until ``key`` has a token, 0 if one was taken"""
+        capacity, per = self.rate
+        now = monotonic()
+        tokens, stamp = self._buckets.get(key, (float(capacity), now))
+        tokens = min(float(capacity), tokens + (now - stamp) * capacity / per)
+        if tokens >= 1:
+            self._buckets[key] = (tokens - 1, now)
+            return 0
+        self._buckets[key] = (tokens, now)
+        return (1 - tokens) * per / capacity
+
+    def respond(self, handler):
+        """Return the ``(status, headers, body)`` to answer a request with"""
+        with self.lock:
+            delay = self.latency + (self._random.uniform(0, self.jitter) if self.jitter else 0)
+            retry = 0
+            if self.rate is not None:
+                retry = self._throttled(handler.headers.get('Ocp-Apim-Subscription-Key'))
+            failed = not retry and self.error_rate and self._random.random() < self.error_rate
+        if delay:
+            time.sleep(delay)
+        if retry:
+            return 429, {'Retry-After': str(int(retry) + 1), 'X-RateLimit-Remaining': '0'}, {
+                'statusCode': 429,
+                'message': 'Rate limit is exceeded. Try again in {0} seconds.'.format(
+                    int(retry) + 1)}
+        if failed:
+            return 500, {}, {'statusCode': 500, 'message': 'Internal server error'}
+        return self.route(handler)
+
+    def route(self, handler):
+        """Return the routed or recorded response of a request"""
+        path = handler.path.split('?', 1)[0].lstrip('/')
+        route = self.routes.get(path)
+        if route is not None:
+            if callable(route):
+                return route(handler)
+            return 200, {}, route
+        recorded = self.cassette.get(request_key(handler.path))
+        if recorded is not None:
+            return recorded
+        return 404, {}, {'statusCode': 404, 'message': 'Resource not found'}
+
+
+def main(argv=None):
+    """Serve a cassette from a local stub server, see ``--help``."""
+    parser = argparse.ArgumentParser(prog='python -m halopy.stub',
+                                     description='Serve recorded Halo API responses locally.')
+    parser.add_argument('cassette', nargs='?', help='JSON lines file of recorded responses')
+    parser.add_argument('--host', default='127.0.0.1', help='address to listen on')
+    parser.add_argument('--port', type=int, default=8080, help='port to listen on')
+    parser.add_argument('--latency', type=float, default=0.0, help='seconds to delay responses')
+    parser.add_argument('--jitter', type=float, default=0.0, help='maximum extra random delay')
+    parser.add_argument('--rate', type=float, nargs=2, metavar=('REQ', 'SEC'),
+                        help='rate limit per API key')
+    parser.add_argument('--error-rate', type=float, default=0.0,
+                        help='fraction of requests failing with a 500')
+    parser.add_argument('--seed', type=int, default=0, help='seed of the random generator')
+    args = parser.parse_args(argv)
+
+    server = StubServer(Cassette(args.cassette), args.latency, args.jitter,
+                        tuple(args.rate) if args.rate else None, args.error_rate, args.seed,
+                        args.host, args.port)
+    print('Serving {0} recorded responses on {1}'.format(len(server.cassette), server.url))
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        server.server_close()
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -17,5 +17,11 @@ setup(
     author_email='maxpowa@outlook.com',
     license='Eiffel Forum License 2',
     packages=['halopy'],
-    install_requires=requirements
+    install_requires=requirements,
+    extras_require={
+        'async': ['httpx; python_version >= "3.8"'],
+    },
+    entry_points={
+        'console_scripts': ['halopy-bundle=halopy.bundle:main'],
+    }
 )
@@ -0,0 +1,48 @@
+# coding=utf-8
+"""
+
+Local stub of the Halo API used by the offline tests
+
+"""
+from __future__ import unicode_literals
+
+import pytest
+
+from halopy import HaloPy
+from halopy.metadata import LISTINGS
+from halopy.stub import StubServer
+
+
+@pytest.fixture
+def stub(request):
+    server = StubServer().start()
+    request.addfinalizer(server.close)
+    return server
+
+
+@pytest.fixture
+def make_api(stub, request):
+    """Factory of clients of the stub, with no cache and a generous rate limit
+    unless given other options. The clients are closed after the test."""
+    def make(**kwargs):
+        kwargs.setdefault('cache', 0)
+        kwargs.setdefault('cache_backend', 'memory')
+        kwargs.setdefault('rate', (100, 1))
+        api = HaloPy('key', base_url=stub.url, **kwargs)
+        request.addfinalizer(api.close)
+        return api
+    return make
+
+
+@pytest.fixture
+def api(make_api):
+    """Client of the stub with the defaults of :func:`make_api`"""
+    return make_api()
+
+
+@pytest.fixture
+def metadata_stub(stub):
+    """Stub serving every metadata listing, empty until a test fills it"""
+    for kind in LISTINGS:
+        stub.routes['metadata/h5/metadata/' + kind] = []
+    return stub
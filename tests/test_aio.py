@@ -0,0 +1,132 @@
+# coding=utf-8
+"""
+
+AsyncHaloPy tests
+
+"""
+from __future__ import unicode_literals
+
+import asyncio
+import threading
+import time
+
+import pytest
+
+from halopy import AsyncHaloPy, HaloPy, HaloPyError
+
+
+def run(coro):
+    loop = asyncio.new_event_loop()
+    try:
+        return loop.run_until_complete(coro)
+    finally:
+        loop.close()
+
+
+@pytest.fixture
+def make_async(make_api):
+    """Factory of async clients wrapping a client of the stub"""
+    def make(max_workers=10, **kwargs):
+        return AsyncHaloPy(api=make_api(**kwargs), max_workers=max_workers)
+    return make
+
+
+def test_async_surface():
+    for name in dir(HaloPy):
+        if name.startswith('get_'):
+            assert asyncio.iscoroutinefunction(getattr(AsyncHaloPy, name))
+    assert AsyncHaloPy.get_weapons.__doc__ == HaloPy.get_weapons.__doc__
+
+
+def test_async_get(stub, make_async):
+    stub.routes['metadata/h5/metadata/weapons'] = [{'id': '1', 'name': 'Magnum'}]
+
+    async def main():
+        async with make_async() as api:
+            return await api.get_weapons()
+    assert run(main())[0].name == 'Magnum'
+
+
+def test_async_errors(make_async):
+    async def main():
+        async with make_async() as api:
+            await api.get_weapons()
+    with pytest.raises(HaloPyError):
+        run(main())
+
+
+def test_async_gather_bound(stub, make_async):
+    active = [0, 0]
+    lock = threading.Lock()
+
+    def slow(handler):
+        with lock:
+            active[0] += 1
+            active[1] = max(active)
+        time.sleep(0.05)
+        with lock:
+            active[0] -= 1
+        return 200, {}, {'Id': handler.path}
+    for x in range(8):
+        stub.routes['stats/h5/arena/matches/{0}'.format(x)] = slow
+
+    async def main():
+        async with make_async(max_workers=8) as api:
+            return await api.gather(
+                *[api.get_arena_match_by_id(x) for x in range(8)], limit=2)
+    results = run(main())
+    assert [r.Id for r in results] == ['/stats/h5/arena/matches/{0}'.format(x) for x in range(8)]
+    assert active[1] == 2
+
+
+def test_async_coalescing(stub, make_async):
+    def slow(handler):
+        time.sleep(0.1)
+        return 200, {}, {'Id': 'abc'}
+    stub.routes['stats/h5/arena/matches/abc'] = slow
+
+    async def main():
+        async with make_async() as api:
+            return await api.gather(*[api.get_arena_match_by_id('abc') for x in range(10)])
+    assert [r.Id for r in run(main())] == ['abc'] * 10
+    assert len(stub.requests) == 1
+
+
+def test_async_without_threads(stub, make_async, monkeypatch):
+    stub.routes['metadata/h5/metadata/weapons'] = [{'id': '1', 'name': 'Magnum'}]
+
+    def blocking(*args, **kwargs):
+        raise AssertionError('sent through the blocking client')
+    monkeypatch.setattr(HaloPy, '_get', blocking)
+
+    async def main():
+        async with make_async() as api:
+            return await api.get_weapons()
+    assert run(main())[0].name == 'Magnum'
+
+
+def test_async_shares_client(stub, make_api):
+    stub.routes['metadata/h5/metadata/weapons'] = [{'id': '1', 'name': 'Magnum'}]
+    sync = make_api(cache=300)
+
+    async def main():
+        async with AsyncHaloPy(api=sync) as api:
+            await api.get_weapons()
+    run(main())
+    assert sync.get_weapons()[0].name == 'Magnum'
+    assert len(stub.requests) == 1
+    assert sync.cache_stats['hits'] == 1
+
+
+def test_async_rate_limit(stub, make_async):
+    for x in range(4):
+        stub.routes['stats/h5/arena/matches/{0}'.format(x)] = {'Id': x}
+
+    async def main(**kwargs):
+        async with make_async(**kwargs) as api:
+            return await api.gather(*[api.get_arena_match_by_id(x) for x in range(4)])
+    start = time.time()
+    assert [r.Id for r in run(main(rate=(2, 0.2), rate_timeout=None))] == list(range(4))
+    assert time.time() - start >= 0.15
+    with pytest.raises(HaloPyError):
+        run(main(rate=(2, 10)))
@@ -0,0 +1,106 @@
+# coding=utf-8
+"""
+
+HaloPy bulk API tests
+
+"""
+from __future__ import unicode_literals
+
+import threading
+import time
+
+import pytest
+
+try:
+    from urllib.parse import parse_qs, urlsplit
+except ImportError:  # Python 2
+    from urlparse import parse_qs, urlsplit
+
+from halopy import HaloPyError
+
+
+def service_records(handler):
+    players = parse_qs(urlsplit(handler.path).query)['players']
+    if 'broken' in players:
+        return 500, {}, {}
+    return 200, {}, {'Results': [{'Id': gt, 'ResultCode': 0, 'Result': {'Xp': 1}}
+                                 for gt in players]}
+
+
+def test_bulk_service_records(stub, make_api):
+    stub.routes['stats/h5/servicerecords/arena'] = service_records
+    api = make_api(rate=(5, 0.1))
+    gamertags = ['player{0}'.format(x) for x in range(100)]
+    gamertags += ['PLAYER0', 'player1']
+    results = list(api.iter_players_service_record(iter(gamertags), 'arena', batch_size=10))
+    assert sorted(r.Id for r in results) == sorted(gamertags[:100])
+    assert all(r.Xp == 1 for r in results)
+    assert len(stub.requests) == 10
+
+
+def test_bulk_batch_size_capped(stub, make_api):
+    stub.routes['stats/h5/servicerecords/arena'] = service_records
+    api = make_api()
+    gamertags = ['player{0}'.format(x) for x in range(40)]
+    results = list(api.iter_players_service_record(gamertags, 'arena', batch_size=100))
+    assert len(results) == 40
+    assert len(stub.requests) == 2
+
+
+def test_bulk_partial_failure(stub, make_api):
+    stub.routes['stats/h5/servicerecords/arena'] = service_records
+    api = make_api()
+    gamertags = ['a', 'b', 'broken', 'c']
+    results = dict((r.Id, r) for r in
+                   api.iter_players_service_record(gamertags, 'arena', batch_size=2))
+    assert results['a'].ResultCode == 0
+    assert results['b'].ResultCode == 0
+    assert results['broken'].ResultCode == 2
+    assert results['c'].ResultCode == 2
+    assert results['c'].Error == 'Internal server error'
+
+
+def slow_match(handler):
+    time.sleep(0.2)
+    return 200, {}, {'Id': 'abc'}
+
+
+def fan_out(fn, count):
+    results = []
+    threads = [threading.Thread(target=lambda: results.append(fn())) for x in range(count)]
+    for t in threads:
+        t.start()
+    for t in threads:
+        t.join()
+    return results
+
+
+@pytest.mark.parametrize('cache', [0, 60])
+def test_coalesces_identical_requests(stub, make_api, cache):
+    stub.routes['stats/h5/arena/matches/abc'] = slow_match
+    api = make_api(cache=cache, rate=(1, 10))
+    results = fan_out(lambda: api.get_arena_match_by_id('abc'), 20)
+    assert [r.Id for r in results] == ['abc'] * 20
+    assert len(stub.requests) == 1
+
+
+def test_coalesces_errors(stub, make_api):
+    api = make_api(rate=(1, 10))
+
+    def fetch():
+        try:
+            api.get_arena_match_by_id('missing')
+        except HaloPyError as ex:
+            return str(ex)
+    stub.routes['stats/h5/arena/matches/missing'] = lambda handler: (time.sleep(0.2) or 404, {}, {})
+    assert fan_out(fetch, 5) == ['Endpoint not found'] * 5
+    assert len(stub.requests) == 1
+
+
+def test_distinct_requests_not_coalesced(stub, make_api):
+    stub.routes['stats/h5/arena/matches/abc'] = slow_match
+    api = make_api(rate=(10, 10))
+    fan_out(lambda: api.request('stats/h5/arena/matches/abc'), 2)
+    fan_out(lambda: api.request('stats/h5/arena/matches/abc', headers={'X-Other': str(
+        threading.current_thread().ident)}), 2)
+    assert len(stub.requests) == 3
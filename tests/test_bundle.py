@@ -0,0 +1,74 @@
+# coding=utf-8
+"""
+
+HaloPy metadata bundle tests
+
+"""
+from __future__ import unicode_literals
+
+import pytest
+
+from halopy import HaloPyError
+from halopy.bundle import MetadataBundle, main, write_bundle
+from halopy.metadata import MetadataIndex
+
+MEDALS = [{'id': 1, 'name': 'Double Kill'}, {'id': 2, 'name': 'Headshot'},
+          {'id': 3, 'name': 'headshot'}]
+WEAPONS = [{'id': '100', 'name': 'Magnum'}]
+MAPS = [{'id': 'map-1', 'name': 'Truth'}]
+
+
+@pytest.fixture
+def bundle(tmpdir):
+    path = str(tmpdir.join('metadata.bundle'))
+    index = MetadataIndex({'medals': MEDALS, 'weapons': WEAPONS, 'maps': MAPS})
+    write_bundle(index, path)
+    with MetadataBundle(path) as bundle:
+        yield bundle
+
+
+def test_bundle_lookups(bundle):
+    assert bundle.kinds == ['maps', 'medals', 'weapons']
+    assert bundle.items('medals') == MEDALS
+    assert bundle.items('vehicles') == []
+    assert bundle.get('medals', 2) == MEDALS[1]
+    assert bundle.get('weapons', 100) == WEAPONS[0]
+    assert bundle.get('maps', 'MAP-1') == MAPS[0]
+    assert bundle.get('medals', 99) is None
+    assert bundle.by_name('medals', 'HEADSHOT') == MEDALS[1]
+    assert bundle.by_name('weapons', 'Needler') is None
+
+
+def test_bundle_resolve(bundle):
+    match = {'MapId': 'map-1', 'PlayerStats': [{'MedalAwards': [{'MedalId': 1, 'Count': 1}]}]}
+    resolved = bundle.resolve(match)
+    assert resolved.Metadata['Map'] == MAPS[0]
+    assert resolved.Metadata['Medals'] == {1: MEDALS[0]}
+
+
+def test_bundle_rejects_other_files(tmpdir):
+    path = tmpdir.join('other.bundle')
+    path.write_binary(b'\0' * 64)
+    with pytest.raises(HaloPyError):
+        MetadataBundle(str(path))
+    path.write_binary(b'')
+    with pytest.raises(HaloPyError):
+        MetadataBundle(str(path))
+
+
+def test_bundle_rejects_truncated_files(bundle, tmpdir):
+    with open(bundle.path, 'rb') as f:
+        data = f.read()
+    path = tmpdir.join('truncated.bundle')
+    for size in (10, len(data) // 2, len(data) - 1):
+        path.write_binary(data[:size])
+        with pytest.raises(HaloPyError):
+            MetadataBundle(str(path))
+
+
+def test_bundle_command(metadata_stub, tmpdir):
+    metadata_stub.routes['metadata/h5/metadata/maps'] = MAPS
+    path = str(tmpdir.join('metadata.bundle'))
+    assert main([path, '--api-key', 'key', '--base-url', metadata_stub.url]) == 0
+    with MetadataBundle(path) as bundle:
+        assert bundle.by_name('maps', 'truth') == MAPS[0]
@@ -0,0 +1,191 @@
+# coding=utf-8
+"""
+
+HaloPy response cache tests
+
+"""
+from __future__ import unicode_literals
+
+import sqlite3
+import time
+
+import pytest
+import requests
+
+from halopy import HaloPyError
+from halopy.cache import CacheEntry, MemoryCache, SQLiteCache, TieredCache, create_cache
+
+
+def entry(content=b'{}', expires=None):
+    return CacheEntry('http://example/', 200, {'Content-Type': 'application/json'},
+                      content, expires)
+
+
+def test_memory_lru():
+    cache = MemoryCache(max_entries=2, max_bytes=10)
+    cache.set('a', entry(b'aaa'))
+    cache.set('b', entry(b'bbb'))
+    cache.get('a')
+    cache.set('c', entry(b'ccc'))
+    assert cache.get('b') is None
+    assert cache.get('a').content == b'aaa'
+    cache.set('d', entry(b'dddddddd'))
+    assert len(cache) == 1 and cache.size == 8
+    cache.set('e', entry(b'x' * 11))
+    assert cache.get('e') is None
+
+
+def test_sqlite_persistence_and_eviction(tmpdir):
+    path = str(tmpdir.join('cache.sqlite'))
+    cache = SQLiteCache(path, max_entries=2)
+    cache.set('a', entry(b'aaa', expires=5.0))
+    cache.set('b', entry(b'bbb'))
+    cache.set('c', entry(b'ccc'))
+    cache.close()
+
+    cache = SQLiteCache(path, max_bytes=4)
+    assert len(cache) == 2 and cache.size == 6
+    assert cache.get('a') is None
+    hit = cache.get('b')
+    assert hit.content == b'bbb' and hit.expires is None
+    assert hit.headers == {'Content-Type': 'application/json'}
+    cache.set('d', entry(b'dd'))
+    assert cache.get('b') is None and cache.get('c') is None
+    assert cache.get('d').content == b'dd'
+
+
+def test_tiered_promotion(tmpdir):
+    back = SQLiteCache(str(tmpdir.join('cache.sqlite')))
+    cache = TieredCache(MemoryCache(), back)
+    back.set('a', entry(b'aaa'))
+    assert cache.front.get('a') is None
+    assert cache.get('a').content == b'aaa'
+    back.clear()
+    assert cache.get('a').content == b'aaa'
+    cache.delete('a')
+    assert cache.get('a') is None
+
+
+def test_entry_freshness():
+    assert entry().fresh()
+    assert entry(expires=time.time() + 10).fresh()
+    assert not entry(expires=time.time() - 1).fresh()
+
+
+def test_create_cache(tmpdir):
+    assert isinstance(create_cache('memory', memory_entries=5), MemoryCache)
+    cache = create_cache('sqlite', cache_name=str(tmpdir.join('halo')), disk_bytes=100)
+    assert cache.back.path.endswith('halo.sqlite')
+    assert cache.back.max_bytes == 100
+    assert create_cache(cache) is cache
+    with pytest.raises(ValueError):
+        create_cache('redis')
+    with pytest.raises(HaloPyError):
+        create_cache('memory', disk_entries=5)
+    with pytest.raises(HaloPyError):
+        create_cache('sqlite', cache_name=str(tmpdir.join('halo')), expire_after=60)
+    with pytest.raises(HaloPyError):
+        create_cache(cache, memory_entries=5)
+
+
+def test_sqlite_cache_over_requests_cache(tmpdir):
+    path = str(tmpdir.join('cache.sqlite'))
+    db = sqlite3.connect(path)
+    with db:
+        db.execute('CREATE TABLE responses (key PRIMARY KEY, value, expires INTEGER)')
+        db.execute("INSERT INTO responses VALUES ('a', 'pickled', 0)")
+    db.close()
+    cache = SQLiteCache(path)
+    assert cache.get('a') is None
+    cache.set('a', entry(b'aaa'))
+    assert cache.get('a').content == b'aaa'
+    cache.close()
+
+
+def test_client_cache_hits(stub, make_api):
+    stub.routes['metadata/h5/metadata/maps'] = [{'id': '1'}]
+    api = make_api(cache=60, rate=(1, 10))
+    assert api.get_maps()[0].id == '1'
+    response = api.request('metadata/h5/metadata/maps')
+    assert response.from_cache
+    assert response.json() == [{'id': '1'}]
+    # The hit neither reached the server nor used a token
+    assert len(stub.requests) == 1
+
+
+def test_client_caches_are_independent(stub, make_api):
+    stub.routes['metadata/h5/metadata/maps'] = []
+    cached = make_api(cache=60)
+    uncached = make_api()
+    cached.get_maps()
+    cached.get_maps()
+    uncached.get_maps()
+    uncached.get_maps()
+    assert len(stub.requests) == 3
+    assert not hasattr(requests.get(stub.url + 'metadata/h5/metadata/maps'), 'from_cache')
+
+
+def test_client_cache_expiry(stub, make_api):
+    stub.routes['metadata/h5/metadata/maps'] = []
+    api = make_api(cache=0.1)
+    api.get_maps()
+    api.get_maps()
+    time.sleep(0.15)
+    api.get_maps()
+    assert len(stub.requests) == 2
+
+
+def test_cache_ttl_policy(stub, make_api):
+    for path in ('metadata/h5/metadata/maps', 'stats/h5/arena/matches/abc',
+                 'stats/h5/players/someone/matches', 'profile/h5/profiles/someone/emblem'):
+        stub.routes[path] = {}
+    api = make_api(cache={'metadata': 3600, 'match': None, 'stats': 0})
+    assert api.cache_ttl('metadata') == 3600
+    assert api.cache_ttl('profile') == 300
+    for x in range(2):
+        api.get_maps()
+        api.get_arena_match_by_id('abc')
+        api.get_player_matches('someone')
+        api.get_player_emblem('someone')
+    paths = [path.split('?')[0] for path, headers in stub.requests]
+    assert paths.count('/stats/h5/players/someone/matches') == 2
+    assert len(paths) == 5
+    entry = api.response_cache.get(stub.url + 'stats/h5/arena/matches/abc?')
+    assert entry.expires is None
+
+    api.cache = {'default': 0}
+    api.get_maps()
+    assert len(stub.requests) == 6
+    with pytest.raises(ValueError):
+        api.cache = {'matches': None}
+
+
+def test_conditional_revalidation(stub, make_api):
+    body = [{'id': x, 'name': 'impulse'} for x in range(100)]
+
+    def impulses(handler):
+        if handler.headers.get('If-None-Match') == '"v1"':
+            return 304, {'ETag': '"v1"'}, b''
+        return 200, {'ETag': '"v1"'}, body
+    stub.routes['metadata/h5/metadata/impulses'] = impulses
+    api = make_api(cache=0.05)
+    first = api.get_impulses()
+    size = len(api.request('metadata/h5/metadata/impulses').content)
+    time.sleep(0.1)
+    second = api.get_impulses()
+    assert [r.id for r in second] == [r.id for r in first]
+    assert stub.requests[1][1]['If-None-Match'] == '"v1"'
+    assert api.cache_stats == {'hits': 1, 'misses': 1, 'revalidated': 1,
+                               'bytes_saved': 2 * size}
+    # The 304 refreshed the entry
+    api.get_impulses()
+    assert len(stub.requests) == 2
+
+
+def test_entry_validators():
+    cached = CacheEntry('http://example/', 200, {'etag': '"a"', 'Last-Modified': 'then'}, b'x', 1)
+    assert cached.validators() == {'If-None-Match': '"a"', 'If-Modified-Since': 'then'}
+    refreshed = cached.revalidated({'ETag': '"b"', 'Content-Length': '0'}, 5)
+    assert refreshed.headers == {'ETag': '"b"', 'Last-Modified': 'then'}
+    assert refreshed.content == b'x' and refreshed.expires == 5
+    assert entry().validators() == {}
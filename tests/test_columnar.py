@@ -0,0 +1,65 @@
+# coding=utf-8
+"""
+
+HaloPy columnar export tests
+
+"""
+from __future__ import unicode_literals
+
+import pytest
+
+from halopy import HaloPyResult
+from halopy.columnar import match_tables, service_record_table, to_arrow, to_numpy
+
+
+def make_match(match_id, players):
+    return HaloPyResult({'Id': {'MatchId': match_id}, 'PlayerStats': [{
+        'Player': {'Gamertag': 'player{0}'.format(n)}, 'TotalKills': n + 1,
+        'TotalDeaths': 2, 'TotalShotsFired': 10, 'TotalShotsLanded': n,
+        'MedalAwards': [{'MedalId': 1, 'Count': n}, {'MedalId': 2, 'Count': 1}],
+        'WeaponStats': [{'WeaponId': {'StockId': 5}, 'TotalKills': n + 1,
+                         'TotalDamageDealt': 10.5}],
+    } for n in range(players)]})
+
+
+def test_match_tables():
+    tables = match_tables([make_match('a', 2), make_match('b', 3)])
+    players = tables['players']
+    assert len(players) == 5
+    assert players.columns['match_id'] == ['a', 'a', 'b', 'b', 'b']
+    assert players.columns['kills'] == [1, 2, 1, 2, 3]
+    assert players.columns['rank'] == [None] * 5
+    assert len(tables['medals']) == 10
+    assert tables['medals'].columns['gamertag'][:2] == ['player0', 'player0']
+    assert tables['weapons'].columns['damage'] == [10.5] * 5
+
+
+def test_match_ids():
+    tables = match_tables([{'PlayerStats': [{}]}, {'PlayerStats': [{}]}])
+    assert tables['players'].columns['match_id'] == ['0', '1']
+    tables = match_tables([{'PlayerStats': [{}]}], match_ids=['x'])
+    assert tables['players'].columns['match_id'] == ['x']
+
+
+def test_service_record_table():
+    table = service_record_table([{'Id': 'a', 'ResultCode': 0,
+                                   'Result': {'ArenaStats': {'TotalKills': 3}}}])
+    assert table.columns['kills'] == [3]
+    assert table.columns['stats_key'] == ['ArenaStats']
+
+
+def test_to_numpy():
+    np = pytest.importorskip('numpy')
+    players = to_numpy(match_tables([make_match('a', 2), make_match('b', 3)]))['players']
+    assert players['kills'].sum() / players['deaths'].sum() == 0.9
+    assert players['rank'].tolist() == [0] * 5
+    assert np.isnan(players['weapon_damage']).all()
+    assert players['match_id'].tolist() == ['a', 'a', 'b', 'b', 'b']
+
+
+def test_to_arrow():
+    pytest.importorskip('pyarrow')
+    tables = to_arrow(match_tables([make_match('a', 2)]))
+    assert tables['players'].column('kills').to_pylist() == [1, 2]
+    assert tables['players'].column('rank').null_count == 2
+    assert tables['medals'].num_rows == 4
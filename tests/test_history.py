@@ -0,0 +1,123 @@
+# coding=utf-8
+"""
+
+HaloPy match history tests
+
+"""
+from __future__ import unicode_literals
+
+import datetime
+
+try:
+    from urllib.parse import parse_qs, urlsplit
+except ImportError:  # Python 2
+    from urlparse import parse_qs, urlsplit
+
+from halopy.history import MemoryWatermarkStore, SQLiteWatermarkStore, parse_date
+
+EPOCH = datetime.datetime(2016, 1, 1)
+
+
+def make_matches(count):
+    return [{'Id': {'MatchId': 'match-{0}'.format(x), 'GameMode': 1},
+             'MatchCompletedDate': {'ISO8601Date': (EPOCH - datetime.timedelta(hours=x))
+                                    .strftime('%Y-%m-%dT%H:%M:%SZ')}}
+            for x in range(count)]
+
+
+def history_route(matches):
+    def route(handler):
+        query = parse_qs(urlsplit(handler.path).query)
+        start = int(query.get('start', [0])[0])
+        count = int(query.get('count', [25])[0])
+        page = matches[start:start + count]
+        return 200, {}, {'Start': start, 'Count': len(page), 'ResultCount': len(page),
+                         'Results': page}
+    return route
+
+
+def serve(stub, matches):
+    stub.routes['stats/h5/players/someone/matches'] = history_route(matches)
+
+
+def test_iterates_all_pages(stub, api):
+    serve(stub, make_matches(60))
+    history = api.iter_player_matches('someone')
+    ids = [m.Id['MatchId'] for m in history]
+    assert ids == ['match-{0}'.format(x) for x in range(60)]
+    assert len(stub.requests) == 3
+    assert history._executor._shutdown
+
+
+def test_exact_page_multiple(stub, api):
+    serve(stub, make_matches(50))
+    assert len(list(api.iter_player_matches('someone', prefetch=False))) == 50
+    assert len(stub.requests) == 3
+
+
+def test_prefetches_next_page(stub, api):
+    serve(stub, make_matches(60))
+    history = api.iter_player_matches('someone')
+    next(history)
+    history._next_page.result()
+    assert len(stub.requests) == 2
+    history.close()
+    assert list(history) == []
+
+
+def test_stops_at_match_and_date(stub, api):
+    serve(stub, make_matches(60))
+    history = api.iter_player_matches('someone', until_match_id='match-30')
+    assert len(list(history)) == 30
+    history = api.iter_player_matches('someone', until=EPOCH - datetime.timedelta(hours=9, minutes=30))
+    assert len(list(history)) == 10
+    history = api.iter_player_matches('someone', until='2015-12-31T14:30:00Z')
+    assert len(list(history)) == 10
+
+
+def test_resume_from_checkpoint(stub, api):
+    serve(stub, make_matches(40))
+    history = api.iter_player_matches('someone')
+    for x in range(30):
+        next(history)
+    checkpoint = history.position
+    history.close()
+    rest = list(api.iter_player_matches('someone', start=checkpoint))
+    assert [m.Id['MatchId'] for m in rest] == ['match-{0}'.format(x) for x in range(30, 40)]
+
+
+def test_parse_date():
+    assert parse_date('2015-11-01T12:30:05.1234567Z') == \
+        datetime.datetime(2015, 11, 1, 12, 30, 5, 123456)
+    assert parse_date('2015-11-01T12:30:05Z') == datetime.datetime(2015, 11, 1, 12, 30, 5)
+
+
+def test_incremental_sync(stub, api, tmpdir):
+    matches = make_matches(60)[10:]
+    serve(stub, matches)
+    store = SQLiteWatermarkStore(str(tmpdir.join('marks.sqlite')))
+    assert len(api.sync_player_matches('someone', store)) == 50
+    assert store.get('someone|') == {'MatchId': 'match-10',
+                                     'Date': matches[0]['MatchCompletedDate']['ISO8601Date']}
+    del stub.requests[:]
+
+    stub.routes['stats/h5/players/SomeOne/matches'] = history_route(matches)
+    assert api.sync_player_matches('SomeOne', store) == []
+    assert len(stub.requests) == 1
+
+    matches[:0] = make_matches(10)
+    del stub.requests[:]
+    new = api.sync_player_matches('someone', store)
+    assert [m.Id['MatchId'] for m in new] == ['match-{0}'.format(x) for x in range(10)]
+    assert len(stub.requests) == 1
+    assert store.get('someone|')['MatchId'] == 'match-0'
+    store.close()
+
+
+def test_sync_since(stub, api):
+    serve(stub, make_matches(60))
+    store = MemoryWatermarkStore()
+    new = api.sync_player_matches('someone', store, modes='arena', since='2015-12-31T20:00:00Z')
+    assert len(new) == 5
+    assert store.get('someone|arena')['MatchId'] == 'match-0'
+    assert store.get('someone|') is None
@@ -0,0 +1,79 @@
+# coding=utf-8
+"""
+
+HaloPy match hydration tests
+
+"""
+from __future__ import unicode_literals
+
+import pytest
+
+from halopy import HaloPyResult
+from halopy.models import MatchSummary
+
+MODES = {1: 'arena', 2: 'campaign', 3: 'custom', 4: 'warzone'}
+
+
+def summary(match_id, mode):
+    return {'Id': {'MatchId': match_id, 'GameMode': mode}}
+
+
+@pytest.fixture
+def api(stub, make_api):
+    for x in range(12):
+        mode = MODES[x % 4 + 1]
+        stub.routes['stats/h5/{0}/matches/m{1}'.format(mode, x)] = {'Mode': mode, 'Index': x}
+    return make_api(cache=60)
+
+
+def test_hydrate_dispatches_by_mode(api):
+    summaries = [summary('m{0}'.format(x), x % 4 + 1) for x in range(12)]
+    summaries[0] = HaloPyResult(summaries[0])
+    summaries[1] = MatchSummary.from_dict(summaries[1])
+    details = list(api.hydrate_matches(iter(summaries), workers=3))
+    assert sorted(d.Index for d in details) == list(range(12))
+    assert all(d.Mode == MODES[d.Index % 4 + 1] for d in details)
+
+
+def test_hydrate_ordered(api):
+    summaries = [summary('m{0}'.format(x), x % 4 + 1) for x in range(12)]
+    details = list(api.hydrate_matches(summaries, workers=4, ordered=True))
+    assert [d.Index for d in details] == list(range(12))
+
+
+def test_hydrate_skips_cached(api, stub):
+    summaries = [summary('m{0}'.format(x), x % 4 + 1) for x in range(12)]
+    list(api.hydrate_matches(summaries[:6]))
+    assert len(stub.requests) == 6
+    details = list(api.hydrate_matches(summaries))
+    assert sorted(d.Index for d in details) == list(range(12))
+    assert len(stub.requests) == 12
+    assert api.cache_stats['hits'] == 6
+
+
+def test_hydrate_failures(api):
+    details = list(api.hydrate_matches([summary('m0', 1), summary('missing', 2),
+                                        summary('m0', 7)], ordered=True))
+    assert details[0].Index == 0
+    assert details[1].MatchId == 'missing'
+    assert details[1].Error == 'Endpoint not found'
+    assert details[2].Error == 'Unknown game mode: 7'
+    with pytest.raises(ValueError):
+        api.get_match_by_id('m0', 'firefight')
+    assert api.get_match_by_id('m0', 'arena').Index == 0
+
+
+def test_hydrate_cached_is_lazy(api, stub):
+    summaries = [summary('m{0}'.format(x), x % 4 + 1) for x in range(12)]
+    list(api.hydrate_matches(summaries))
+    pulled = []
+
+    def source():
+        for x in range(200):
+            pulled.append(x)
+            yield summaries[x % 12]
+    details = api.hydrate_matches(source(), workers=2)
+    assert next(details).Index == 0
+    assert len(pulled) == 1
+    assert len(list(details)) == 199
+    assert len(stub.requests) == 12
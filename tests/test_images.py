@@ -0,0 +1,133 @@
+# coding=utf-8
+"""
+
+HaloPy image store tests
+
+"""
+from __future__ import unicode_literals
+
+import os
+
+import pytest
+
+from halopy import HaloPyError, ImageStore
+
+EMBLEM = b'\x89PNG' + bytes(bytearray(range(256))) * 64
+
+
+def image(body, etag='"v1"'):
+    def handler(handler):
+        if handler.headers.get('If-None-Match') == etag:
+            return 304, {'ETag': etag}, b''
+        requested = handler.headers.get('Range')
+        if requested and handler.headers.get('If-Range') == etag:
+            start = int(requested.split('=')[1].rstrip('-'))
+            return 206, {'ETag': etag, 'Content-Range': 'bytes {0}-{1}/{2}'.format(
+                start, len(body) - 1, len(body))}, body[start:]
+        return 200, {'ETag': etag}, body
+    return handler
+
+
+@pytest.fixture
+def api(stub, make_api):
+    stub.routes['profile/h5/profiles/alpha/emblem'] = image(EMBLEM)
+    stub.routes['profile/h5/profiles/bravo/emblem'] = image(EMBLEM)
+    stub.routes['profile/h5/profiles/alpha/spartan'] = image(b'spartan', '"s1"')
+    return make_api(cache=60)
+
+
+def test_images_stored_by_content(api, stub, tmpdir):
+    with ImageStore(str(tmpdir)) as store:
+        first = store.emblem(api, 'alpha', 128)
+        second = store.emblem(api, 'bravo', 128)
+        spartan = store.spartan_image(api, 'alpha', 128, 'portrait')
+        assert first.digest == second.digest
+        assert first.path == second.path
+        assert first.length == len(EMBLEM)
+        assert store.read(first) == EMBLEM
+        content = store.open(spartan)
+        assert content[:] == b'spartan'
+        content.close()
+        assert len(store) == 3
+        assert store.emblem(api, 'ALPHA', 128).digest == first.digest
+        assert len(stub.requests) == 3
+        assert len(api.response_cache) == 0
+        assert 'crop=portrait' in stub.requests[2][0]
+
+
+def test_images_through_client(api, stub, tmpdir):
+    with ImageStore(str(tmpdir)) as store:
+        api.image_store = store
+        response = api.get_player_emblem('alpha', 128)
+        assert response.content == EMBLEM
+        assert response.headers['ETag'] == '"v1"'
+        assert response.url.endswith('profile/h5/profiles/alpha/emblem?size=128')
+        assert not response.from_cache
+        assert api.get_player_emblem('alpha', 128).from_cache
+        assert api.get_player_spartan_image('alpha', crop='portrait').content == b'spartan'
+        assert len(stub.requests) == 2
+        assert len(api.response_cache) == 0
+        assert len(store) == 2
+
+
+def test_images_revalidated(api, stub, tmpdir):
+    with ImageStore(str(tmpdir), ttl=0) as store:
+        first = store.emblem(api, 'alpha')
+        second = store.emblem(api, 'alpha')
+        assert second.digest == first.digest
+        assert second.stamp >= first.stamp
+        assert stub.requests[1][1]['If-None-Match'] == '"v1"'
+
+
+def test_images_changed(api, stub, tmpdir):
+    with ImageStore(str(tmpdir)) as store:
+        first = store.emblem(api, 'alpha')
+        stub.routes['profile/h5/profiles/alpha/emblem'] = image(b'new', '"v2"')
+        second = store.emblem(api, 'alpha', refresh=True)
+        assert second.digest != first.digest
+        assert store.read(second) == b'new'
+        assert store.prune() == 1
+        assert not os.path.exists(first.path)
+
+
+def test_images_resumed(api, stub, tmpdir):
+    with ImageStore(str(tmpdir)) as store:
+        key = store.key('emblem', 'alpha')
+        with open(store._partial(key), 'wb') as f:
+            f.write(EMBLEM[:1000])
+        store._db.execute('INSERT INTO partials VALUES (?, ?)', (key, '"v1"'))
+        stored = store.emblem(api, 'alpha')
+        assert stub.requests[0][1]['Range'] == 'bytes=1000-'
+        assert store.read(stored) == EMBLEM
+        assert stored.digest == store.emblem(api, 'bravo').digest
+        assert not os.listdir(os.path.join(str(tmpdir), 'partial'))
+
+
+def test_images_errors(api, tmpdir):
+    with ImageStore(str(tmpdir)) as store:
+        with pytest.raises(HaloPyError):
+            store.emblem(api, 'nobody')
+        with pytest.raises(ValueError):
+            store.fetch(api, 'avatar', 'alpha')
+
+
+def test_images_prefetch(api, stub, tmpdir):
+    for gt in ('alpha', 'bravo', 'charlie'):
+        stub.routes['profile/h5/profiles/{0}/emblem'.format(gt)] = image(EMBLEM)
+        stub.routes['profile/h5/profiles/{0}/spartan'.format(gt)] = image(gt.encode('utf-8'))
+    seen = []
+    with ImageStore(str(tmpdir), ttl=None) as store:
+        store.emblem(api, 'alpha', 95)
+        stats = store.prefetch(api, ['alpha', 'bravo', 'ALPHA', 'charlie', 'nobody'],
+                               ('emblem', 'spartan'), (95, 512), ('full', 'portrait'),
+                               workers=3, progress=lambda s: seen.append(s['done']))
+        assert stats['total'] == 24
+        assert stats['skipped'] == 1
+        assert stats['failed'] == 6
+        assert stats['downloaded'] == 17
+        assert stats['bytes'] > 0
+        assert seen == list(range(1, 25))
+        assert stats['errors'][0][1] == 'Endpoint not found'
+        assert len(store) == 18
+        assert len(stub.requests) == 24
+        assert store.prefetch(api, ['bravo'], sizes=[512])['skipped'] == 1
@@ -0,0 +1,83 @@
+# coding=utf-8
+"""
+
+HaloPy instrumentation tests
+
+"""
+from __future__ import unicode_literals
+
+import socket
+
+import pytest
+
+from halopy import HaloPyError, Instrument, Metrics, StatsD
+from halopy.instrument import Instruments, endpoint_name
+
+
+def test_endpoint_names():
+    assert endpoint_name('metadata/h5/metadata/weapons') == 'metadata/h5/metadata/weapons'
+    assert endpoint_name('metadata/h5/metadata/game-variants/abc') == \
+        'metadata/h5/metadata/game-variants/{id}'
+    assert endpoint_name('profile/h5/profiles/Some Player/emblem?size=95') == \
+        'profile/h5/profiles/{player}/emblem'
+    assert endpoint_name('stats/h5/players/gt/matches') == 'stats/h5/players/{player}/matches'
+    assert endpoint_name('stats/h5/warzone/matches/m1') == 'stats/h5/{mode}/matches/{id}'
+    assert endpoint_name('stats/h5/servicerecords/arena') == 'stats/h5/servicerecords/{mode}'
+
+
+def test_metrics(stub, make_api):
+    stub.routes['metadata/h5/metadata/weapons'] = [{'id': '1', 'name': 'Magnum'}]
+    stub.routes['stats/h5/arena/matches/m1'] = lambda handler: (
+        429, {'Retry-After': '0'}, {})
+    metrics = Metrics()
+    api = make_api(cache=60, rate_timeout=None, throttle_retries=0, instrument=metrics)
+    api._throttle.backoff = 0.001
+    api.get_weapons()
+    api.get_weapons()
+    with pytest.raises(HaloPyError):
+        api.get_arena_match_by_id('m1')
+    with pytest.raises(HaloPyError):
+        api.get_warzone_match_by_id('m2')
+
+    summary = metrics.summary()
+    weapons = 'metadata/h5/metadata/weapons'
+    matches = 'stats/h5/{mode}/matches/{id}'
+    assert summary['counters']['cache_hit'] == {weapons: 1}
+    assert summary['counters']['cache_miss'] == {weapons: 1, matches: 2}
+    assert summary['counters']['throttled'] == {matches: 1}
+    assert summary['counters']['error'] == {matches: 1}
+    timings = summary['timings']
+    assert timings['request'][weapons]['count'] == 2
+    assert timings['cache'][weapons]['count'] == 2
+    assert timings['network'][weapons]['count'] == 1
+    assert timings['limiter'][matches]['count'] == 2
+    assert timings['decode'][weapons]['count'] == 2
+    assert timings['result'][weapons]['count'] == 2
+    assert 0 < timings['request'][weapons]['p50'] <= timings['request'][weapons]['p99']
+
+    text = metrics.prometheus()
+    assert '# TYPE halopy_phase_seconds histogram' in text
+    assert 'halopy_events_total{endpoint="metadata/h5/metadata/weapons",' \
+        'event="cache_hit"} 1' in text
+    assert 'halopy_phase_seconds_count{endpoint="metadata/h5/metadata/weapons",' \
+        'phase="request"} 2' in text
+    assert 'le="+Inf",phase="request"} 2' in text
+    metrics.reset()
+    assert metrics.summary() == {'counters': {}, 'timings': {}}
+
+
+def test_statsd(stub, make_api):
+    receiver = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+    receiver.bind(('127.0.0.1', 0))
+    receiver.settimeout(2)
+    statsd = StatsD(port=receiver.getsockname()[1])
+    stub.routes['metadata/h5/metadata/maps'] = []
+    api = make_api(instrument=Instruments(Instrument(), statsd))
+    api.get_maps()
+    lines = set()
+    for x in range(4):
+        lines.add(receiver.recv(512).decode('utf-8').split(':')[0])
+    assert lines == set('halopy.{0}.metadata.h5.metadata.maps'.format(phase)
+                        for phase in ('limiter', 'network', 'request', 'decode'))
+    statsd.close()
+    receiver.close()
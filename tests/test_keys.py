@@ -0,0 +1,108 @@
+# coding=utf-8
+"""
+
+HaloPy key pool tests
+
+"""
+from __future__ import unicode_literals
+
+import collections
+import threading
+import time
+
+import pytest
+
+from halopy import HaloPy, HaloPyError, KeyPool, TokenBucket
+from halopy import scheduler
+
+
+def by_key(statuses):
+    def handler(handler):
+        key = handler.headers.get('Ocp-Apim-Subscription-Key')
+        status = statuses.get(key, 200)
+        return status, {'Retry-After': '0'} if status == 429 else {}, {'Key': key}
+    return handler
+
+
+def used_keys(stub):
+    return collections.Counter(headers['Ocp-Apim-Subscription-Key']
+                               for _, headers in stub.requests)
+
+
+def test_keys_balanced(stub):
+    stub.routes['metadata/h5/metadata/weapons'] = by_key({})
+    api = HaloPy(['k1', 'k2', 'k3'], base_url=stub.url, cache=0, cache_backend='memory',
+                 rate=(2, 60))
+    for x in range(6):
+        api.get_weapons()
+    with pytest.raises(HaloPyError):
+        api.get_weapons()
+    assert used_keys(stub) == {'k1': 2, 'k2': 2, 'k3': 2}
+    assert api.api_key == 'k1'
+    assert api.keys.stats()['k2']['requests'] == 2
+    assert api.keys.available() == pytest.approx(0, abs=0.01)
+    api.rate = (5, 60)
+    assert all(key.limiter.rate == (5, 60) for key in api.keys.keys)
+
+
+def test_keys_unauthorized_removed(stub):
+    stub.routes['metadata/h5/metadata/weapons'] = by_key({'bad': 401})
+    api = HaloPy(['bad', 'good'], base_url=stub.url, cache=0, cache_backend='memory',
+                 rate=(100, 1))
+    for x in range(5):
+        api.get_weapons()
+    assert used_keys(stub) == {'bad': 1, 'good': 5}
+    stats = api.keys.stats()
+    assert stats['bad']['state'] == 'removed'
+    assert stats['good']['state'] == 'active'
+
+    single = HaloPy('bad', base_url=stub.url, cache=0, cache_backend='memory', rate=(100, 1))
+    for x in range(2):
+        with pytest.raises(HaloPyError):
+            single.get_weapons()
+    assert single.keys.stats()['bad']['state'] == 'active'
+
+
+def test_keys_throttled_quarantined(stub):
+    stub.routes['metadata/h5/metadata/weapons'] = by_key({'hot': 429})
+    # The hot key refills fast enough to be picked again after its backoff
+    pool = KeyPool([('hot', TokenBucket((1000, 1))), ('cold', TokenBucket((5, 0.05)))],
+                   quarantine_after=2)
+    for key in pool.keys:
+        key.throttle.backoff = 0.001
+    api = HaloPy(pool, base_url=stub.url, cache=0, cache_backend='memory', rate_timeout=None)
+    for x in range(20):
+        assert api.meta_request('weapons')['Key'] == 'cold'
+    stats = api.keys.stats()
+    assert stats['hot']['state'] == 'quarantined'
+    assert stats['hot']['throttled'] == 2
+    assert stats['cold']['requests'] == 20
+    assert api.keys.active() == [pool.keys[1]]
+    with pytest.raises(ValueError):
+        KeyPool([])
+
+
+def test_keys_priority():
+    pool = KeyPool(['k1', 'k2'], rate=(1, 60), priority=True)
+    for key in pool.keys:
+        key.limiter.reset(0)
+    order = []
+
+    def run(level, name):
+        with scheduler.priority(level):
+            order.append((name, pool.acquire(timeout=5)))
+    threads = []
+    for level, name in (('background', 'b0'), ('background', 'b1'), ('interactive', 'i0')):
+        queued = sum(s['queued'] for s in pool.scheduler.stats().values())
+        threads.append(threading.Thread(target=run, args=(level, name)))
+        threads[-1].start()
+        deadline = time.time() + 5
+        while (sum(s['queued'] for s in pool.scheduler.stats().values()) == queued and
+               time.time() < deadline):
+            time.sleep(0.001)
+    pool.rate = (1, 0.05)
+    for thread in threads:
+        thread.join(5)
+    assert [name for name, _ in order] == ['i0', 'b0', 'b1']
+    assert all(key in pool.keys for _, key in order)
+    assert pool.scheduler.stats()['background']['served'] == 2
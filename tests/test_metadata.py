@@ -0,0 +1,93 @@
+# coding=utf-8
+"""
+
+HaloPy metadata index tests
+
+"""
+from __future__ import unicode_literals
+
+import pytest
+
+from halopy import HaloPyError
+from halopy.metadata import LISTINGS, MetadataIndex
+
+MEDALS = [{'id': 1, 'name': 'Double Kill'}, {'id': 2, 'name': 'Headshot'}]
+WEAPONS = [{'id': '100', 'name': 'Magnum'}]
+MAPS = [{'id': 'map-1', 'name': 'Truth'}]
+
+MATCH = {
+    'MapId': 'MAP-1',
+    'GameVariant': {'ResourceId': 'gv-1'},
+    'PlayerStats': [{
+        'MedalAwards': [{'MedalId': 1, 'Count': 2}, {'MedalId': 99, 'Count': 1}],
+        'WeaponStats': [{'WeaponId': {'StockId': 100}}],
+    }],
+}
+
+
+def serve(stub):
+    stub.routes['metadata/h5/metadata/medals'] = MEDALS
+    stub.routes['metadata/h5/metadata/weapons'] = WEAPONS
+    stub.routes['metadata/h5/metadata/maps'] = MAPS
+    stub.routes['metadata/h5/metadata/game-variants/gv-1'] = {'id': 'gv-1', 'name': 'Slayer'}
+
+
+def test_index_lookups():
+    index = MetadataIndex({'medals': MEDALS, 'weapons': WEAPONS})
+    assert index.get('medals', 2)['name'] == 'Headshot'
+    assert index.get('medals', '2')['name'] == 'Headshot'
+    assert index.get('weapons', 100)['name'] == 'Magnum'
+    assert index.by_name('medals', 'double kill')['id'] == 1
+    assert index.get('medals', 3) is None
+    assert index.get('skulls', 1) is None
+    assert index.kinds == ['medals', 'weapons']
+
+
+def test_load_refresh_and_fetch(metadata_stub, api):
+    stub = metadata_stub
+    serve(stub)
+    index = MetadataIndex.load(api)
+    assert len(stub.requests) == len(LISTINGS)
+    assert index.get('maps', 'map-1')['name'] == 'Truth'
+
+    weapons = index._by_id['weapons']
+    stub.routes['metadata/h5/metadata/medals'] = MEDALS + [{'id': 3, 'name': 'Killjoy'}]
+    assert index.refresh(api) == ['medals']
+    assert index._by_id['weapons'] is weapons
+    assert index.by_name('medals', 'killjoy')['id'] == 3
+
+    assert index.fetch(api, 'game-variants', 'gv-1')['name'] == 'Slayer'
+    requests = len(stub.requests)
+    assert index.fetch(api, 'game-variants', 'GV-1')['name'] == 'Slayer'
+    assert len(stub.requests) == requests
+
+
+def test_resolve_without_network(metadata_stub, api):
+    stub = metadata_stub
+    serve(stub)
+    index = MetadataIndex.load(api)
+    index.add('game-variants', {'id': 'gv-1', 'name': 'Slayer'})
+    requests = len(stub.requests)
+    resolved = index.resolve(MATCH)
+    assert len(stub.requests) == requests
+    assert resolved.MapId == 'MAP-1'
+    assert resolved.Metadata['Map']['name'] == 'Truth'
+    assert resolved.Metadata['GameVariant']['name'] == 'Slayer'
+    assert resolved.Metadata['Medals'] == {1: MEDALS[0]}
+    assert resolved.Metadata['Weapons'] == {100: WEAPONS[0]}
+    assert 'Metadata' not in MATCH
+
+
+def test_save_and_open(tmpdir):
+    path = str(tmpdir.join('metadata.json'))
+    index = MetadataIndex({'medals': MEDALS})
+    index.add('requisitions', {'id': 'req', 'name': '10 REQ Points'})
+    index.save(path)
+    reopened = MetadataIndex.open(path)
+    assert reopened.get('medals', 1)['name'] == 'Double Kill'
+    assert reopened.by_name('requisitions', '10 req points')['id'] == 'req'
+
+    with open(path, 'w') as f:
+        f.write('{"format": 0}')
+    with pytest.raises(HaloPyError):
+        MetadataIndex.open(path)
@@ -0,0 +1,67 @@
+# coding=utf-8
+"""
+
+HaloPy model tests
+
+"""
+from __future__ import unicode_literals
+
+import pickle
+
+import pytest
+
+from halopy import HaloPyResult
+from halopy.models import (MatchSummary, MedalAward, PlayerMatchStats, ServiceRecord,
+                           medal_awards, player_stats)
+
+SUMMARY = {
+    'Id': {'MatchId': 'abc', 'GameMode': 1},
+    'MapId': 'map', 'IsTeamGame': True, 'MatchDuration': 'PT10M',
+    'MatchCompletedDate': {'ISO8601Date': '2016-01-01T00:00:00Z'},
+}
+
+PLAYER = {
+    'Player': {'Gamertag': 'someone'}, 'TeamId': 1, 'Rank': 2, 'DNF': False,
+    'TotalKills': 10, 'TotalDeaths': 5, 'TotalWeaponDamage': 1234.5,
+    'MedalAwards': [{'MedalId': 123, 'Count': 2}],
+}
+
+
+def test_model_round_trip():
+    summary = MatchSummary.from_result(HaloPyResult(SUMMARY))
+    assert summary.match_id == 'abc'
+    assert summary.game_mode == 1
+    assert summary.is_team_game is True
+    assert summary.hopper_id is None
+    assert summary.to_dict() == SUMMARY
+    assert summary.to_result().MapId == 'map'
+    assert MatchSummary.from_dict(summary.to_dict()) == summary
+
+
+def test_model_is_slotted():
+    stats = PlayerMatchStats(gamertag='someone', kills=1)
+    assert not hasattr(stats, '__dict__')
+    with pytest.raises(AttributeError):
+        stats.foo = 1
+    with pytest.raises(TypeError):
+        PlayerMatchStats(foo=1)
+    assert pickle.loads(pickle.dumps(stats)) == stats
+    assert repr(MedalAward(1, 2)) == 'MedalAward(medal_id=1, count=2)'
+
+
+def test_player_stats_and_medals():
+    match = HaloPyResult({'PlayerStats': [PLAYER, dict(PLAYER, TotalKills='3')]})
+    players = player_stats(match)
+    assert [p.kills for p in players] == [10, 3]
+    assert players[0].weapon_damage == 1234.5 and players[0].gamertag == 'someone'
+    assert medal_awards(PLAYER) == [MedalAward(123, 2)]
+
+
+def test_service_record_stats_block():
+    record = {'Id': 'someone', 'ResultCode': 0,
+              'Result': {'SpartanRank': 40, 'Xp': 1000,
+                         'WarzoneStat': {'TotalKills': 7, 'TotalGamesWon': 2}}}
+    model = ServiceRecord.from_result(HaloPyResult(record))
+    assert model.stats_key == 'WarzoneStat'
+    assert (model.kills, model.games_won, model.xp) == (7, 2, 1000)
+    assert model.to_dict() == record
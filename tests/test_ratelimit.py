@@ -0,0 +1,291 @@
+# coding=utf-8
+"""
+
+HaloPy rate limiter tests
+
+"""
+from __future__ import unicode_literals
+
+import multiprocessing
+import os
+import threading
+import time
+
+import pytest
+
+from halopy import HaloPy, HaloPyError
+from halopy.ratelimit import AdaptiveThrottle, FileTokenBucket, RedisTokenBucket, TokenBucket
+
+
+def test_bucket_fail_fast():
+    bucket = TokenBucket((2, 10))
+    assert bucket.acquire(blocking=False)
+    assert bucket.acquire(blocking=False)
+    assert not bucket.acquire(blocking=False)
+    assert bucket.available() < 1
+
+
+def test_bucket_timeout():
+    bucket = TokenBucket((1, 10))
+    bucket.acquire()
+    start = time.time()
+    assert not bucket.acquire(timeout=0.1)
+    assert 0.09 <= time.time() - start < 1
+
+
+def test_bucket_blocks_until_refill():
+    bucket = TokenBucket((10, 1))
+    bucket.reset(0)
+    start = time.time()
+    assert bucket.acquire()
+    assert 0.08 <= time.time() - start < 0.5
+
+
+def test_bucket_threads_share_budget():
+    bucket = TokenBucket((5, 0.5))
+    bucket.reset(0)
+    stamps = []
+
+    def worker():
+        for x in range(5):
+            bucket.acquire()
+            stamps.append(time.time())
+    start = time.time()
+    threads = [threading.Thread(target=worker) for x in range(4)]
+    for t in threads:
+        t.start()
+    for t in threads:
+        t.join()
+    # 20 tokens at 10/s from an empty bucket
+    assert len(stamps) == 20
+    assert 1.8 <= max(stamps) - start < 2.5
+
+
+def test_bucket_refund_and_rate():
+    bucket = TokenBucket((1, 10))
+    bucket.acquire()
+    bucket.refund()
+    assert bucket.acquire(blocking=False)
+    with pytest.raises(ValueError):
+        bucket.rate = '1,1'
+    bucket.rate = (100, 1)
+    assert bucket.acquire(timeout=0.1)
+
+
+def test_request_modes(stub, make_api):
+    stub.routes['metadata/h5/metadata/maps'] = []
+    api = make_api(rate=(1, 0.2))
+    api.get_maps()
+    with pytest.raises(HaloPyError):
+        api.get_maps()
+    api.rate_timeout = None
+    api.get_maps()
+    api.rate_timeout = 0.05
+    with pytest.raises(HaloPyError):
+        api.get_maps()
+    assert len(stub.requests) == 2
+
+
+def test_shared_limiter(stub, make_api):
+    stub.routes['metadata/h5/metadata/maps'] = []
+    bucket = TokenBucket((2, 10))
+    apis = [make_api(rate_limiter=bucket) for x in range(2)]
+    apis[0].get_maps()
+    apis[1].get_maps()
+    assert not apis[0].can_request()
+    with pytest.raises(HaloPyError):
+        apis[1].get_maps()
+
+
+def _drain_file_bucket(path, count):
+    bucket = FileTokenBucket(path, (20, 1))
+    for x in range(count):
+        bucket.acquire()
+    bucket.close()
+
+
+def test_file_bucket_across_processes(tmpdir):
+    path = str(tmpdir.join('bucket'))
+    FileTokenBucket(path, (20, 1)).reset(0)
+    start = time.time()
+    procs = [multiprocessing.Process(target=_drain_file_bucket, args=(path, 5))
+             for x in range(3)]
+    for p in procs:
+        p.start()
+    for p in procs:
+        p.join()
+    # 15 tokens at 20/s from an empty bucket
+    assert 0.7 <= time.time() - start < 2
+    assert all(p.exitcode == 0 for p in procs)
+
+
+def test_file_bucket_state(tmpdir):
+    path = str(tmpdir.join('bucket'))
+    first = FileTokenBucket(path, (2, 10))
+    second = FileTokenBucket(path, (2, 10))
+    assert first.acquire(blocking=False)
+    assert second.acquire(blocking=False)
+    assert not first.acquire(blocking=False)
+    second.refund()
+    assert first.acquire(blocking=False)
+    first.reset()
+    assert second.available() == pytest.approx(2, abs=0.1)
+
+
+def redis_clients():
+    try:
+        import fakeredis
+    except ImportError:
+        pass
+    else:
+        # Runs the bucket script with a real Lua interpreter (lupa)
+        yield fakeredis.FakeStrictRedis()
+    url = os.getenv('HALOPY_REDIS_URL')
+    if url:
+        import redis
+        yield redis.StrictRedis.from_url(url)
+
+
+clients = list(redis_clients())
+needs_redis = pytest.mark.skipif(not clients, reason='needs fakeredis or HALOPY_REDIS_URL')
+
+
+@needs_redis
+@pytest.mark.parametrize('client', clients)
+def test_redis_bucket(client):
+    client.delete('halopy:test')
+    first = RedisTokenBucket(client, (2, 0.2), key='halopy:test')
+    second = RedisTokenBucket(client, (2, 0.2), key='halopy:test')
+    assert first.acquire(blocking=False)
+    assert second.acquire(blocking=False)
+    assert not second.acquire(blocking=False)
+    assert first.available() < 1
+    start = time.time()
+    assert second.acquire()
+    assert 0.05 <= time.time() - start < 0.5
+    first.reset()
+    assert second.available() == pytest.approx(2, abs=0.1)
+
+
+@needs_redis
+@pytest.mark.parametrize('client', clients)
+def test_redis_bucket_penalty_outlives_expiry(client):
+    client.delete('halopy:test')
+    bucket = RedisTokenBucket(client, (10, 10), key='halopy:test')
+    assert client.pttl('halopy:test') < 0
+    bucket.penalize(60)
+    assert bucket.available() == pytest.approx(-60, abs=0.1)
+    # Kept until refilled from -60 tokens at 1/s, then for another period
+    assert 79000 < client.pttl('halopy:test') <= 80000
+    bucket.reset()
+    assert 0 < client.pttl('halopy:test') <= 10000
+
+
+@needs_redis
+def test_redis_bucket_with_client(stub, make_api):
+    stub.routes['metadata/h5/metadata/maps'] = []
+    client = clients[0]
+    client.delete('halopy:ratelimit')
+    apis = [make_api(rate_limiter=RedisTokenBucket(client, (1, 10))) for x in range(2)]
+    apis[0].get_maps()
+    with pytest.raises(HaloPyError):
+        apis[1].get_maps()
+    assert float(client.hget('halopy:ratelimit', 'tokens')) < 1
+
+
+def throttling_route(failures, headers):
+    calls = []
+
+    def route(handler):
+        calls.append(time.time())
+        if len(calls) <= failures:
+            return 429, headers, {'statusCode': 429}
+        return 200, {}, []
+    return route, calls
+
+
+def test_retry_after(stub, make_api):
+    route, calls = throttling_route(2, {'Retry-After': '0.2'})
+    stub.routes['metadata/h5/metadata/maps'] = route
+    api = make_api(rate_timeout=None)
+    api._throttle.backoff = 0.01
+    api.get_maps()
+    assert len(calls) == 3
+    assert calls[1] - calls[0] >= 0.2
+    assert calls[2] - calls[1] >= 0.2
+    # halved twice, then a success wins back 5%
+    assert api._throttle.factor == pytest.approx(0.3)
+    assert api.limiter.rate[1] == pytest.approx(1 / 0.3)
+    assert api.rate == (100, 1)
+    for x in range(20):
+        api.get_maps()
+    assert api._throttle.factor == 1.0
+    assert api.limiter.rate == (100, 1)
+
+
+def test_throttle_gives_up(stub, make_api):
+    route, calls = throttling_route(10, {})
+    stub.routes['metadata/h5/metadata/maps'] = route
+    api = make_api(rate_timeout=None, throttle_retries=1)
+    api._throttle.backoff = 0.01
+    with pytest.raises(HaloPyError):
+        api.get_maps()
+    assert len(calls) == 2
+    assert not api.can_request()
+
+
+@pytest.mark.parametrize('rate_timeout', [0, 0.3])
+def test_throttle_retries_within_rate_timeout(stub, make_api, rate_timeout):
+    route, calls = throttling_route(10, {'Retry-After': '5'})
+    stub.routes['metadata/h5/metadata/maps'] = route
+    api = make_api(rate_timeout=rate_timeout)
+    start = time.time()
+    with pytest.raises(HaloPyError) as excinfo:
+        api.get_maps()
+    assert str(excinfo.value) == HaloPy._err_429
+    assert time.time() - start < rate_timeout + 0.5
+    assert len(calls) == 1
+
+
+def test_quota_headers(stub, make_api):
+    stub.routes['metadata/h5/metadata/maps'] = lambda handler: (
+        200, {'X-RateLimit-Remaining': '3'}, [])
+    api = make_api(rate=(10, 10))
+    api.get_maps()
+    assert api.limiter.available() == pytest.approx(3, abs=0.1)
+    stub.routes['metadata/h5/metadata/maps'] = lambda handler: (
+        200, {'X-RateLimit-Remaining': '0', 'X-RateLimit-Reset': '5'}, [])
+    api.get_maps()
+    assert api.limiter.available() < -4
+
+
+def test_retry_after_date():
+    class Response(object):
+        headers = {'Retry-After': 'Wed, 21 Oct 2015 07:28:00 GMT'}
+    assert AdaptiveThrottle.retry_after(Response()) == 0
+    Response.headers = {}
+    assert AdaptiveThrottle.retry_after(Response()) is None
+
+
+def test_throttle_observe():
+    class Response(object):
+        status_code = 200
+        headers = {'X-RateLimit-Remaining': '0', 'X-RateLimit-Reset': str(time.time() + 3)}
+    throttle = AdaptiveThrottle(TokenBucket((1, 1)), max_backoff=10)
+    throttle.observe(Response())
+    assert throttle.limiter.available() == pytest.approx(-3, abs=0.2)
+
+    Response.headers = {'X-RateLimit-Remaining': '0', 'X-RateLimit-Reset': str(time.time() + 3600)}
+    throttle.limiter.reset()
+    throttle.observe(Response())
+    assert throttle.limiter.available() == pytest.approx(-10, abs=0.2)
+
+    throttle.rate = (1, 1)
+    throttle._scale(0.5)
+    Response.status_code = 500
+    Response.headers = {}
+    throttle.observe(Response())
+    assert throttle.factor == 0.5
+    Response.status_code = 200
+    throttle.observe(Response())
+    assert throttle.factor == pytest.approx(0.55)
@@ -0,0 +1,69 @@
+# coding=utf-8
+"""
+
+HaloPyResult tests
+
+"""
+from __future__ import unicode_literals
+
+import copy
+import pickle
+import threading
+import time
+
+import pytest
+
+import halopy
+
+from halopy import HaloPyResult
+
+
+def test_lazy_result():
+    hpyo = HaloPyResult(raw=b'{"foo": "bar", "Result": {"team": "blue"}}')
+    assert '_wrap' not in hpyo.__dict__
+    assert hpyo.foo == 'bar'
+    assert hpyo.team == 'blue'
+    assert '_raw' not in hpyo.__dict__
+    with pytest.raises(AttributeError):
+        hpyo.bar
+
+
+def test_lazy_result_copies():
+    hpyo = HaloPyResult(raw=b'{"foo": [1, 2]}')
+    assert pickle.loads(pickle.dumps(hpyo)).foo == [1, 2]
+    assert copy.copy(hpyo).foo == [1, 2]
+
+
+def test_single_results_are_lazy(stub, make_api):
+    stub.routes['stats/h5/arena/matches/abc'] = {'IsMatchOver': True, 'PlayerStats': []}
+    api = make_api(cache=60)
+    first = api.get_arena_match_by_id('abc')
+    second = api.get_arena_match_by_id('abc')
+    # Both results share the cached body until they are decoded
+    assert first._raw is second._raw
+    assert first.IsMatchOver is True
+
+
+def test_lazy_result_threads(monkeypatch):
+    def slow_loads(raw):
+        time.sleep(0.05)
+        return loads(raw)
+    loads = halopy.json_loads
+    monkeypatch.setattr(halopy, 'json_loads', slow_loads)
+
+    hpyo = HaloPyResult(raw=b'{"foo": "bar"}')
+    seen, errors = [], []
+
+    def read():
+        try:
+            seen.append((hpyo.foo, hpyo._wrap))
+        except Exception as ex:
+            errors.append(ex)
+    threads = [threading.Thread(target=read) for x in range(8)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    assert not errors
+    assert len(seen) == 8
+    assert all(foo == 'bar' and wrap is seen[0][1] for foo, wrap in seen)
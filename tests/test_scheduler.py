@@ -0,0 +1,101 @@
+# coding=utf-8
+"""
+
+HaloPy priority scheduler tests
+
+"""
+from __future__ import unicode_literals
+
+import threading
+import time
+
+import pytest
+
+from halopy import HaloPy, PriorityScheduler, TokenBucket
+from halopy import scheduler
+
+
+def queue(sched, order, level, tenant, name):
+    def run():
+        with scheduler.priority(level, tenant):
+            sched.acquire()
+        order.append(name)
+    queued = lambda: sum(s['queued'] for s in sched.stats().values())
+    before = queued()
+    thread = threading.Thread(target=run)
+    thread.daemon = True
+    thread.start()
+    deadline = time.time() + 5
+    while queued() == before and time.time() < deadline:
+        time.sleep(0.001)
+    return thread
+
+
+def drain(sched, threads, rate=(1, 0.02)):
+    sched.rate = rate
+    for thread in threads:
+        thread.join(5)
+
+
+def test_scheduler_priority_order():
+    sched = PriorityScheduler(TokenBucket((1, 60)))
+    sched.reset(0)
+    order = []
+    threads = [queue(sched, order, 'background', None, 'b{0}'.format(x)) for x in range(3)]
+    threads += [queue(sched, order, 'interactive', None, 'i{0}'.format(x)) for x in range(2)]
+    drain(sched, threads)
+    assert order == ['i0', 'i1', 'b0', 'b1', 'b2']
+    stats = sched.stats()
+    assert stats['background']['served'] == 3
+    assert stats['interactive']['queued'] == 0
+    assert stats['interactive']['max_wait'] < stats['background']['max_wait']
+
+
+def test_scheduler_tenants_take_turns():
+    sched = PriorityScheduler(TokenBucket((1, 60)))
+    sched.reset(0)
+    order = []
+    threads = [queue(sched, order, 'default', 'a', 'a{0}'.format(x)) for x in range(3)]
+    threads += [queue(sched, order, 'default', 'b', 'b0')]
+    assert sched.stats()['default']['tenants'] == 2
+    drain(sched, threads)
+    assert order == ['a0', 'b0', 'a1', 'a2']
+
+
+def test_scheduler_timeouts():
+    sched = PriorityScheduler(TokenBucket((2, 60)))
+    assert sched.acquire(False)
+    assert sched.acquire(timeout=0.05)
+    assert not sched.acquire(False)
+    assert not sched.acquire(timeout=0.05)
+    assert sched.stats()['default']['timeouts'] == 2
+    with pytest.raises(ValueError):
+        with scheduler.priority('urgent'):
+            pass
+
+
+def test_scheduler_interactive_skips_background_queue():
+    sched = PriorityScheduler(TokenBucket((1, 60)))
+    sched.reset(0)
+    order = []
+    threads = [queue(sched, order, 'background', None, 'b0')]
+    # Refunded behind the scheduler's back, the queued caller is still asleep
+    sched.limiter.refund()
+    with scheduler.priority('interactive'):
+        assert sched.acquire(False)
+    drain(sched, threads)
+    assert order == ['b0']
+
+
+def test_priority_carried_to_bulk_workers():
+    api = HaloPy('key', cache=0, cache_backend='memory',
+                 rate_limiter=PriorityScheduler(TokenBucket((10, 1))))
+    seen = []
+    with api.priority('background', 'crawler'):
+        fetch = api._waiting(scheduler.current)
+    thread = threading.Thread(target=lambda: seen.append(fetch()))
+    thread.start()
+    thread.join()
+    assert seen == [('background', 'crawler')]
+    assert scheduler.current() == ('default', None)
+    assert api.rate == (10, 1)
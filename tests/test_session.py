@@ -0,0 +1,42 @@
+# coding=utf-8
+"""
+
+HaloPy HTTP session tests
+
+"""
+from __future__ import unicode_literals
+
+
+def test_session_reuses_connections(stub, make_api):
+    stub.routes['metadata/h5/metadata/weapons'] = [{'id': '1', 'name': 'Magnum'}]
+    with make_api() as api:
+        for x in range(5):
+            assert api.get_weapons()[0].name == 'Magnum'
+    assert len(stub.requests) == 5
+    assert len(stub.connections) == 1
+
+
+def test_session_without_keep_alive(stub, make_api):
+    stub.routes['metadata/h5/metadata/weapons'] = []
+    with make_api(keep_alive=False) as api:
+        for x in range(3):
+            api.get_weapons()
+    assert len(stub.connections) == 3
+
+
+def test_session_pool_settings(stub, make_api):
+    api = make_api(pool_connections=2, pool_maxsize=4, max_retries=3)
+    adapter = api._session.get_adapter(stub.url)
+    assert adapter._pool_maxsize == 4
+    assert adapter.max_retries.total == 3
+    api.close()
+
+
+def test_api_key_header(stub, make_api):
+    stub.routes['metadata/h5/metadata/maps'] = []
+    with make_api() as api:
+        api.get_maps()
+        api.request('metadata/h5/metadata/maps',
+                    headers={'Ocp-Apim-Subscription-Key': 'other'})
+    assert stub.requests[0][1]['Ocp-Apim-Subscription-Key'] == 'key'
+    assert stub.requests[1][1]['Ocp-Apim-Subscription-Key'] == 'other'
@@ -0,0 +1,104 @@
+# coding=utf-8
+"""
+
+HaloPy record/replay and stub server tests
+
+"""
+from __future__ import unicode_literals
+
+import time
+
+import pytest
+import requests
+
+from halopy import HaloPy, HaloPyError
+from halopy.stub import Cassette, StubServer, record, replay, request_key
+
+WEAPONS = [{'id': '1', 'name': 'Magnum'}]
+
+
+def test_record_replay(stub, make_api, tmpdir):
+    path = str(tmpdir.join('h5.jsonl'))
+    stub.routes['metadata/h5/metadata/weapons'] = WEAPONS
+    stub.routes['profile/h5/profiles/alpha/emblem'] = lambda handler: (
+        200, {'Content-Type': 'image/png', 'ETag': '"e1"'}, b'\x89PNG\x00')
+    api = make_api()
+    record(api, path)
+    api.get_weapons()
+    api.get_player_emblem('alpha', 95)
+    api.close()
+
+    cassette = Cassette(path)
+    assert cassette.keys() == ['metadata/h5/metadata/weapons?',
+                               'profile/h5/profiles/alpha/emblem?size=95']
+    assert 'Content-Length' not in cassette.get(cassette.keys()[0])[1]
+
+    offline = HaloPy('other', cache=0, cache_backend='memory', rate=(100, 1))
+    replay(offline, path)
+    assert [w.name for w in offline.get_weapons()] == ['Magnum']
+    emblem = offline.get_player_emblem('alpha', 95)
+    assert emblem.content == b'\x89PNG\x00'
+    assert emblem.headers['etag'] == '"e1"'
+    with pytest.raises(requests.ConnectionError):
+        offline.get_maps()
+    assert len(stub.requests) == 2
+
+
+def test_cassette_appends(tmpdir):
+    path = tmpdir.join('h5.jsonl')
+    cassette = Cassette(str(path))
+    for body in (b'[1]', b'[2]'):
+        cassette.add('metadata/h5/metadata/maps?', 200, {}, body, append=True)
+    assert len(path.readlines()) == 2
+    assert Cassette(str(path)).get('metadata/h5/metadata/maps?')[2] == b'[2]'
+    cassette.save()
+    assert len(path.readlines()) == 1
+
+
+def test_stub_serves_cassette():
+    cassette = Cassette()
+    cassette.add(request_key('/metadata/h5/metadata/maps'), 200,
+                 {'Content-Type': 'application/json'}, b'[{"id": "m"}]')
+    with StubServer(cassette, rate=(2, 60)) as server:
+        api = HaloPy('key', base_url=server.url, cache=0, cache_backend='memory',
+                     rate=(100, 1), throttle_retries=0)
+        assert api.get_maps()[0].id == 'm'
+        assert api.get_maps()[0].id == 'm'
+        with pytest.raises(HaloPyError):
+            api.get_maps()
+        with pytest.raises(HaloPyError):
+            api.get_weapons()
+        other = HaloPy('other', base_url=server.url, cache=0, cache_backend='memory')
+        assert other.get_maps()[0].id == 'm'
+        assert server.responses == {200: 3, 429: 1}
+
+
+def statuses(seed):
+    with StubServer(error_rate=0.3, jitter=0.002, seed=seed) as server:
+        server.routes['metadata/h5/metadata/maps'] = []
+        api = HaloPy('key', base_url=server.url, cache=0, cache_backend='memory',
+                     rate=(100, 1))
+        result = []
+        for x in range(30):
+            try:
+                api.get_maps()
+                result.append(200)
+            except HaloPyError:
+                result.append(500)
+        return result
+
+
+def test_stub_errors_seeded():
+    first = statuses(1)
+    assert 0 < first.count(500) < 30
+    assert statuses(1) == first
+    assert statuses(2) != first
+
+
+def test_stub_latency():
+    with StubServer(latency=0.05) as server:
+        server.routes['metadata/h5/metadata/maps'] = []
+        api = HaloPy('key', base_url=server.url, cache=0, cache_backend='memory')
+        start = time.time()
+        api.get_maps()
+        assert time.time() - start >= 0.05